@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from logs import configure_logging
+from parsing import (
+    EXTRACTION_WORKERS, GEMINI_MAX_CONCURRENCY, PARSE_MODE, extract_pages_and_tables, extraction_context, parse_pdf,
+)
+from ratelimit import BATCH
+
+logger = logging.getLogger(__name__)
+
+# Documents parsed at once; their Gemini calls all share the process-wide scheduler
+BATCH_DOCUMENTS = int(os.getenv("BATCH_DOCUMENTS", "8"))
+
+PARSED = "parsed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# --- Inputs and Outputs ---
+
+def find_pdfs(inputs: List[str]) -> List[str]:
+    """PDF paths named directly or found (non-recursively) in the given directories, without duplicates"""
+    found: List[str] = []
+    seen = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.lower().endswith(".pdf"))
+            candidates = [os.path.join(path, name) for name in names]
+        elif os.path.isfile(path):
+            candidates = [path]
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+        for candidate in candidates:
+            real = os.path.realpath(candidate)
+            if real not in seen:
+                seen.add(real)
+                found.append(candidate)
+    return found
+
+def output_path(pdf_path: str, output_dir: str) -> str:
+    """<output_dir>/<PDF name>.json"""
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(pdf_path))[0] + ".json")
+
+def is_up_to_date(pdf_path: str, out_path: str) -> bool:
+    """Whether the output was written after the PDF last changed"""
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(pdf_path)
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """
+    Write JSON to a temporary file next to `path`, then rename it over
+    `path`, so an interrupted run never leaves a truncated output behind
+    (which would then look up to date).
+    """
+    write_text_atomic(path, json.dumps(data, indent=2, ensure_ascii=False))
+
+def write_text_atomic(path: str, text: str) -> None:
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            out.write(text)
+            out.flush()
+            os.fsync(out.fileno())
+        # mkstemp creates the file owner-only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# --- Batch Run ---
+
+def extract_document(pdf_path: str) -> Tuple[List[dict], Dict[str, float]]:
+    """
+    Runs in the extraction pool: pages of the whole PDF, plus the stage
+    timings, which would be lost if recorded in the worker process.
+    """
+    timings: Dict[str, float] = {}
+    return extract_pages_and_tables(pdf_path, 1, timings=timings), timings
+
+def parse_document(pdf_path: str, out_path: str, extractor: ProcessPoolExecutor, mode: str,
+                   max_concurrency: int) -> Dict[str, Any]:
+    """
+    Extract one PDF in the shared process pool, parse it with batch priority
+    and write its document JSON. Results with failed or incomplete chunks are
+    not written, so the next run tries them again (completed chunks come from
+    the cache).
+    """
+    start = time.monotonic()
+    try:
+        pages, timings = extractor.submit(extract_document, pdf_path).result()
+        metrics.observe_stages(timings)
+        logger.info("pages extracted", extra={"pdf": pdf_path, "pages": len(pages)})
+        result = parse_pdf(pdf_path, mode=mode, max_concurrency=max_concurrency, priority=BATCH, pages=pages)
+    except Exception as e:
+        result = {"success": False, "data": None, "error": f"Error processing PDF: {str(e)}"}
+
+    entry = {"pdf": pdf_path, "output": out_path, "seconds": round(time.monotonic() - start, 2)}
+    meta = result.get("meta") or {}
+    failed_chunks = meta.get("failed_chunks") or []
+    incomplete_chunks = meta.get("incomplete_chunks") or []
+    if not result.get("success"):
+        return {**entry, "status": FAILED, "error": result.get("error")}
+    if failed_chunks or incomplete_chunks:
+        return {**entry, "status": FAILED,
+                "error": f"{len(failed_chunks)} chunk(s) failed, {len(incomplete_chunks)} incomplete",
+                "failed_chunks": failed_chunks, "incomplete_chunks": incomplete_chunks}
+    try:
+        write_json_atomic(out_path, result["data"])
+    except OSError as e:
+        return {**entry, "status": FAILED, "error": f"Error writing output: {str(e)}"}
+    return {**entry, "status": PARSED}
+
+def run_batch(inputs: List[str], output_dir: str, mode: str = PARSE_MODE, workers: int = EXTRACTION_WORKERS,
+              documents: int = BATCH_DOCUMENTS, max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+              force: bool = False) -> List[Dict[str, Any]]:
+    """
+    Parse every PDF in `inputs` (files or directories) into `output_dir`.
+    Pages are extracted whole-document-per-task in one pool of `workers`
+    processes; up to `documents` PDFs are parsed at once, and their Gemini
+    calls are paced and shared out by the process-wide scheduler. PDFs
+    whose output is newer than the PDF are skipped unless `force`.
+    Returns one entry per PDF, in input order.
+    """
+    pdfs = find_pdfs(inputs)
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = [output_path(pdf, output_dir) for pdf in pdfs]
+    clashes = sorted({out for out in outputs if outputs.count(out) > 1})
+    if clashes:
+        raise ValueError(f"Several PDFs would be written to: {', '.join(clashes)}")
+
+    entries: List[Optional[Dict[str, Any]]] = [None] * len(pdfs)
+    pending = []
+    for i, (pdf, out) in enumerate(zip(pdfs, outputs)):
+        if not force and is_up_to_date(pdf, out):
+            entries[i] = {"pdf": pdf, "output": out, "status": SKIPPED}
+        else:
+            pending.append(i)
+    logger.info("batch started", extra={"pdfs": len(pdfs), "up_to_date": len(pdfs) - len(pending),
+                                        "to_parse": len(pending)})
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=extraction_context()) as extractor, \
+                ThreadPoolExecutor(max_workers=max(1, documents), thread_name_prefix="batch") as parser:
+            futures = {
+                parser.submit(parse_document, pdfs[i], outputs[i], extractor, mode, max_concurrency): i
+                for i in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                entry = future.result()
+                entries[futures[future]] = entry
+                fields = {"done": done, "total": len(pending), "pdf": entry["pdf"], "seconds": entry["seconds"]}
+                if entry["status"] == FAILED:
+                    logger.warning("PDF failed", extra={**fields, "error": entry["error"]})
+                else:
+                    logger.info("PDF parsed", extra=fields)
+    return entries
+
+# --- Command Line ---
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Parse MasterFormat PDFs into JSON files in bulk.")
+    parser.add_argument("inputs", nargs="+", help="PDF files and/or directories containing PDFs")
+    parser.add_argument("-o", "--output-dir", default="json_outputs", help="where <PDF name>.json files are written")
+    parser.add_argument("--mode", choices=("rules", "llm"), default=PARSE_MODE, help="parsing engine")
+    parser.add_argument("--workers", type=int, default=EXTRACTION_WORKERS, help="page extraction processes")
+    parser.add_argument("--documents", type=int, default=BATCH_DOCUMENTS, help="PDFs parsed at once")
+    parser.add_argument("--concurrency", type=int, default=GEMINI_MAX_CONCURRENCY,
+                        help="Gemini requests in flight per PDF")
+    parser.add_argument("--force", action="store_true", help="re-parse PDFs whose output is up to date")
+    parser.add_argument("--metrics-file", help="write the run's metrics here in the Prometheus text format")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    try:
+        entries = run_batch(args.inputs, args.output_dir, mode=args.mode, workers=args.workers,
+                            documents=args.documents, max_concurrency=args.concurrency, force=args.force)
+    except (FileNotFoundError, ValueError) as e:
+        logger.error("batch not started", extra={"error": str(e)})
+        return 2
+
+    counts = {status: sum(entry["status"] == status for entry in entries) for status in (PARSED, SKIPPED, FAILED)}
+    logger.info("batch finished", extra=counts)
+    for entry in entries:
+        if entry["status"] == FAILED:
+            logger.warning("PDF not written", extra={"pdf": entry["pdf"], "error": entry["error"]})
+    if args.metrics_file:
+        write_text_atomic(args.metrics_file, metrics.render())
+    return 1 if counts[FAILED] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional
+
+# Location and size limit of the on-disk result cache
+PARSE_CACHE_PATH = os.getenv(
+    "PARSE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "parse_cache.sqlite3"),
+)
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "256"))
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# --- Cache Keys ---
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's bytes, read in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def document_key(pdf_hash: str, **params) -> str:
+    """
+    Key for a whole-document result: the PDF content hash plus every
+    pipeline parameter that changes the output (chunk size, model, ...).
+    """
+    payload = json.dumps({"pdf": pdf_hash, **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def chunk_key(prompt: str, model_name: str, schema: Optional[dict] = None) -> str:
+    """Key for a single LLM response: hash of the model name, response schema (if any) and prompt text"""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    if schema is not None:
+        digest.update(json.dumps(schema, sort_keys=True).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+# --- SQLite Store ---
+
+class ResultCache:
+    """
+    Persistent JSON cache backed by a single SQLite file.
+    Entries are grouped by namespace ("document", "chunk") and evicted
+    least-recently-used first once the total stored size exceeds max_bytes.
+    """
+
+    def __init__(self, path: str = PARSE_CACHE_PATH, max_bytes: int = int(PARSE_CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries (last_access)")
+        self._conn.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Return the cached value, or None on a miss. A hit refreshes its LRU position."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (time.time(), namespace, key),
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        """Store a JSON-serializable value and evict old entries if over the size limit"""
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, data, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self) -> None:
+        """Drop least-recently-used entries until the store fits in max_bytes (lock held)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        for namespace, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+
+# --- Process-wide Instance ---
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[ResultCache]:
+    """Shared cache for this process, or None when caching is disabled"""
+    global _cache
+    if not PARSE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
@@ -0,0 +1,159 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, Any, List, Set, Tuple
+
+from masterformat import SECTION_RE, PART_RE, ARTICLE_RE, iter_lines, normalize_line, is_structural
+
+# Top and bottom share of the page height where running headers and footers sit
+FURNITURE_MARGIN = float(os.getenv("FURNITURE_MARGIN", "0.12"))
+# Share of pages a margin block must repeat on to count as a running header or footer
+FURNITURE_MIN_SHARE = float(os.getenv("FURNITURE_MIN_SHARE", "0.5"))
+
+# "7", "- 7 -", "Page 7", "PAGE 7 OF 30", "7/30"
+PAGE_NUMBER_RE = re.compile(r"^(?:page\s*)?[-–]?\s*\d+\s*[-–]?(?:\s*(?:of|/)\s*\d+)?$", re.IGNORECASE)
+
+# --- Block Classification ---
+
+def block_key(text: str) -> Tuple[str, ...]:
+    """
+    Digit-masked lines of a block, sorted: the same footer matches across pages
+    even when its page number changes or PyMuPDF orders its lines differently.
+    """
+    return tuple(sorted(normalize_line(line) for line in text.splitlines() if line.strip()))
+
+def in_margin(block: dict, height: float, margin: float = FURNITURE_MARGIN) -> bool:
+    """Block centre lies in the top or bottom margin band of the page"""
+    center = (block["bbox"][1] + block["bbox"][3]) / 2
+    return center <= height * margin or center >= height * (1 - margin)
+
+def is_page_number(text: str) -> bool:
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return bool(lines) and all(PAGE_NUMBER_RE.match(line) for line in lines)
+
+def has_spec_heading(text: str) -> bool:
+    """Page text contains a SECTION, PART or article heading"""
+    return any(
+        SECTION_RE.match(line) or PART_RE.match(line) or ARTICLE_RE.match(line)
+        for _, line in iter_lines(text)
+    )
+
+def find_furniture(pages: List[dict], margin: float = FURNITURE_MARGIN,
+                   min_share: float = FURNITURE_MIN_SHARE) -> List[Set[int]]:
+    """
+    Indices of the header/footer blocks on each page: margin blocks that repeat
+    (digits masked) on at least `min_share` of the pages, and lone page numbers.
+    Blocks holding PART/article headings or paragraph markers are never furniture.
+    """
+    candidates: List[List[Tuple[int, Tuple[str, ...]]]] = []
+    counts: Counter = Counter()
+    for page in pages:
+        page_candidates = []
+        for i, block in enumerate(page.get("blocks", [])):
+            text = page["text"][block["start"]:block["end"]]
+            key = block_key(text)
+            if not key or not in_margin(block, page["height"], margin):
+                continue
+            if any(is_structural(line) for line in text.splitlines() if line.strip()):
+                continue
+            page_candidates.append((i, key))
+        candidates.append(page_candidates)
+        counts.update({key for _, key in page_candidates})
+
+    threshold = max(2, int(len(pages) * min_share + 0.5))
+    furniture: List[Set[int]] = []
+    for page, page_candidates in zip(pages, candidates):
+        drop = set()
+        for i, key in page_candidates:
+            block = page["blocks"][i]
+            if (len(pages) > 1 and counts[key] >= threshold) or is_page_number(page["text"][block["start"]:block["end"]]):
+                drop.add(i)
+        furniture.append(drop)
+    return furniture
+
+# --- Stripping ---
+
+def remove_spans(page: dict, spans: List[Tuple[int, int]]) -> int:
+    """
+    Cut character spans out of a page's text, moving table positions and
+    block spans to match. Returns the number of characters removed.
+    """
+    if not spans:
+        return 0
+    spans = sorted(spans)
+    text = page["text"]
+
+    def shift(pos: int) -> int:
+        removed = 0
+        for start, end in spans:
+            if start >= pos:
+                break
+            removed += min(end, pos) - start
+        return pos - removed
+
+    kept = []
+    cursor = 0
+    for start, end in spans:
+        kept.append(text[cursor:start])
+        cursor = max(cursor, end)
+    kept.append(text[cursor:])
+    new_text = "".join(kept)
+    for tbl in page.get("tables", []):
+        if "position" in tbl:
+            tbl["position"] = shift(tbl["position"])
+    page["blocks"] = [
+        {**block, "start": shift(block["start"]), "end": shift(block["end"])}
+        for block in page.get("blocks", [])
+        if (block["start"], block["end"]) not in spans
+    ]
+    page["text"] = new_text
+    return len(text) - len(new_text)
+
+def strip_furniture(pages: List[dict]) -> Dict[str, Any]:
+    """
+    Remove running headers, footers, page numbers and leading cover pages from
+    extracted pages, in place, before chunking. A cover page is a leading page
+    with no SECTION/PART/article heading once its furniture is gone, in a
+    document where a later page has one. A repeated header that is the only
+    place the SECTION number appears is kept on its first non-cover page.
+    Returns {"chars_removed", "blocks_removed", "cover_pages"}.
+    """
+    furniture = find_furniture(pages)
+
+    def body_text(page: dict, drop: Set[int]) -> str:
+        spans = sorted((b["start"], b["end"]) for i, b in enumerate(page.get("blocks", [])) if i in drop)
+        pieces, cursor = [], 0
+        for start, end in spans:
+            pieces.append(page["text"][cursor:start])
+            cursor = max(cursor, end)
+        pieces.append(page["text"][cursor:])
+        return "".join(pieces)
+
+    bodies = [body_text(page, drop) for page, drop in zip(pages, furniture)]
+    cover_pages = 0
+    if any(has_spec_heading(body) for body in bodies):
+        while cover_pages < len(pages) - 1 and not has_spec_heading(bodies[cover_pages]):
+            cover_pages += 1
+
+    section_in_body = any(
+        SECTION_RE.match(line) for body in bodies[cover_pages:] for _, line in iter_lines(body)
+    )
+    chars_removed = 0
+    blocks_removed = 0
+    for page_num, (page, drop) in enumerate(zip(pages, furniture)):
+        if page_num < cover_pages:
+            chars_removed += len(page["text"])
+            blocks_removed += len(page.get("blocks", []))
+            page.update(text="", tables=[], blocks=[])
+            continue
+        if not section_in_body:
+            for i in sorted(drop):
+                block = page["blocks"][i]
+                if any(SECTION_RE.match(line) for _, line in iter_lines(page["text"][block["start"]:block["end"]])):
+                    drop.discard(i)
+                    section_in_body = True
+                    break
+        spans = [(page["blocks"][i]["start"], page["blocks"][i]["end"]) for i in drop]
+        chars_removed += remove_spans(page, spans)
+        blocks_removed += len(drop)
+    return {"chars_removed": chars_removed, "blocks_removed": blocks_removed, "cover_pages": cover_pages}
@@ -0,0 +1,257 @@
+import copy
+import re
+import time
+import difflib
+import hashlib
+import logging
+import fitz  # PyMuPDF
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from retry import ParseReport
+from ratelimit import INTERACTIVE
+from metrics import DOCUMENT_SECONDS, DOCUMENTS
+from masterformat import find_boundaries, find_section_header, index_sort_key
+from parsing import (
+    PARSE_MODE, STRIP_PAGE_FURNITURE, ChunkCallback, ItemCallback, extract_page, extract_page_text,
+    slice_page, furniture_savings, remove_page_furniture, rules_document, llm_document, parse_pdf,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Version Fingerprints ---
+
+def page_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def item_key(part: int, index: Optional[str]) -> str:
+    """Key for a top-level item: part plus its index numbers, so "2.1" and "2.01" match"""
+    numbers = re.findall(r"\d+", index or "")
+    return f"{part}:{'.'.join(str(int(n)) for n in numbers) if numbers else index}"
+
+def article_spans(pages: List[dict]) -> Dict[str, List[int]]:
+    """
+    Inclusive page span of every article, keyed by item_key. An article runs
+    from its heading to the page of the next PART or article heading.
+    """
+    boundaries = find_boundaries(pages)
+    spans = {}
+    for i, boundary in enumerate(boundaries):
+        if boundary["kind"] != "article":
+            continue
+        end = boundaries[i + 1]["page"] if i + 1 < len(boundaries) else len(pages) - 1
+        spans[item_key(boundary["part"], boundary["index"])] = [boundary["page"], end]
+    return spans
+
+def preceding_articles(pages: List[dict]) -> Dict[str, int]:
+    """
+    Number of the article before each article in its part (0 for a part's
+    first article), keyed by item_key: where a cut-out article's numbering resumes.
+    """
+    preceding: Dict[str, int] = {}
+    last: Dict[int, int] = {}
+    for boundary in find_boundaries(pages):
+        if boundary["kind"] == "article":
+            preceding[item_key(boundary["part"], boundary["index"])] = last.get(boundary["part"], 0)
+            last[boundary["part"]] = int(boundary["index"].split(".")[1])
+    return preceding
+
+def page_ranges(page_nums: Set[int]) -> List[Tuple[int, int]]:
+    """Inclusive runs of consecutive page numbers"""
+    ranges: List[Tuple[int, int]] = []
+    for page_num in sorted(page_nums):
+        if ranges and page_num == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], page_num)
+        else:
+            ranges.append((page_num, page_num))
+    return ranges
+
+# --- Incremental Re-parse ---
+
+def is_complete(result: Dict[str, Any]) -> bool:
+    """Whether a parse result has every chunk in full (see ParseReport.meta)"""
+    meta = result.get("meta") or {}
+    return not meta.get("failed_chunks") and not meta.get("incomplete_chunks")
+
+def parse_pdf_incremental(pdf_path: str, previous: Optional[Dict[str, Any]] = None,
+                          mode: str = PARSE_MODE, **kwargs) -> Dict[str, Any]:
+    """
+    Parse a revision of a previously parsed PDF. `previous` is the earlier
+    parse result, including the "version" fingerprint this function attaches
+    to every result: {"page_hashes": [...], "spans": {item key: [first, last]}}.
+
+    Page texts are fingerprinted with a cheap text-only pass and diffed against
+    the previous version. Only the articles on changed pages are extracted
+    (with tables) and parsed again, and they replace their old versions in a
+    copy of the previous tree. Without a usable previous version (one with
+    failed or incomplete chunks is not, so their content is not carried
+    forward), or when the change can't be pinned to articles, the whole
+    document is parsed.
+    """
+    start = time.perf_counter()
+    try:
+        with fitz.open(pdf_path) as doc:
+            light = [extract_page_text(page) for page in doc]
+            version = {"page_hashes": [page_hash(page["text"]) for page in light], "spans": article_spans(light)}
+            result = None
+            if previous and previous.get("success") and previous.get("version") and previous.get("data") \
+                    and is_complete(previous):
+                result = reparse_changes(doc, light, version, previous, mode, **kwargs)
+        if result is not None:
+            DOCUMENT_SECONDS.observe(time.perf_counter() - start, mode="incremental")
+            DOCUMENTS.inc(mode="incremental", outcome="success" if result.get("success") else "failure")
+    except Exception as e:
+        logger.exception("incremental parsing failed")
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Error processing PDF: {str(e)}"
+        }
+
+    if result is None:
+        result = parse_pdf(pdf_path, mode=mode, **kwargs)
+    if result.get("success"):
+        result = {**result, "version": version}
+    return result
+
+def reparse_changes(doc, light: List[dict], version: Dict[str, Any], previous: Dict[str, Any],
+                    mode: str, on_chunk: Optional[ChunkCallback] = None, on_item: Optional[ItemCallback] = None,
+                    priority: str = INTERACTIVE, **kwargs) -> Optional[Dict[str, Any]]:
+    """Patch the previous tree with re-parsed articles; None means parse the whole document"""
+    old_hashes = previous["version"]["page_hashes"]
+    old_spans = previous["version"]["spans"]
+    new_hashes = version["page_hashes"]
+    new_spans = version["spans"]
+    if not new_spans:
+        return None
+
+    changed_old: Set[int] = set()
+    changed_new: Set[int] = set()
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            changed_old.update(range(i1, i2))
+            changed_new.update(range(j1, j2))
+    if not changed_old and not changed_new:
+        logger.info("no page changes since the previous version")
+        return {"success": True, "data": copy.deepcopy(previous["data"]), "error": None,
+                "meta": ParseReport().meta()}
+
+    # Changes outside every article span (other than the preamble) can't be patched
+    first_article = min(start for start, _ in new_spans.values())
+    covered = {p for start, end in new_spans.values() for p in range(start, end + 1)}
+    old_first = min((start for start, _ in old_spans.values()), default=0)
+    old_covered = {p for start, end in old_spans.values() for p in range(start, end + 1)}
+    if any(p > first_article and p not in covered for p in changed_new) or \
+            any(p > old_first and p not in old_covered for p in changed_old):
+        return None
+
+    affected = {key for key, (start, end) in old_spans.items() if changed_old.intersection(range(start, end + 1))}
+    affected |= {key for key, (start, end) in new_spans.items() if changed_new.intersection(range(start, end + 1))}
+    reparse_pages = {p for key in affected if key in new_spans for p in range(new_spans[key][0], new_spans[key][1] + 1)}
+    if len(reparse_pages) == len(light):
+        return None
+    logger.info("re-parsing changed articles", extra={
+        "pages_changed_or_removed": len(changed_old), "pages_changed_or_added": len(changed_new),
+        "articles": len(affected), "reparse_pages": len(reparse_pages), "pages": len(light),
+    })
+
+    # Full extraction for the pages being re-parsed; the text-only pages give
+    # the header/footer detector the rest of the document to compare against
+    pages = list(light)
+    for page_num in reparse_pages:
+        pages[page_num] = extract_page(doc[page_num])
+    if STRIP_PAGE_FURNITURE:
+        remove_page_furniture(pages)
+
+    boundaries = find_boundaries(light)
+    part_titles = {b["part"]: b["title"] for b in boundaries if b["kind"] == "part"}
+    preceding = preceding_articles(light)
+    runs = []
+    for start, end in page_ranges(reparse_pages):
+        range_runs = cut_articles(pages[start:end + 1], affected, part_titles, preceding)
+        if not range_runs:
+            return None
+        runs.extend(range_runs)
+
+    new_items: Dict[str, Dict[str, Any]] = {}
+    chunks_reported = 0
+    report = ParseReport(priority=priority)
+    report.furniture_removed(**furniture_savings(pages))
+    for sub_pages, last_articles in runs:
+        run_total = [0]
+
+        def relay(idx: int, total: int, chunk_json: Dict[str, Any], offset: int = chunks_reported) -> None:
+            run_total[0] = total
+            if on_chunk:
+                on_chunk(offset + idx, offset + total, chunk_json)
+
+        item_relay = (lambda idx, chunk_json, offset=chunks_reported: on_item(offset + idx, chunk_json)) if on_item else None
+
+        if mode == "llm":
+            document, _ = llm_document(sub_pages, on_chunk=relay, on_item=item_relay, report=report, **kwargs)
+        else:
+            document = rules_document(sub_pages, on_chunk=relay, on_item=item_relay, report=report,
+                                      last_articles=last_articles, **kwargs)
+        chunks_reported += run_total[0]
+        for n in (1, 2, 3):
+            for item in document[f"part{n}"]["partItems"]:
+                key = item_key(n, item.get("index"))
+                if key in affected:
+                    new_items[key] = item
+
+    # An article still in the document that came back under no affected key
+    # (e.g. renumbered by the LLM) keeps its previous version rather than vanishing
+    kept = {key for key in affected if key in new_spans and key not in new_items}
+    if kept:
+        logger.warning("keeping previous version of re-parsed articles", extra={"articles": sorted(kept)})
+
+    data = copy.deepcopy(previous["data"])
+    for n in (1, 2, 3):
+        part = data.setdefault(f"part{n}", {"partItems": []})
+        items = [item for item in part["partItems"]
+                 if item_key(n, item.get("index")) not in affected or item_key(n, item.get("index")) in kept]
+        items.extend(item for key, item in new_items.items() if key.startswith(f"{n}:"))
+        items.sort(key=lambda item: index_sort_key(item.get("index")))
+        part["partItems"] = items
+
+    if any(p <= first_article for p in changed_new):
+        # The section heading may have changed too
+        section, name = find_section_header(light)
+        if section:
+            data["section"], data["name"] = section, name
+    return {"success": True, "data": data, "error": None, "meta": report.meta()}
+
+def cut_articles(pages: List[dict], affected: Set[str], part_titles: Dict[int, str],
+                 preceding: Optional[Dict[str, int]] = None) -> List[Tuple[List[dict], Dict[int, int]]]:
+    """
+    Text of the affected articles within a page range, one page list per run of
+    consecutive affected articles: cut from the run's first heading to the next
+    unaffected one, behind a PART heading line so the parsers file the articles
+    under the right part. Each run comes with the article number its part's
+    numbering resumes from (from `preceding`, see preceding_articles), so the
+    rules parser does not take the cut for a gap in the numbering.
+    """
+    preceding = preceding or {}
+    boundaries = [b for b in find_boundaries(pages) if b["kind"] == "article"]
+    runs = []
+    i = 0
+    while i < len(boundaries):
+        if item_key(boundaries[i]["part"], boundaries[i]["index"]) not in affected:
+            i += 1
+            continue
+        start = boundaries[i]
+        while i < len(boundaries) and item_key(boundaries[i]["part"], boundaries[i]["index"]) in affected:
+            i += 1
+        end = boundaries[i] if i < len(boundaries) else None
+        fragments = []
+        last_page = end["page"] if end else len(pages) - 1
+        for page_num in range(start["page"], last_page + 1):
+            frag_start = start["offset"] if page_num == start["page"] else 0
+            frag_end = end["offset"] if end and page_num == end["page"] else None
+            fragment = slice_page(pages[page_num], frag_start, frag_end)
+            if fragment["text"].strip() or fragment["tables"]:
+                fragments.append(fragment)
+        heading = part_titles.get(start["part"], f"PART {start['part']}")
+        resumes = preceding.get(item_key(start["part"], start["index"]), 0)
+        runs.append(([{"text": heading, "tables": []}] + fragments, {start["part"]: resumes}))
+    return runs
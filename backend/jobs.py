@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from parsing import INLINE_TABLES, ChunkCallback, ItemCallback
+from merge import TreeMerger
+from incremental import parse_pdf_incremental
+from ratelimit import INTERACTIVE
+
+# Where job records and pending uploads are kept, and how many parses run at once
+JOBS_DIR = os.getenv(
+    "JOBS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs"),
+)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# --- Persistent Job Store ---
+
+class JobStore:
+    """
+    SQLite table of parse jobs: status, per-chunk progress and final result.
+    Survives restarts so queued/running jobs can be resumed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                upload_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def create(self, filename: str, upload_path: str, job_id: Optional[str] = None) -> str:
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        progress = json.dumps({"chunks_total": 0, "chunks_done": 0, "chunks": []})
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, upload_path, status, progress, result, error, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?, ?)",
+                (job_id, filename, upload_path, QUEUED, progress, now, now),
+            )
+            self._conn.commit()
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        """Update status/progress/result/error; dict values are stored as JSON"""
+        columns = []
+        values = []
+        for name, value in fields.items():
+            if name in ("progress", "result") and value is not None:
+                value = json.dumps(value, ensure_ascii=False)
+            columns.append(f"{name} = ?")
+            values.append(value)
+        columns.append("updated_at = ?")
+        values.append(time.time())
+        values.append(job_id)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {', '.join(columns)} WHERE id = ?", values)
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, upload_path, status, progress, result, error, created_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "filename": row[1],
+            "upload_path": row[2],
+            "status": row[3],
+            "progress": json.loads(row[4]),
+            "result": json.loads(row[5]) if row[5] else None,
+            "error": row[6],
+            "created_at": row[7],
+            "updated_at": row[8],
+        }
+
+    def unfinished(self) -> list:
+        """Ids of jobs that were queued or running when the process last stopped"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+# --- Worker Pool ---
+
+class JobManager:
+    """
+    Runs parse jobs on a background thread pool so request handlers return
+    immediately. Progress is written to the JobStore as each chunk finishes.
+    """
+
+    def __init__(self, jobs_dir: str = JOBS_DIR, workers: int = JOB_WORKERS):
+        self.upload_dir = os.path.join(jobs_dir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.store = JobStore(os.path.join(jobs_dir, "jobs.sqlite3"))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse-job")
+        self._futures: Dict[str, Future] = {}
+        self._listeners: Dict[str, ChunkCallback] = {}
+        self._item_listeners: Dict[str, ItemCallback] = {}
+        # Job whose result a job is an incremental revision of (kept in memory; a resumed job parses in full)
+        self._previous: Dict[str, str] = {}
+        # Scheduling priority of each job's LLM calls (in memory too; a resumed job runs interactive)
+        self._priorities: Dict[str, str] = {}
+        # Chunk results of running jobs, folded as they arrive for partial views
+        self._partials: Dict[str, TreeMerger] = {}
+        self._lock = threading.Lock()
+
+    def new_upload_path(self) -> str:
+        """Path where the next upload should be written before calling submit()"""
+        return os.path.join(self.upload_dir, f"{uuid.uuid4().hex}.pdf")
+
+    def submit(self, upload_path: str, filename: str, on_chunk: Optional[ChunkCallback] = None,
+               previous_job_id: Optional[str] = None, on_item: Optional[ItemCallback] = None,
+               priority: str = INTERACTIVE) -> str:
+        """
+        Queue a job; `on_chunk` additionally receives each chunk's JSON as it
+        finishes, and `on_item` each item while its chunk is generating. With
+        `previous_job_id`, the upload is parsed as a revision of that job's
+        document and only changed pages are re-parsed. `priority` is how its
+        LLM calls are scheduled against other jobs' (see ratelimit.py).
+        """
+        job_id = self.store.create(filename, upload_path)
+        with self._lock:
+            if on_chunk:
+                self._listeners[job_id] = on_chunk
+            if on_item:
+                self._item_listeners[job_id] = on_item
+            if previous_job_id:
+                self._previous[job_id] = previous_job_id
+            self._priorities[job_id] = priority
+        self._enqueue(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(job_id)
+
+    def partial(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Document merged from the chunks a running job has finished so far"""
+        with self._lock:
+            merger = self._partials.get(job_id)
+        return merger.snapshot(inline_tables=INLINE_TABLES) if merger is not None else None
+
+    def future(self, job_id: str) -> Optional[Future]:
+        """Future resolving to the job's final parse result, if it runs in this process"""
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def resume(self) -> int:
+        """Re-queue jobs left unfinished by a previous run; returns how many were resumed"""
+        resumed = 0
+        for job_id in self.store.unfinished():
+            job = self.store.get(job_id)
+            if not os.path.exists(job["upload_path"]):
+                self.store.update(job_id, status=FAILED, error="Upload was lost before the job could run")
+                continue
+            self.store.update(job_id, status=QUEUED)
+            self._enqueue(job_id)
+            resumed += 1
+        return resumed
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _enqueue(self, job_id: str) -> None:
+        future = self._executor.submit(self._run, job_id)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._forget(job_id))
+
+    def _forget(self, job_id: str) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._listeners.pop(job_id, None)
+            self._item_listeners.pop(job_id, None)
+            self._previous.pop(job_id, None)
+            self._priorities.pop(job_id, None)
+            self._partials.pop(job_id, None)
+
+    def _run(self, job_id: str) -> Dict[str, Any]:
+        job = self.store.get(job_id)
+        self.store.update(job_id, status=RUNNING)
+        progress = {"chunks_total": 0, "chunks_done": 0, "chunks": []}
+        progress_lock = threading.Lock()
+        with self._lock:
+            listener = self._listeners.get(job_id)
+            item_listener = self._item_listeners.get(job_id)
+            previous_job_id = self._previous.get(job_id)
+            priority = self._priorities.get(job_id, INTERACTIVE)
+        previous_job = self.store.get(previous_job_id) if previous_job_id else None
+        merger = TreeMerger()
+        with self._lock:
+            self._partials[job_id] = merger
+
+        def on_chunk(idx: int, total: int, chunk_json: Dict[str, Any]) -> None:
+            with progress_lock:
+                if total > progress["chunks_total"]:
+                    progress["chunks"].extend(["pending"] * (total - progress["chunks_total"]))
+                    progress["chunks_total"] = total
+                progress["chunks"][idx] = "done"
+                progress["chunks_done"] += 1
+                self.store.update(job_id, progress=progress)
+            merger.add(chunk_json, order=idx)
+            if listener:
+                listener(idx, total, chunk_json)
+
+        def on_item(idx: int, chunk_json: Dict[str, Any]) -> None:
+            # Shows up in the partial view before its chunk is done
+            merger.add(chunk_json, order=idx)
+            if item_listener:
+                item_listener(idx, chunk_json)
+
+        try:
+            previous = previous_job["result"] if previous_job else None
+            result = parse_pdf_incremental(job["upload_path"], previous=previous, on_chunk=on_chunk,
+                                           on_item=on_item, priority=priority)
+        except Exception as e:
+            result = {"success": False, "data": None, "error": f"Error processing PDF: {str(e)}"}
+        status = COMPLETED if result.get("success") else FAILED
+        self.store.update(job_id, status=status, result=result, error=result.get("error"))
+        if os.path.exists(job["upload_path"]):
+            os.remove(job["upload_path"])
+        return result
+
+# --- Process-wide Instance ---
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
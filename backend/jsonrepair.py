@@ -0,0 +1,294 @@
+import re
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Outside strings: whitespace, then a structural character or a run of bare-value characters
+TOKEN_RE = re.compile(r'\s*(?:([{}\[\]",:])|([^{}\[\]",:\s]+))')
+# Inside strings: the closing quote or the start of an escape
+STRING_SPECIAL_RE = re.compile(r'["\\]')
+# A bare value that is complete as it stands
+LITERAL_RE = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null")
+# An escape cut off by the end of the response
+PARTIAL_ESCAPE_RE = re.compile(r"(?<!\\)(?:\\\\)*(\\(?:u[0-9a-fA-F]{0,3})?)$")
+
+CLOSERS = {"{": "}", "[": "]"}
+# Tolerates raw control characters (e.g. newlines) inside strings
+DECODER = json.JSONDecoder(strict=False)
+
+# --- Incremental Extractor ---
+
+# Called as on_item(path, item) with the keys leading to the item's array, e.g. ("part2", "partItems")
+ItemCallback = Callable[[Tuple[str, ...], Any], None]
+
+class JSONExtractor:
+    """
+    Pulls the first JSON object out of an LLM response in one pass, fed in
+    fragments as they stream in. Text around the object (prose, ``` fences)
+    is skipped, trailing commas are dropped and mismatched closers repaired,
+    all outside string literals only. A response cut off mid-object is
+    completed by text(): the open string is closed, a dangling key or
+    partial literal gets null, and open containers are closed.
+
+    Objects that close as elements of an `item_key` array are decoded and
+    passed to `on_item` right away, and the text up to the last valid one is
+    kept as a checkpoint that text(checkpoint=True) can fall back to.
+
+    Runs of ordinary characters are skipped with regex matches, so the
+    Python-level work is per token, not per character.
+    """
+
+    def __init__(self, on_item: Optional[ItemCallback] = None, item_key: str = "partItems"):
+        self.on_item = on_item
+        self.item_key = item_key
+        self.pieces: List[str] = []
+        # Per open container: its closer, its current key (objects) and where its text starts
+        self.stack: List[str] = []
+        self.keys: List[Optional[str]] = []
+        self.starts: List[int] = []
+        self.checkpoint: Optional[Tuple[int, List[str]]] = None
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.string_is_key = False
+        self.string_at = 0
+        self.escape = False
+        self.pending_comma = False
+        # Last significant token: "{", "[", ",", ":", "key", "value" or "literal"
+        self.last = ""
+        self.literal = ""
+        self.literal_from = ""
+        self.literal_at = 0
+        self.repairs = 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether the root object has been closed by the response itself"""
+        return self.done
+
+    def feed(self, fragment: str) -> "JSONExtractor":
+        """Consume the next piece of the response"""
+        pos, end = 0, len(fragment)
+        if not self.started:
+            pos = fragment.find("{")
+            if pos == -1:
+                return self
+            self.started = True
+            self._open("{")
+            pos += 1
+        while pos < end and not self.done:
+            if self.in_string:
+                pos = self._scan_string(fragment, pos, end)
+            else:
+                pos = self._scan_structure(fragment, pos, end)
+        return self
+
+    def _scan_string(self, text: str, pos: int, end: int) -> int:
+        start = pos
+        if self.escape:
+            # The escaped character was cut off by the previous fragment
+            pos += 1
+            self.escape = False
+        while True:
+            match = STRING_SPECIAL_RE.search(text, pos)
+            if match is None:
+                self.pieces.append(text[start:end])
+                return end
+            if match.group() == "\\":
+                if match.end() == end:
+                    self.escape = True
+                    self.pieces.append(text[start:end])
+                    return end
+                pos = match.end() + 1
+                continue
+            self.pieces.append(text[start:match.end()])
+            self.in_string = False
+            if self.string_is_key:
+                self.keys[-1] = DECODER.decode("".join(self.pieces[self.string_at:]))
+                self.last = "key"
+            else:
+                self.last = "value"
+            return match.end()
+
+    def _scan_structure(self, text: str, pos: int, end: int) -> int:
+        match = TOKEN_RE.match(text, pos)
+        if match is None:
+            return end
+        char = match.group(1)
+        if char is None:
+            self._literal(match.group(2))
+        elif char == '"':
+            self._flush_comma()
+            self.string_is_key = self.stack[-1] == "}" and self.last in ("{", ",")
+            self.in_string = True
+            self.string_at = len(self.pieces)
+            self.pieces.append('"')
+        elif char in CLOSERS:
+            self._flush_comma()
+            self._open(char)
+        elif char in "}]":
+            self._close(char)
+        elif char == ",":
+            if self.last in ("value", "literal"):
+                self.pending_comma = True
+                self.last = ","
+            else:
+                self.repairs += 1
+        else:
+            self.pieces.append(":")
+            self.last = ":"
+        return match.end()
+
+    def _open(self, char: str) -> None:
+        self.stack.append(CLOSERS[char])
+        self.keys.append(None)
+        self.starts.append(len(self.pieces))
+        self.pieces.append(char)
+        self.last = char
+
+    def _literal(self, bare: str) -> None:
+        if self.last != "literal":
+            self.literal = ""
+            self.literal_from = self.last
+            self.literal_at = len(self.pieces)
+            self._flush_comma()
+        self.literal += bare
+        self.pieces.append(bare)
+        self.last = "literal"
+
+    def _flush_comma(self) -> None:
+        if self.pending_comma:
+            self.pieces.append(",")
+            self.pending_comma = False
+
+    def _close(self, char: str) -> None:
+        if self.pending_comma:
+            self.pending_comma = False
+            self.repairs += 1
+        if char not in self.stack:
+            # Stray closer: nothing open that it could close
+            self.repairs += 1
+            return
+        if self.last in ("key", ":") or (self.last == "literal" and not self._literal_ok()):
+            self._fill_value()
+        while self.stack:
+            closer = self.stack.pop()
+            self.keys.pop()
+            start = self.starts.pop()
+            self.pieces.append(closer)
+            if closer == char:
+                break
+            self.repairs += 1
+        self.last = "value"
+        if not self.stack:
+            self.done = True
+        elif char == "}" and self.stack[-1] == "]" and len(self.keys) > 1 and self.keys[-2] == self.item_key:
+            self._item(start)
+
+    def _item(self, start: int) -> None:
+        """An item object just closed at pieces[start:]"""
+        try:
+            item = DECODER.decode("".join(self.pieces[start:]))
+        except ValueError:
+            # Broken inside (e.g. a missing comma): neither reported nor a safe checkpoint
+            self.repairs += 1
+            return
+        self.checkpoint = (len(self.pieces), list(self.stack))
+        if self.on_item:
+            self.on_item(tuple(self.keys[:-1]), item)
+
+    def _literal_ok(self) -> bool:
+        return LITERAL_RE.fullmatch(self.literal) is not None
+
+    def _fill_value(self) -> None:
+        """Complete a member left without a usable value with null"""
+        if self.last == "literal":
+            del self.pieces[self.literal_at:]
+            self.last = self.literal_from
+        if self.last == "key":
+            self.pieces.append(":null")
+        elif self.last == ":":
+            self.pieces.append("null")
+        self.last = "value"
+        self.repairs += 1
+
+    def text(self, checkpoint: bool = False) -> str:
+        """
+        The JSON text extracted so far, completed into a valid document if
+        the response stopped early. With `checkpoint`, everything after the
+        last completed item is dropped instead. Raises ValueError if no
+        object started (or, with `checkpoint`, no item completed).
+        """
+        if not self.started:
+            raise ValueError("No JSON object found in response")
+        if checkpoint:
+            if self.checkpoint is None:
+                raise ValueError("No complete item in response")
+            length, stack = self.checkpoint
+            return "".join(self.pieces[:length]) + "".join(reversed(stack))
+        if self.done:
+            return "".join(self.pieces)
+        pieces = self.pieces
+        tail = []
+        last = self.last
+        if self.in_string:
+            current = "".join(pieces)
+            partial = PARTIAL_ESCAPE_RE.search(current)
+            pieces = [current[:partial.start(1)] if partial else current]
+            tail.append('"')
+            last = "key" if self.string_is_key else "value"
+        elif last == "literal" and not self._literal_ok():
+            pieces = pieces[:self.literal_at]
+            last = self.literal_from
+        if last == "key":
+            tail.append(":null")
+        elif last == ":":
+            tail.append("null")
+        tail.extend(reversed(self.stack))
+        return "".join(pieces) + "".join(tail)
+
+    def parse(self, checkpoint: bool = False) -> Any:
+        """Decode text(); control characters inside strings are tolerated"""
+        return DECODER.decode(self.text(checkpoint))
+
+# --- Runaway Output ---
+
+def repeating_tail(text: str, min_chars: int, max_unit: int = 200) -> bool:
+    """
+    Whether `text` ends with one unit of at most `max_unit` characters
+    repeated over at least `min_chars` characters: a generation stuck in a loop.
+    """
+    if min_chars <= 0 or len(text) < min_chars:
+        return False
+    window = text[-min_chars:]
+    if window.isspace():
+        return False
+    for unit in range(1, min(max_unit, min_chars // 3) + 1):
+        if window[unit:] == window[:-unit]:
+            return True
+    return False
+
+# --- One-shot Helpers ---
+
+def extract_json(text: str) -> str:
+    """JSON text of the first object in a complete response, repaired if needed"""
+    return JSONExtractor().feed(text or "").text()
+
+def parse_llm_json(text: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Decode the first object of a whole response, as (object, complete).
+    Well-formed responses are decoded directly; anything else goes through
+    JSONExtractor, and `complete` is False if the object had to be closed
+    for it. Raises ValueError if there is no object to recover.
+    """
+    text = text or ""
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("No JSON object found in response")
+    try:
+        result, complete = DECODER.raw_decode(text, start)[0], True
+    except ValueError:
+        extractor = JSONExtractor().feed(text[start:])
+        result, complete = extractor.parse(), extractor.complete
+    if not isinstance(result, dict):
+        raise ValueError("JSON response is not an object")
+    return result, complete
@@ -0,0 +1,286 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+import google.generativeai as genai
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Models to use, in order of preference; the first available one wins
+GEMINI_MODELS = [
+    name.strip()
+    for name in os.getenv("GEMINI_MODELS", "gemini-1.5-pro,gemini-1.5-pro-latest,gemini-pro").split(",")
+    if name.strip()
+]
+GEMINI_MODEL = GEMINI_MODELS[0]
+# How long the model availability list is trusted before asking the API again
+MODEL_CHECK_TTL = float(os.getenv("GEMINI_MODEL_CHECK_TTL", "3600"))
+
+# Backend selection: "gemini" (default) or "replay" for the local stand-in
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+# Directory of recorded responses; when set with the gemini backend, responses are recorded there
+LLM_RECORDINGS_DIR = os.getenv("LLM_RECORDINGS_DIR")
+LLM_REPLAY_LATENCY = float(os.getenv("LLM_REPLAY_LATENCY", "0"))
+LLM_REPLAY_JITTER = float(os.getenv("LLM_REPLAY_JITTER", "0"))
+LLM_REPLAY_FAILURE_RATE = float(os.getenv("LLM_REPLAY_FAILURE_RATE", "0"))
+LLM_REPLAY_SEED = os.getenv("LLM_REPLAY_SEED")
+# Size of the fragments the replay backend streams a recorded response in
+LLM_REPLAY_FRAGMENT_CHARS = int(os.getenv("LLM_REPLAY_FRAGMENT_CHARS", "256"))
+
+def prompt_hash(prompt: str) -> str:
+    """Key under which a prompt's recorded response is stored"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+# --- Backend Interface ---
+
+class LLMBackend:
+    """
+    What the chunk pipeline needs from an LLM: a model name (used in cache
+    keys), a readiness check, and prompt -> response text, whole or streamed.
+    With a `schema`, the response must be JSON matching it (structured output).
+    """
+
+    @property
+    def model_name(self) -> str:
+        raise NotImplementedError
+
+    def ensure_ready(self) -> None:
+        """Raise if the backend cannot serve requests (e.g. missing credentials)"""
+
+    def generate(self, prompt: str, model_name: Optional[str] = None,
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        raise NotImplementedError
+
+    def generate_stream(self, prompt: str, model_name: Optional[str] = None,
+                        schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        Response text in fragments as it is generated. Closing the iterator
+        early abandons the generation. Backends without streaming yield once.
+        """
+        yield self.generate(prompt, model_name, schema)
+
+# --- Long-lived Gemini Client ---
+
+class GeminiClient(LLMBackend):
+    """
+    One configured Gemini client per process. Model objects (and their
+    underlying connections) are reused across chunks and requests, and model
+    availability is looked up with list_models() and cached for MODEL_CHECK_TTL
+    seconds instead of probing with paid generations.
+    """
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, model_names: List[str] = GEMINI_MODELS,
+                 availability_ttl: float = MODEL_CHECK_TTL):
+        self.api_key = api_key
+        self.model_names = model_names
+        self.availability_ttl = availability_ttl
+        self._lock = threading.Lock()
+        self._configured = False
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._available: Optional[Set[str]] = None
+        self._checked_at = 0.0
+
+    def ensure_ready(self) -> None:
+        if not self.api_key:
+            raise Exception("GEMINI_API_KEY environment variable is not set")
+
+    def _configure(self) -> None:
+        if self._configured:
+            return
+        if not self.api_key:
+            raise Exception("GEMINI_API_KEY environment variable is not set")
+        genai.configure(api_key=self.api_key)
+        self._configured = True
+
+    def available_models(self, refresh: bool = False) -> Set[str]:
+        """Names of models that support generateContent (cached with a TTL)"""
+        with self._lock:
+            self._configure()
+            expired = time.monotonic() - self._checked_at > self.availability_ttl
+            if refresh or self._available is None or expired:
+                self._available = {
+                    m.name.split("/", 1)[-1]
+                    for m in genai.list_models()
+                    if "generateContent" in getattr(m, "supported_generation_methods", [])
+                }
+                self._checked_at = time.monotonic()
+            return self._available
+
+    @property
+    def model_name(self) -> str:
+        """First preferred model that is available, or the first preference if the check fails"""
+        try:
+            available = self.available_models()
+        except Exception as e:
+            logger.warning("could not check Gemini model availability", extra={"error": str(e)})
+            return self.model_names[0]
+        for name in self.model_names:
+            if name in available:
+                return name
+        raise Exception("No working Gemini model found")
+
+    def model(self, name: Optional[str] = None) -> genai.GenerativeModel:
+        name = name or self.model_name
+        with self._lock:
+            self._configure()
+            if name not in self._models:
+                self._models[name] = genai.GenerativeModel(name)
+            return self._models[name]
+
+    @staticmethod
+    def generation_config(schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """JSON mode constrained to `schema`, or the model defaults without one"""
+        if schema is None:
+            return None
+        return {"response_mime_type": "application/json", "response_schema": schema}
+
+    def generate(self, prompt: str, model_name: Optional[str] = None,
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        """Run one generation and return the response text"""
+        return self.model(model_name).generate_content(
+            prompt, generation_config=self.generation_config(schema)
+        ).text
+
+    def generate_stream(self, prompt: str, model_name: Optional[str] = None,
+                        schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Stream a generation; once the caller stops reading, the stream is dropped"""
+        response = self.model(model_name).generate_content(
+            prompt, generation_config=self.generation_config(schema), stream=True
+        )
+        for chunk in response:
+            # The last chunk may only carry the finish reason
+            if chunk.parts:
+                yield chunk.text
+
+# --- Local Stand-in Backends ---
+
+class ReplayBackend(LLMBackend):
+    """
+    Deterministic offline backend: returns responses recorded under
+    <recordings_dir>/<prompt_hash>.txt, after a simulated latency, and fails
+    a configurable fraction of calls. Used for load tests, benchmarks and CI.
+    """
+
+    def __init__(self, recordings_dir: str, latency: float = LLM_REPLAY_LATENCY, jitter: float = LLM_REPLAY_JITTER,
+                 failure_rate: float = LLM_REPLAY_FAILURE_RATE, seed: Optional[int] = None,
+                 model_name: str = "replay", fragment_chars: int = LLM_REPLAY_FRAGMENT_CHARS):
+        self.recordings_dir = recordings_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.fragment_chars = max(1, fragment_chars)
+        self._model_name = model_name
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def _draw(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.failure_rate
+        return delay, fail
+
+    def _recorded(self, prompt: str) -> str:
+        path = os.path.join(self.recordings_dir, f"{prompt_hash(prompt)}.txt")
+        if not os.path.exists(path):
+            raise Exception(f"No recorded response for prompt {prompt_hash(prompt)[:12]}")
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def generate(self, prompt: str, model_name: Optional[str] = None,
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        delay, fail = self._draw()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise Exception("Injected replay backend failure")
+        return self._recorded(prompt)
+
+    def generate_stream(self, prompt: str, model_name: Optional[str] = None,
+                        schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """The recorded response in fragment_chars pieces, with the latency spread across them"""
+        delay, fail = self._draw()
+        if fail:
+            time.sleep(delay)
+            raise Exception("Injected replay backend failure")
+        text = self._recorded(prompt)
+        fragments = [text[i:i + self.fragment_chars] for i in range(0, len(text), self.fragment_chars)] or [""]
+        for fragment in fragments:
+            if delay:
+                time.sleep(delay / len(fragments))
+            yield fragment
+
+class RecordingBackend(LLMBackend):
+    """Wraps another backend and saves every response for later replay"""
+
+    def __init__(self, backend: LLMBackend, recordings_dir: str):
+        self.backend = backend
+        self.recordings_dir = recordings_dir
+        os.makedirs(recordings_dir, exist_ok=True)
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    def ensure_ready(self) -> None:
+        self.backend.ensure_ready()
+
+    def generate(self, prompt: str, model_name: Optional[str] = None,
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        text = self.backend.generate(prompt, model_name, schema)
+        self._save(prompt, text)
+        return text
+
+    def generate_stream(self, prompt: str, model_name: Optional[str] = None,
+                        schema: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Relay the stream; only responses read to the end are recorded"""
+        fragments = []
+        for fragment in self.backend.generate_stream(prompt, model_name, schema):
+            fragments.append(fragment)
+            yield fragment
+        self._save(prompt, "".join(fragments))
+
+    def _save(self, prompt: str, text: str) -> None:
+        path = os.path.join(self.recordings_dir, f"{prompt_hash(prompt)}.txt")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+# --- Process-wide Instance ---
+
+_client: Optional[LLMBackend] = None
+_client_lock = threading.Lock()
+
+def create_llm_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    """Build the backend selected by LLM_BACKEND / LLM_RECORDINGS_DIR"""
+    if name == "replay":
+        if not LLM_RECORDINGS_DIR:
+            raise Exception("LLM_RECORDINGS_DIR must be set to use the replay backend")
+        seed = int(LLM_REPLAY_SEED) if LLM_REPLAY_SEED else None
+        return ReplayBackend(LLM_RECORDINGS_DIR, seed=seed)
+    if name != "gemini":
+        raise Exception(f"Unknown LLM backend: {name}")
+    if LLM_RECORDINGS_DIR:
+        return RecordingBackend(GeminiClient(), LLM_RECORDINGS_DIR)
+    return GeminiClient()
+
+def get_llm_client() -> LLMBackend:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_llm_backend()
+        return _client
+
+def set_llm_backend(backend: Optional[LLMBackend]) -> None:
+    """Swap the process-wide backend (None resets to the configured default)"""
+    global _client
+    with _client_lock:
+        _client = backend
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Lowest level logged (DEBUG includes per-chunk progress), and "text" (key=value) or "json" lines
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Attributes every LogRecord has; anything else was passed as extra={...}
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# --- Formatters ---
+# Log calls carry a short fixed message plus fields, e.g.
+#   logger.info("chunk finished", extra={"chunk": 3, "total": 12})
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in STANDARD_ATTRS}
+
+def format_field(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return json.dumps(text, ensure_ascii=False) if not text or any(c in text for c in ' "=\n') else text
+
+class KeyValueFormatter(logging.Formatter):
+    """2026-01-01 12:00:00,000 INFO parsing: chunk finished chunk=3 total=12"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{self.formatTime(record)} {record.levelname} {record.name}: {record.getMessage()}"
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={format_field(value)}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, then the fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# --- Setup ---
+
+_handler: Optional[logging.Handler] = None
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> None:
+    """Send log records to stderr in the configured format; safe to call more than once"""
+    global _handler
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(JSONFormatter() if fmt == "json" else KeyValueFormatter())
+    root.addHandler(_handler)
+    root.setLevel(level)
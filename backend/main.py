@@ -1,20 +1,52 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Any
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+import asyncio
+import json
+import logging
 import os
-import tempfile
-from parsing import parse_pdf_to_json_chunked  
+from logs import configure_logging
+from jobs import get_job_manager
+from parsing import discard_extraction_pool
+from ratelimit import INTERACTIVE, PRIORITIES
+from llm import get_llm_client
+from uploads import MAX_UPLOAD_BYTES, UPLOAD_OVERHEAD_BYTES, UploadReceiver, receive_upload, upload_too_large
+import metrics
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
-    print(f"✅ API key loaded from environment: {api_key[:20]}...")
+    logger.info("API key loaded from environment")
 else:
-    print("❌ API key not found in environment variables")
+    logger.error("API key not found in environment variables")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Check model availability once up front; the client caches it with a TTL
+    if api_key:
+        try:
+            model_name = await asyncio.to_thread(lambda: get_llm_client().model_name)
+            logger.info("using Gemini model", extra={"model": model_name})
+        except Exception as e:
+            logger.error("Gemini model check failed", extra={"error": str(e)})
+    # Pick up jobs that were still queued or running when the server last stopped
+    manager = get_job_manager()
+    resumed = manager.resume()
+    if resumed:
+        logger.info("resumed unfinished parse jobs", extra={"jobs": resumed})
+    yield
+    manager.shutdown()
+    discard_extraction_pool()
 
 app = FastAPI(
     title="MasterFormat PDF Parser",
     description="Backend API for parsing MasterFormat PDFs to structured JSON using Gemini LLM.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -25,28 +57,183 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/parse")
-async def parse_endpoint(file: UploadFile = File(...)) -> Any:
-    # Validate file type
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse an oversized upload from its Content-Length, before the body is read"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + UPLOAD_OVERHEAD_BYTES:
+        error = upload_too_large()
+        return JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+    return await call_next(request)
+
+# The endpoints read their multipart body themselves (see save_upload), so the form is described here
+def upload_form(**fields: dict) -> dict:
+    """openapi_extra documenting a multipart/form-data body with a "file" PDF and `fields`"""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["file"],
+        "properties": {"file": {"type": "string", "format": "binary"}, **fields},
+    }}}}}
+
+PREVIOUS_JOB_FIELD = {"type": "string", "description": "Job whose result this PDF revises"}
+PRIORITY_FIELD = {"type": "string", "enum": list(PRIORITIES), "default": INTERACTIVE}
+
+async def save_upload(request: Request) -> UploadReceiver:
+    """
+    Stream the uploaded PDF straight to where the job workers read it,
+    refusing it with 413 once it passes MAX_UPLOAD_BYTES. The body is never
+    spooled or held in memory whole. Returns the receiver, which holds the
+    file's path and name and the other form fields.
+    """
+    return await receive_upload(request, get_job_manager().new_upload_path())
+
+def discard_upload(upload: UploadReceiver) -> None:
+    if os.path.exists(upload.upload_path):
+        os.remove(upload.upload_path)
+
+def check_previous_job(previous_job_id: Optional[str]) -> None:
+    """A revision can only be parsed against a job that finished successfully"""
+    if not previous_job_id:
+        return
+    job = get_job_manager().get(previous_job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Previous job not found.")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail="Previous job has not completed.")
+
+def check_priority(priority: str) -> None:
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Priority must be one of: {', '.join(PRIORITIES)}.")
+
+def job_response(job: dict) -> dict:
+    """Public view of a job record; running jobs include the document parsed so far"""
+    return {
+        "job_id": job["job_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "partial": get_job_manager().partial(job["job_id"]) if job["status"] == "running" else None,
+        "result": job["result"],
+        "error": job["error"],
+    }
 
-    # Save uploaded file to a temporary location
+@app.post("/jobs", status_code=202,
+          openapi_extra=upload_form(previous_job_id=PREVIOUS_JOB_FIELD, priority=PRIORITY_FIELD))
+async def create_job(request: Request) -> Any:
+    """
+    Queue a PDF for parsing and return its job id right away. Jobs submitted
+    with priority "batch" only get Gemini quota that interactive ones leave.
+    """
+    upload = await save_upload(request)
+    previous_job_id = upload.fields.get("previous_job_id") or None
+    priority = upload.fields.get("priority") or INTERACTIVE
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
+        check_priority(priority)
+        check_previous_job(previous_job_id)
+    except HTTPException:
+        discard_upload(upload)
+        raise
+    job_id = get_job_manager().submit(upload.upload_path, upload.filename, previous_job_id=previous_job_id,
+                                      priority=priority)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Any:
+    """Job status, per-chunk progress and, once finished, the parsed JSON"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_response(job)
+
+@app.post("/parse", openapi_extra=upload_form(previous_job_id=PREVIOUS_JOB_FIELD))
+async def parse_endpoint(request: Request) -> Any:
+    # Runs as a job and waits for it, so the event loop stays free while parsing
+    upload = await save_upload(request)
+    previous_job_id = upload.fields.get("previous_job_id") or None
+    try:
+        check_previous_job(previous_job_id)
+    except HTTPException:
+        discard_upload(upload)
+        raise
+    manager = get_job_manager()
+    job_id = manager.submit(upload.upload_path, upload.filename, previous_job_id=previous_job_id)
+    future = manager.future(job_id)
+    if future is not None:
+        return await asyncio.wrap_future(future)
+    return manager.get(job_id)["result"]
+
+@app.post("/parse/stream", openapi_extra=upload_form(previous_job_id=PREVIOUS_JOB_FIELD))
+async def parse_stream_endpoint(request: Request) -> StreamingResponse:
+    """
+    Same as /parse, but streams newline-delimited JSON: a "job" event, an
+    "item" event for each top-level item as soon as Gemini has generated it,
+    one "chunk" event with each chunk's partItems as soon as it is parsed,
+    then a "result" event with the final merged document.
+    """
+    upload = await save_upload(request)
+    previous_job_id = upload.fields.get("previous_job_id") or None
+    try:
+        check_previous_job(previous_job_id)
+    except HTTPException:
+        discard_upload(upload)
+        raise
+    manager = get_job_manager()
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_chunk(idx: int, total: int, chunk_json: dict) -> None:
+        # Serialize on the worker thread, before the chunk is merged and mutated
+        event = {
+            "type": "chunk",
+            "chunk": idx + 1,
+            "total": total,
+            "section": chunk_json.get("section"),
+            "name": chunk_json.get("name"),
+            "parts": {
+                part: (chunk_json.get(part) or {}).get("partItems", [])
+                for part in ("part1", "part2", "part3")
+            },
+        }
+        loop.call_soon_threadsafe(events.put_nowait, json.dumps(event) + "\n")
+
+    def on_item(idx: int, chunk_json: dict) -> None:
+        for part in ("part1", "part2", "part3"):
+            for item in (chunk_json.get(part) or {}).get("partItems", []):
+                event = {"type": "item", "chunk": idx + 1, "part": part, "item": item}
+                loop.call_soon_threadsafe(events.put_nowait, json.dumps(event) + "\n")
+
+    job_id = manager.submit(upload.upload_path, upload.filename, on_chunk=on_chunk,
+                            previous_job_id=previous_job_id, on_item=on_item)
+    future = manager.future(job_id)
 
-        # Call your parsing function (LLM logic goes in parsing.py)
-        result_json = parse_pdf_to_json_chunked(tmp_path)
+    async def stream():
+        yield json.dumps({"type": "job", "job_id": job_id}) + "\n"
+        if future is None:
+            # Job already finished before we could attach to it
+            while not events.empty():
+                yield events.get_nowait()
+            result = manager.get(job_id)["result"]
+        else:
+            waiter = asyncio.ensure_future(asyncio.wrap_future(future))
+            while True:
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                break
+            while not events.empty():
+                yield events.get_nowait()
+            result = waiter.result()
+        yield json.dumps({"type": "result", **result}) + "\n"
 
-        # Optionally validate the output here
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
-        return result_json
-    finally:
-        # Clean up temp file
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """Stage timings, Gemini request/token counters and more, in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,443 @@
+import re
+from collections import Counter
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+# --- MasterFormat Heading Patterns ---
+
+# "PART 1 - GENERAL", "PART 2 PRODUCTS", "PART 3 – EXECUTION"
+PART_RE = re.compile(r"^\s*PART\s+(\d)\b\s*[-–—:.]?\s*(.*?)\s*$", re.IGNORECASE)
+# "1.01", "2.1", optionally followed by an upper-case title on the same line ("1.01 SUMMARY")
+ARTICLE_RE = re.compile(r"^\s*(\d{1,2})\.(\d{1,2})\s*(?:$|\s([A-Z][^a-z]*)$)")
+
+# "SECTION 23 82 43", "SECTION 27 15 00 - HORIZONTAL CABLING REQUIREMENTS"
+SECTION_RE = re.compile(r"^\s*SECTION\s+(\d{2}\s?\d{2}\s?\d{2}(?:\.\d+)?)\s*(?:[-–—]\s*(.*?))?\s*$", re.IGNORECASE)
+# Paragraph markers: "A.", "1.", "a." and "1)", "a)", "(1)", "(a)", alone or followed by text
+DOT_MARKER_RE = re.compile(r"^\s*([A-Z]|\d{1,2}|[a-z])\.(?:\s+(.*?))?\s*$")
+PAREN_MARKER_RE = re.compile(r"^\s*\(?(\d{1,2}|[a-z])\)(?:\s+(.*?))?\s*$")
+END_OF_SECTION_RE = re.compile(r"^\s*END\s+OF\s+SECTION\b", re.IGNORECASE)
+
+def iter_lines(text: str):
+    """Yield (offset, line) for every line in text, offsets pointing at the line start"""
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        yield offset, line.rstrip("\r\n")
+        offset += len(line)
+
+def next_title_line(lines: List[tuple], start: int) -> str:
+    """First non-blank line from `start` if it reads like an upper-case article title"""
+    for _, line in lines[start:]:
+        line = line.strip()
+        if not line:
+            continue
+        return line if line == line.upper() and any(c.isalpha() for c in line) else ""
+    return ""
+
+def find_boundaries(pages: List[dict]) -> List[Dict[str, Any]]:
+    """
+    Fast single pass over extracted page text that finds PART and article
+    headings. Returns boundaries in document order, each with its page number
+    and character offset into that page's text:
+        {"kind": "part" | "article", "page": int, "offset": int,
+         "part": int, "index": str, "title": str}
+
+    A small state machine rejects lines that only look like headings: an
+    article must belong to the current PART ("2.03" only inside PART 2) and
+    its number must increase within the part.
+    """
+    boundaries = []
+    current_part: Optional[int] = None
+    last_article = 0
+    seen_part_heading = False
+    for page_num, page in enumerate(pages):
+        lines = list(iter_lines(page["text"]))
+        for line_num, (offset, line) in enumerate(lines):
+            part_match = PART_RE.match(line)
+            if part_match:
+                part = int(part_match.group(1))
+                if current_part is None or part > current_part:
+                    seen_part_heading = True
+                    current_part = part
+                    last_article = 0
+                    boundaries.append({
+                        "kind": "part",
+                        "page": page_num,
+                        "offset": offset,
+                        "part": part,
+                        "index": f"PART {part}",
+                        "title": line.strip(),
+                    })
+                continue
+
+            article_match = ARTICLE_RE.match(line)
+            if not article_match:
+                continue
+            major, minor = int(article_match.group(1)), int(article_match.group(2))
+            if current_part is None and not boundaries:
+                # Spec without PART headings: trust the first article's major number
+                current_part = major
+            elif not seen_part_heading and major == current_part + 1:
+                current_part = major
+                last_article = 0
+            if major != current_part or minor <= last_article:
+                continue
+            last_article = minor
+            title = (article_match.group(3) or "").strip()
+            if not title:
+                # Titles are usually on the line after a bare "1.01"
+                title = next_title_line(lines, line_num + 1)
+            boundaries.append({
+                "kind": "article",
+                "page": page_num,
+                "offset": offset,
+                "part": major,
+                "index": f"{article_match.group(1)}.{article_match.group(2)}",
+                "title": title,
+            })
+    return boundaries
+
+# --- Deterministic Parser ---
+
+def normalize_line(line: str) -> str:
+    """Line with digits masked, so running headers like "PAGE 3 OF 5" match across pages"""
+    return re.sub(r"\d+", "#", " ".join(line.split()))
+
+def is_structural(line: str) -> bool:
+    """PART/article headings and paragraph markers, which recur on every page but are content"""
+    return bool(PART_RE.match(line) or ARTICLE_RE.match(line) or marker_info(line))
+
+def repeated_lines(pages: List[dict], min_share: float = 0.6, edge_lines: int = 12) -> Set[str]:
+    """
+    Normalized lines that recur near the top or bottom of most pages (running
+    headers, footers, page numbers). Only meaningful for documents of two or
+    more pages.
+    """
+    if len(pages) < 2:
+        return set()
+    counts: Counter = Counter()
+    for page in pages:
+        lines = [line for _, line in iter_lines(page["text"]) if line.strip()]
+        edges = lines[:edge_lines] + lines[-edge_lines:]
+        counts.update({normalize_line(line) for line in edges if not is_structural(line)})
+    threshold = max(2, int(len(pages) * min_share + 0.5))
+    return {line for line, count in counts.items() if count >= threshold}
+
+def is_title_text(line: str) -> bool:
+    """Upper-case line made mostly of letters (section names, article titles)"""
+    chars = [c for c in line if not c.isspace()]
+    letters = [c for c in chars if c.isalpha()]
+    return bool(letters) and line == line.upper() and len(letters) >= 0.6 * len(chars)
+
+def find_section_header(pages: List[dict]) -> Tuple[str, str]:
+    """Section number and name from the first "SECTION xx xx xx" line with a usable name"""
+    fallback = ("", "")
+    for page in pages:
+        lines = [line.strip() for _, line in iter_lines(page["text"]) if line.strip()]
+        for i, line in enumerate(lines):
+            match = SECTION_RE.match(line)
+            if not match:
+                continue
+            number = " ".join(match.group(1).split())
+            name = (match.group(2) or "").strip()
+            if not name and i + 1 < len(lines) and is_title_text(lines[i + 1]) and not PART_RE.match(lines[i + 1]):
+                name = lines[i + 1]
+            if name:
+                return number, name
+            if not fallback[0]:
+                fallback = (number, "")
+    return fallback
+
+def marker_info(line: str) -> Optional[Tuple[str, int, str, str]]:
+    """(marker type, ordinal, index label, trailing text) for a paragraph marker line"""
+    match = DOT_MARKER_RE.match(line)
+    if match:
+        label, text = match.group(1), match.group(2) or ""
+        if label.isdigit():
+            return "digit", int(label), f"{label}.", text
+        if label.isupper():
+            return "upper", ord(label) - ord("A") + 1, f"{label}.", text
+        return "lower", ord(label) - ord("a") + 1, f"{label}.", text
+    match = PAREN_MARKER_RE.match(line)
+    if match:
+        label, text = match.group(1), match.group(2) or ""
+        if label.isdigit():
+            return "paren_digit", int(label), f"{label})", text
+        return "paren_lower", ord(label) - ord("a") + 1, f"{label})", text
+    return None
+
+def append_text(node: Dict[str, Any], text: str) -> None:
+    """Append a continuation line, re-joining words hyphenated across the line break"""
+    text = " ".join(text.split())
+    if not text:
+        return
+    current = node["text"]
+    if not current:
+        node["text"] = text
+    elif current.endswith("-") and len(current) > 1 and current[-2].isalnum():
+        node["text"] = current + text
+    else:
+        node["text"] = f"{current} {text}"
+
+# How much each irregularity lowers a region's confidence score (which starts at 1.0)
+ISSUE_WEIGHTS = {
+    "numbering": 0.5,     # article or paragraph number out of sequence
+    "heading": 0.5,       # repeated or out-of-order PART heading
+    "broken_line": 0.25,  # marker-like line that had to be read as continuation text
+    "table": 0.2,         # table attached to the paragraph it follows, by position only
+    "loose_text": 1.0,    # text directly under a PART with no paragraph to hang it on
+}
+
+class MasterFormatParser:
+    """
+    Numbering-grammar state machine that builds the section/part/partItems
+    tree straight from extracted page text:
+        PART n  ->  article "n.nn"  ->  "A."  ->  "1."  ->  "a."  ->  "1)"  ->  "a)"
+    A marker is accepted when it continues the numbering at its level or starts
+    a new, deeper level at 1/A/a. Lines that don't fit are continuation text.
+
+    Alongside the tree the parser records regions: one per top-level item of a
+    part (usually an article), holding the source lines and tables it was built
+    from and the irregularities seen while building it. Each region gets a
+    confidence score so callers can re-parse only the doubtful ones.
+
+    `last_articles` seeds the article numbering per part, for pages cut out
+    of a longer document ({2: 4} when PART 2 here resumes after 2.04).
+
+    With `skip_repeated`, lines recurring at the top or bottom of most pages
+    (repeated_lines) are dropped as running headers and footers. That is only
+    a fallback for pages furniture.py has not stripped already: it works from
+    the text alone, where furniture.py also has the page layout.
+    """
+
+    def __init__(self, pages: List[dict], last_articles: Optional[Dict[int, int]] = None,
+                 skip_repeated: bool = True):
+        self.pages = pages
+        self.last_articles = last_articles or {}
+        self.furniture = repeated_lines(pages) if skip_repeated else set()
+        self.parts: Dict[int, List[Dict[str, Any]]] = {1: [], 2: [], 3: []}
+        self.part_titles: Dict[int, str] = {}
+        self.regions: List[Dict[str, Any]] = []
+        self.region: Optional[Dict[str, Any]] = None
+        self.part: Optional[int] = None
+        self.article: Optional[Dict[str, Any]] = None
+        # Stand-in parent for paragraphs placed directly under a PART with no articles
+        self.part_root: Optional[Dict[str, Any]] = None
+        self.last_article = 0
+        self.stack: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.expect_title = False
+        self.done = False
+
+    def open_region(self, page_num: int, node: Optional[Dict[str, Any]], heading: str) -> None:
+        """
+        Start a region for a new top-level node. Loose text gets a region with
+        no node, anchored after the part's last item so results can be spliced in.
+        """
+        items = self.parts.setdefault(self.part, [])
+        self.region = {
+            "part": self.part,
+            "part_title": self.part_titles.get(self.part, f"PART {self.part}"),
+            "node": node,
+            "anchor": items[-1] if node is None and items else None,
+            "heading": heading,
+            "pages": [page_num, page_num],
+            "content": [],
+            "issues": [],
+        }
+        self.regions.append(self.region)
+        if node is None:
+            self.flag("loose_text")
+
+    def flag(self, issue: str) -> None:
+        if self.region is not None:
+            self.region["issues"].append(issue)
+
+    def record(self, page_num: int, item: Any) -> None:
+        """Keep a source line or table with the current region"""
+        self.region["content"].append(item)
+        self.region["pages"][1] = page_num
+
+    def loose_region(self, page_num: int) -> None:
+        if self.region is None or self.region["node"] is not None or self.region["part"] != self.part:
+            self.open_region(page_num, None, "")
+
+    def current_node(self) -> Optional[Dict[str, Any]]:
+        if self.stack:
+            return self.stack[-1][2]
+        return self.article or self.part_root
+
+    def start_article(self, page_num: int, index: str, minor: int, title: str, line: str) -> None:
+        self.article = {"index": index, "text": title, "children": None}
+        self.parts.setdefault(self.part, []).append(self.article)
+        self.open_region(page_num, self.article, line)
+        if minor != self.last_article + 1:
+            self.flag("numbering")
+        self.last_article = minor
+        self.stack = []
+        self.expect_title = not title
+
+    def place_marker(self, page_num: int, mtype: str, ordinal: int, label: str, text: str) -> bool:
+        """Attach a paragraph node for this marker; False if it doesn't fit the numbering"""
+        level = None
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == mtype:
+                level = i
+                break
+        in_sequence = True
+        if level is not None:
+            if ordinal != self.stack[level][1] + 1:
+                if text:
+                    return False
+                in_sequence = False
+            self.stack = self.stack[:level]
+        elif ordinal != 1:
+            if text:
+                return False
+            in_sequence = False
+        parent = self.current_node()
+        node = {"index": label, "text": " ".join(text.split()), "children": None}
+        if parent.get("children") is None:
+            parent["children"] = []
+        parent["children"].append(node)
+        if parent is self.part_root:
+            self.open_region(page_num, node, label)
+        if not in_sequence:
+            # Bare marker out of sequence: keep it, but don't trust this region
+            self.flag("numbering")
+        self.stack.append((mtype, ordinal, node))
+        return True
+
+    def feed_line(self, page_num: int, line: str) -> None:
+        stripped = line.strip()
+        if not stripped or self.done:
+            return
+        if END_OF_SECTION_RE.match(stripped):
+            self.done = True
+            return
+        if normalize_line(stripped) in self.furniture:
+            return
+
+        part_match = PART_RE.match(stripped)
+        if part_match:
+            part = int(part_match.group(1))
+            if self.part is not None and part <= self.part:
+                # A repeated or backwards PART heading; keep building the current part
+                self.flag("heading")
+                return
+            self.part = part
+            self.part_titles[part] = stripped
+            self.article = None
+            self.part_root = {"children": self.parts.setdefault(part, [])}
+            self.region = None
+            self.last_article = self.last_articles.get(part, 0)
+            self.stack = []
+            return
+
+        article_match = ARTICLE_RE.match(stripped)
+        if article_match and self.part is not None:
+            major, minor = int(article_match.group(1)), int(article_match.group(2))
+            if major == self.part and minor > self.last_article:
+                index = f"{article_match.group(1)}.{article_match.group(2)}"
+                self.start_article(page_num, index, minor, (article_match.group(3) or "").strip(), stripped)
+                self.record(page_num, stripped)
+                return
+
+        if self.part is None:
+            return  # Preamble before PART 1 (cover sheet, section title)
+
+        if self.article is None and not self.stack:
+            # Paragraphs directly under a PART are allowed; loose text there has nowhere to go
+            info = marker_info(stripped)
+            if not (info and self.place_marker(page_num, *info)):
+                self.loose_region(page_num)
+            self.record(page_num, stripped)
+            return
+
+        if self.expect_title:
+            self.expect_title = False
+            if marker_info(stripped) is None:
+                append_text(self.article, stripped)
+                self.record(page_num, stripped)
+                return
+
+        info = marker_info(stripped)
+        if info and self.place_marker(page_num, *info):
+            self.record(page_num, stripped)
+            return
+        if info:
+            self.flag("broken_line")
+        append_text(self.current_node(), stripped)
+        self.record(page_num, stripped)
+
+    def feed_table(self, page_num: int, table: dict) -> None:
+        if self.part is None or self.done:
+            return
+        table = {"headers": table["headers"], "rows": table["rows"]}
+        node = self.current_node()
+        if node is self.part_root:
+            self.loose_region(page_num)
+        else:
+            node.setdefault("tables", []).append(table)
+            self.flag("table")
+        self.record(page_num, table)
+
+    def parse(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        for page_num, page in enumerate(self.pages):
+            text = page["text"]
+            tables = sorted(page.get("tables", []), key=lambda t: t.get("position", len(text)))
+            table_iter = iter(tables)
+            next_table = next(table_iter, None)
+            for offset, line in iter_lines(text):
+                while next_table is not None and next_table.get("position", len(text)) <= offset:
+                    self.feed_table(page_num, next_table)
+                    next_table = next(table_iter, None)
+                self.feed_line(page_num, line)
+            while next_table is not None:
+                self.feed_table(page_num, next_table)
+                next_table = next(table_iter, None)
+
+        for region in self.regions:
+            penalty = sum(ISSUE_WEIGHTS[issue] for issue in region["issues"])
+            region["confidence"] = max(0.0, 1.0 - penalty)
+
+        section, name = find_section_header(self.pages)
+        document = {
+            "section": section,
+            "name": name,
+            "part1": {"partItems": self.parts.get(1, [])},
+            "part2": {"partItems": self.parts.get(2, [])},
+            "part3": {"partItems": self.parts.get(3, [])},
+        }
+        return document, self.regions
+
+def parse_masterformat(pages: List[dict], last_articles: Optional[Dict[int, int]] = None,
+                       skip_repeated: bool = True) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Deterministic parse of extracted pages into the section JSON schema.
+    `last_articles` seeds the article numbering and `skip_repeated` drops
+    running headers and footers (see MasterFormatParser).
+    Returns the document and its regions in document order:
+        {"part": int, "part_title": str, "node": dict | None, "anchor": dict | None,
+         "heading": str, "pages": [first, last], "content": [line | table, ...],
+         "issues": [str, ...], "confidence": float}
+    Every region with a node is already in the document; loose-text regions
+    (node None) are not, and belong right after their anchor.
+    """
+    return MasterFormatParser(pages, last_articles, skip_repeated).parse()
+
+def splice_region(document: Dict[str, Any], region: Dict[str, Any], items: List[Dict[str, Any]]) -> None:
+    """
+    Put re-parsed items in place of a region's node, or after its anchor for
+    loose text. Splice loose regions before replacing the nodes they anchor to.
+    """
+    part_items = document[f"part{region['part']}"]["partItems"]
+    if region["node"] is not None:
+        at = next(i for i, item in enumerate(part_items) if item is region["node"])
+        part_items[at:at + 1] = items
+        return
+    anchor = region["anchor"]
+    at = 0 if anchor is None else next(i for i, item in enumerate(part_items) if item is anchor) + 1
+    part_items[at:at] = items
+
+def index_sort_key(index: Optional[str]) -> Tuple:
+    """Sort key for article indices such as "1.02" or "2.10" (numeric, not lexical)"""
+    numbers = re.findall(r"\d+", index or "")
+    return tuple(int(n) for n in numbers) if numbers else (float("inf"),)
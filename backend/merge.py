@@ -0,0 +1,178 @@
+import re
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from masterformat import find_boundaries, index_sort_key
+
+# "2.1", "3.02": article indices, whose major number names their part
+ARTICLE_INDEX_RE = re.compile(r"^\s*(\d{1,2})\.(\d{1,2})\s*$")
+
+# --- Node Keys ---
+
+def node_key(index: Any) -> str:
+    """
+    Key of a node among its siblings: "2.1" and "2.01" are the same article,
+    "A.", "A" and "(A)" the same paragraph.
+    """
+    if index is None:
+        return ""
+    match = ARTICLE_INDEX_RE.match(str(index))
+    if match:
+        return f"{int(match.group(1))}.{int(match.group(2))}"
+    return re.sub(r"[\s.()]", "", str(index))
+
+def article_part(index: Any) -> Optional[int]:
+    """Part an article index belongs to ("3.02" -> 3), or None for other indices"""
+    match = ARTICLE_INDEX_RE.match(str(index or ""))
+    if match and 1 <= int(match.group(1)) <= 3:
+        return int(match.group(1))
+    return None
+
+def chunk_coverage(chunk_pages: List[dict]) -> Dict[str, int]:
+    """
+    How much of each article a chunk holds, in characters, keyed by node_key of
+    the article index. Text before the chunk's first article heading belongs to
+    an article begun in an earlier chunk and is counted under "".
+    """
+    text = "\n".join(page["text"] for page in chunk_pages)
+    coverage: Dict[str, int] = {}
+    key, start = "", 0
+    for boundary in find_boundaries([{"text": text}]):
+        coverage[key] = coverage.get(key, 0) + boundary["offset"] - start
+        key = node_key(boundary["index"]) if boundary["kind"] == "article" else ""
+        start = boundary["offset"]
+    coverage[key] = coverage.get(key, 0) + len(text) - start
+    return coverage
+
+# --- Tables ---
+
+def table_hash(tbl):
+    """Create a hash for table deduplication"""
+    # Use headers + all rows for hashable tuple
+    return (tuple(tbl['headers']), tuple(tuple(row) for row in tbl['rows']))
+
+def table_markdown(tbl: dict) -> str:
+    """Markdown for a table inlined into its node's text"""
+    headers = " | ".join(str(h) for h in tbl['headers'])
+    separator = " | ".join(['---'] * len(tbl['headers']))
+    rows = "\n".join(" | ".join(str(cell) for cell in row) for row in tbl['rows'])
+    title = f"**{tbl.get('title', '')}**\n" if tbl.get('title') else ""
+    return f"{title}| {headers} |\n| {separator} |\n{rows}"
+
+# --- Merge Engine ---
+
+class TreeMerger:
+    """
+    Merges chunk results into one document as they arrive, in any order.
+    Nodes are keyed by their index path (part, article, paragraph, ...), so the
+    same node from overlapping chunks lands in one place at any depth: children
+    are unioned recursively, tables collected, and text and other fields come
+    from the chunk that covers the node's article best (see chunk_coverage),
+    the earlier chunk on a tie. Articles are filed under the part their number
+    names, whatever part the chunk put them in.
+
+    Table de-duplication and markdown rendering happen as tables are added, so
+    snapshot() is a single walk and can be taken at any moment (thread-safe)
+    for a consistent partial document. The result does not depend on the
+    order chunks were added in.
+    """
+
+    def __init__(self):
+        self.section = ""
+        self.name = ""
+        self.section_order: Optional[int] = None
+        self.parts: Dict[int, Dict[str, Dict[str, Any]]] = {1: {}, 2: {}, 3: {}}
+        # Table hash -> (position, entry) of its first occurrence in document order
+        self.table_owner: Dict[Any, Tuple[Tuple[int, int], int]] = {}
+        self.added = 0
+        self._lock = threading.Lock()
+
+    def add(self, chunk: Dict[str, Any], coverage: Optional[Dict[str, int]] = None,
+            order: Optional[int] = None) -> None:
+        """
+        Fold one chunk result in. `order` is the chunk's position in the
+        document (defaults to arrival order); `coverage` its chunk_coverage.
+        """
+        with self._lock:
+            order = self.added if order is None else order
+            self.added += 1
+            if (chunk.get("section") or chunk.get("name")) and \
+                    (self.section_order is None or order < self.section_order):
+                self.section = chunk.get("section") or ""
+                self.name = chunk.get("name") or ""
+                self.section_order = order
+            seq = [0]
+            for n in (1, 2, 3):
+                part = chunk.get(f"part{n}")
+                items = part.get("partItems") if isinstance(part, dict) else None
+                for item in items or []:
+                    if not isinstance(item, dict):
+                        continue
+                    score = 0
+                    if coverage:
+                        score = coverage.get(node_key(item.get("index")), coverage.get("", 0))
+                    self._merge(self.parts[article_part(item.get("index")) or n], item, score, order, seq)
+
+    def _merge(self, siblings: Dict[str, Dict[str, Any]], node: Dict[str, Any], score: int,
+               order: int, seq: List[int]) -> None:
+        position = (order, seq[0])
+        seq[0] += 1
+        key = node_key(node.get("index")) or f"text:{node.get('text')}"
+        fields = {k: v for k, v in node.items() if k not in ("children", "tables")}
+        # Any text beats none, then better coverage, then the earlier chunk
+        rank = (bool(fields.get("text")), score, -order)
+        entry = siblings.get(key)
+        if entry is None:
+            entry = {"fields": fields, "rank": rank, "position": position, "tables": {}, "children": {}}
+            siblings[key] = entry
+        else:
+            entry["position"] = min(entry["position"], position)
+            if rank > entry["rank"]:
+                entry["fields"] = fields
+                entry["rank"] = rank
+        for tbl in node.get("tables") or []:
+            if isinstance(tbl, dict) and isinstance(tbl.get("headers"), list) and isinstance(tbl.get("rows"), list):
+                self._add_table(entry, tbl, position)
+        for child in node.get("children") or []:
+            if isinstance(child, dict):
+                self._merge(entry["children"], child, score, order, seq)
+
+    def _add_table(self, entry: Dict[str, Any], tbl: dict, position: Tuple[int, int]) -> None:
+        thash = table_hash(tbl)
+        if thash not in entry["tables"]:
+            entry["tables"][thash] = {"position": position, "table": tbl, "markdown": table_markdown(tbl)}
+        elif position < entry["tables"][thash]["position"]:
+            entry["tables"][thash]["position"] = position
+        owner = self.table_owner.get(thash)
+        if owner is None or position < owner[0]:
+            self.table_owner[thash] = (position, id(entry))
+
+    def _build(self, entry: Dict[str, Any], inline_tables: bool) -> Dict[str, Any]:
+        node = dict(entry["fields"])
+        tables = sorted(
+            (t for thash, t in entry["tables"].items() if self.table_owner[thash][1] == id(entry)),
+            key=lambda t: t["position"],
+        )
+        if tables and inline_tables:
+            markdown = "\n\n".join(t["markdown"] for t in tables)
+            text = node.get("text")
+            node["text"] = text.rstrip() + "\n\n" + markdown if isinstance(text, str) else markdown
+        elif tables:
+            node["tables"] = [t["table"] for t in tables]
+        children = sorted(entry["children"].values(), key=lambda child: child["position"])
+        node["children"] = [self._build(child, inline_tables) for child in children] or None
+        return node
+
+    def snapshot(self, inline_tables: bool = False) -> Dict[str, Any]:
+        """
+        The document merged so far: top-level items ordered by index, children
+        in document order, each table kept once (where it first occurs) and,
+        with `inline_tables`, appended to its node's text as markdown.
+        """
+        with self._lock:
+            document = {"section": self.section, "name": self.name}
+            for n in (1, 2, 3):
+                items = [self._build(entry, inline_tables) for entry in self.parts[n].values()]
+                items.sort(key=lambda item: index_sort_key(item.get("index")))
+                document[f"part{n}"] = {"partItems": items}
+            return document
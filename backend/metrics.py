@@ -0,0 +1,143 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Upper bounds (seconds) of histogram buckets: sub-millisecond post-processing up to multi-minute Gemini calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# --- Metric Types ---
+# Minimal Prometheus client: label sets are keyword arguments, and render()
+# produces the text exposition format served at /metrics.
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    """A value that only goes up, per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        # Without labels there is one series, reported from the start
+        self._values: Dict[Tuple[str, ...], float] = {} if self.labels else {(): 0.0}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return super().render() + [
+            f"{self.name}{format_labels(list(zip(self.labels, key)))} {format_value(value)}" for key, value in values
+        ]
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count, per label set"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: per-bucket counts (not yet cumulative; the last is +Inf), sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1][0] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines = super().render()
+        for key, (counts, total) in series:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(pairs + [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(pairs)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(pairs)} {cumulative}")
+        return lines
+
+REGISTRY: List[Metric] = []
+
+def render() -> str:
+    """Every metric in the Prometheus text format (version 0.0.4)"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+# --- Parser Metrics ---
+
+STAGE_SECONDS = Histogram(
+    "parser_stage_seconds",
+    "Time spent in each pipeline stage, per document (per request for llm, json and validate)",
+    ["stage"],
+)
+DOCUMENT_SECONDS = Histogram("parser_document_seconds", "Time to parse one document", ["mode"])
+DOCUMENTS = Counter("parser_documents_total", "Documents parsed", ["mode", "outcome"])
+LLM_REQUESTS = Counter("parser_llm_requests_total", "Gemini requests by outcome (ok, malformed, error)", ["outcome"])
+LLM_TOKENS = Counter("parser_llm_tokens_total", "Estimated Gemini tokens sent (input) and generated (output)",
+                     ["direction"])
+LLM_RETRIES = Counter("parser_llm_retries_total", "Chunk retries (repair prompt or backoff)", ["kind"])
+LLM_QUEUE_SECONDS = Histogram("parser_llm_queue_seconds", "Time a Gemini call waited in the rate limiter",
+                              ["priority"])
+CHUNKS_FAILED = Counter("parser_chunks_failed_total", "Chunks given up on after their retries")
+CACHE_HITS = Counter("parser_cache_hits_total", "Results served from the parse cache", ["kind"])
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Observe the time spent in the with-block as `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+def observe_stages(seconds: Dict[str, float]) -> None:
+    """Record stage timings collected elsewhere, e.g. in a worker process"""
+    for stage, value in seconds.items():
+        STAGE_SECONDS.observe(value, stage=stage)
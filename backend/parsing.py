@@ -1,18 +1,61 @@
 import os
 import json
-import google.generativeai as genai
+import time
+import logging
+import threading
+import multiprocessing
 import fitz  # PyMuPDF
-import re
 import pdfplumber
-from typing import Dict, Any, List
+from google.api_core.exceptions import ResourceExhausted
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Callable, Optional, Tuple
+from cache import get_cache, hash_file, document_key, chunk_key
+from llm import get_llm_client
+from furniture import strip_furniture
+from jsonrepair import JSONExtractor, extract_json, parse_llm_json, repeating_tail
+from merge import TreeMerger, chunk_coverage, table_hash, table_markdown
+from masterformat import find_boundaries, parse_masterformat, splice_region
+from schema import REGION_SCHEMA, SECTION_SCHEMA, validate
+from retry import LLM_MAX_RETRIES, ParseReport, backoff_delay
+from ratelimit import INTERACTIVE, get_scheduler
+from metrics import (
+    CACHE_HITS, CHUNKS_FAILED, DOCUMENT_SECONDS, DOCUMENTS, LLM_QUEUE_SECONDS, LLM_REQUESTS, LLM_RETRIES,
+    LLM_TOKENS, STAGE_SECONDS, observe_stages, timed,
+)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+logger = logging.getLogger(__name__)
+
+# Maximum number of chunk requests in flight to Gemini at once
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+# Worker processes for page extraction, and the page count at which they are used
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACTION_MIN_PAGES", "16"))
+# Input token budget per chunk (about three dense spec pages) and the overlap carried between chunks
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", "3000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "150"))
+# Strip running headers, footers, page numbers and cover pages before chunking
+STRIP_PAGE_FURNITURE = os.getenv("STRIP_PAGE_FURNITURE", "1").lower() not in ("0", "false", "no")
+# "sections" (cut at article boundaries), "tokens" (token-budget windows) or "pages" (fixed page windows)
+CHUNKING_STRATEGY = os.getenv("CHUNKING_STRATEGY", "sections")
+# "rules": deterministic MasterFormat parser with LLM fallback; "llm": every chunk goes through Gemini
+PARSE_MODE = os.getenv("PARSE_MODE", "rules")
+# Regions the rules parser scores below this confidence (0-1) are re-parsed by Gemini
+RULES_MIN_CONFIDENCE = float(os.getenv("RULES_MIN_CONFIDENCE", "0.7"))
+# Stream Gemini responses and parse them as they arrive, so items are reported early and runaway output is cut short
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1").lower() not in ("0", "false", "no")
+# A streamed response is abandoned once its tail repeats the same text over this many characters
+STREAM_REPEAT_CHARS = int(os.getenv("STREAM_REPEAT_CHARS", "600"))
+# Ask Gemini for JSON constrained to the response schema (schema.py), with a shorter prompt
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "0").lower() not in ("0", "false", "no")
+# Opt-in: append tables to their item's text as markdown instead of returning them as structured "tables"
+INLINE_TABLES = os.getenv("INLINE_TABLES", "0").lower() not in ("0", "false", "no")
 
 # --- Utility Functions ---
 
 def normalize_quotes(text):
     """Normalize different types of quotes to standard quotes"""
-    if not isinstance(text, str):
+    if not isinstance(text, str) or text.isascii():
         return text
     return text.replace("’", "'").replace("‘", "'") \
                .replace("“", '"').replace("”", '"')
@@ -28,70 +71,236 @@ def normalize_json_quotes(obj):
         return obj
 
 def clean_llm_response(text):
-    """Clean and extract JSON from LLM response"""
+    """Clean and extract JSON from LLM response (see jsonrepair.JSONExtractor)"""
     if not text:
         return ""
-    
-    # Remove all code block markers
-    text = text.strip()
-    text = re.sub(r"^```json\s*", "", text)
-    text = re.sub(r"^```", "", text)
-    text = re.sub(r"```$", "", text)
-    
-    # Find the first opening brace
-    start_idx = text.find('{')
-    if start_idx == -1:
-        raise ValueError("No JSON object found in response")
-    
-    # Find the matching closing brace
-    brace_count = 0
-    end_idx = -1
-    
-    for i in range(start_idx, len(text)):
-        if text[i] == '{':
-            brace_count += 1
-        elif text[i] == '}':
-            brace_count -= 1
-            if brace_count == 0:
-                end_idx = i + 1
-                break
-    
-    if end_idx == -1:
-        raise ValueError("Unmatched braces in JSON response")
-    
-    # Extract the JSON part
-    json_text = text[start_idx:end_idx]
-    
-    # Additional cleaning for common LLM issues
-    json_text = re.sub(r',\s*}', '}', json_text)  # Remove trailing commas
-    json_text = re.sub(r',\s*]', ']', json_text)  # Remove trailing commas in arrays
-    
-    return json_text.strip()
+    return extract_json(text)
 
 # --- Text Extraction ---
 
-def extract_pages_and_tables(pdf_path: str):
-    # Extract page text with fitz
-    doc = fitz.open(pdf_path)
-    pages = [page.get_text().strip() for page in doc]
-    doc.close()
-    
-    # Extract tables with pdfplumber
-    tables_per_page = extract_tables_by_page(pdf_path)
-    
-    # Combine: returns a list of dicts per page
-    result = []
-    for idx, page_text in enumerate(pages):
-        entry = {
-            "text": page_text,
-            "tables": tables_per_page[idx] if idx < len(tables_per_page) else []
-        }
-        result.append(entry)
-    return result
+# A page needs at least this many ruling lines/rectangles before we look for tables
+TABLE_MIN_RULINGS = 4
+
+def page_has_table_layout(page) -> bool:
+    """
+    Cheap layout check: tables in spec PDFs are drawn with ruling lines, so
+    pages without enough vector lines/rectangles are skipped by the table finder.
+    """
+    rulings = 0
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] in ("l", "re"):
+                rulings += 1
+                if rulings >= TABLE_MIN_RULINGS:
+                    return True
+    return False
+
+def extract_page(page, timings: Optional[Dict[str, float]] = None) -> dict:
+    """
+    Single pass over one PyMuPDF page: returns its text with table regions cut
+    out, each table with its bounding box and character position in the text,
+    and each text block's bounding box and character span.
+    Time spent finding tables is added to timings["tables"].
+    """
+    start = time.perf_counter()
+    tables = []
+    if page_has_table_layout(page):
+        for tbl in page.find_tables().tables:
+            cells = tbl.extract()
+            if not cells or not cells[0]:
+                continue
+            tables.append({
+                "headers": cells[0],
+                "rows": cells[1:],
+                "bbox": [round(v, 2) for v in tbl.bbox],
+            })
+    if timings is not None:
+        timings["tables"] = timings.get("tables", 0.0) + time.perf_counter() - start
+    table_rects = [fitz.Rect(tbl["bbox"]) for tbl in tables]
+
+    pieces = []
+    spans = []
+    length = 0
+    positions = [None] * len(tables)
+    for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks"):
+        if block_type != 0:
+            continue
+        center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+        inside = [i for i, rect in enumerate(table_rects) if rect.contains(center)]
+        if inside:
+            # Block belongs to a table: the table is emitted here instead of its raw text
+            for i in inside:
+                if positions[i] is None:
+                    positions[i] = length
+            continue
+        # Tables with no text block inside them go before the first block below their top edge
+        for i, rect in enumerate(table_rects):
+            if positions[i] is None and y0 >= rect.y0:
+                positions[i] = length
+        pieces.append(block_text)
+        spans.append(([round(v, 2) for v in (x0, y0, x1, y1)], length, length + len(block_text)))
+        length += len(block_text)
+
+    raw_text = "".join(pieces)
+    text = raw_text.strip()
+    lead = len(raw_text) - len(raw_text.lstrip())
+    for tbl, pos in zip(tables, positions):
+        pos = length if pos is None else pos
+        tbl["position"] = min(max(pos - lead, 0), len(text))
+    # Text blocks with their page coordinates, for header/footer detection across pages
+    blocks = [
+        {"bbox": bbox, "start": min(max(start - lead, 0), len(text)), "end": min(max(end - lead, 0), len(text))}
+        for bbox, start, end in spans
+    ]
+    return {"text": text, "tables": tables, "blocks": blocks, "height": round(page.rect.height, 2)}
+
+def extract_page_text(page) -> dict:
+    """
+    Text-only counterpart of extract_page (no table detection), cheap enough
+    to run on every page just to fingerprint pages and locate headings.
+    """
+    pieces = []
+    spans = []
+    length = 0
+    for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks"):
+        if block_type != 0:
+            continue
+        pieces.append(block_text)
+        spans.append(([round(v, 2) for v in (x0, y0, x1, y1)], length, length + len(block_text)))
+        length += len(block_text)
+    raw_text = "".join(pieces)
+    text = raw_text.strip()
+    lead = len(raw_text) - len(raw_text.lstrip())
+    blocks = [
+        {"bbox": bbox, "start": min(max(start - lead, 0), len(text)), "end": min(max(end - lead, 0), len(text))}
+        for bbox, start, end in spans
+    ]
+    return {"text": text, "tables": [], "blocks": blocks, "height": round(page.rect.height, 2)}
+
+def extract_page_range(pdf_path: str, start: int, stop: int) -> Tuple[List[dict], Dict[str, float]]:
+    """
+    Extract pages [start, stop) of the PDF. Runs inside extraction worker
+    processes, so it opens its own handle on the document, and returns its
+    stage timings alongside the pages.
+    """
+    timings: Dict[str, float] = {}
+    with fitz.open(pdf_path) as doc:
+        return [extract_page(doc[i], timings) for i in range(start, stop)], timings
+
+# --- Extraction Pool ---
+
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_extraction_pool_lock = threading.Lock()
+
+def extraction_context():
+    """
+    Start method for extraction processes. The server forks from threads
+    (jobs, LLM calls, SQLite) that may hold locks, and a forked child inherits
+    them held, so workers are started from a clean forkserver (or spawned).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Process-wide pool of EXTRACTION_WORKERS processes shared by every document being extracted"""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=max(1, EXTRACTION_WORKERS),
+                                                   mp_context=extraction_context())
+        return _extraction_pool
+
+def discard_extraction_pool(pool: Optional[ProcessPoolExecutor] = None) -> None:
+    """Shut the pool down (only if it is still `pool`, when given); the next extraction starts a new one"""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None or (pool is not None and _extraction_pool is not pool):
+            return
+        _extraction_pool, pool = None, _extraction_pool
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_pages_and_tables(pdf_path: str, workers: int = EXTRACTION_WORKERS,
+                             strip: bool = STRIP_PAGE_FURNITURE,
+                             timings: Optional[Dict[str, float]] = None):
+    """
+    Opens the PDF once with PyMuPDF and extracts text and tables for every page.
+    Large documents are split into page ranges across the shared process pool.
+    With `strip`, page furniture is removed before the pages are returned.
+    Returns a list of dicts per page: {"text", "tables", "blocks", "height"}.
+
+    The extraction, tables (part of extraction, summed over pages) and
+    furniture stages are recorded in the metrics, or only added to
+    `timings` when given (a worker process reports them to its parent).
+    """
+    record = timings is None
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < PARALLEL_EXTRACTION_MIN_PAGES:
+            pages = [extract_page(page, timings) for page in doc]
+        else:
+            pages = None
+
+    if pages is None:
+        # Several ranges per worker so one dense, table-heavy range doesn't hold up the rest
+        range_count = min(page_count, workers * 4)
+        bounds = [page_count * i // range_count for i in range(range_count + 1)]
+        executor = get_extraction_pool()
+        futures = [
+            executor.submit(extract_page_range, pdf_path, bounds[i], bounds[i + 1])
+            for i in range(range_count)
+        ]
+        pages = []
+        try:
+            for future in futures:
+                range_pages, range_timings = future.result()
+                pages.extend(range_pages)
+                timings["tables"] = timings.get("tables", 0.0) + range_timings.get("tables", 0.0)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); don't leave every later document failing
+            discard_extraction_pool(executor)
+            raise
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    timings["extraction"] = time.perf_counter() - start
+
+    if strip:
+        start = time.perf_counter()
+        remove_page_furniture(pages)
+        timings["furniture"] = time.perf_counter() - start
+    if record:
+        observe_stages(timings)
+    return pages
+
+def remove_page_furniture(pages: List[dict]) -> Dict[str, int]:
+    """
+    Strip headers, footers and cover pages in place and report what that saved.
+    Each page also keeps its own savings as "stripped": {"chars", "tokens"}, so
+    they reach the result meta (see furniture_savings) even when the pages were
+    extracted in another process.
+    """
+    before = [(len(page['text']), estimate_tokens(page['text'])) for page in pages]
+    report = strip_furniture(pages)
+    for page, (chars, tokens) in zip(pages, before):
+        page['stripped'] = {"chars": chars - len(page['text']), "tokens": tokens - estimate_tokens(page['text'])}
+    report['tokens_saved'] = sum(page['stripped']['tokens'] for page in pages)
+    logger.info("page furniture stripped", extra=dict(report))
+    return report
+
+def furniture_savings(pages: List[dict]) -> Dict[str, int]:
+    """Characters and estimated tokens remove_page_furniture took out of these pages"""
+    return {
+        "chars_removed": sum(page.get('stripped', {}).get('chars', 0) for page in pages),
+        "tokens_saved": sum(page.get('stripped', {}).get('tokens', 0) for page in pages),
+    }
 
 def extract_tables_by_page(pdf_path: str) -> List[List[dict]]:
     """
     Extract tables for each page as a list (indexed by page number).
+    Legacy pdfplumber extractor; the pipeline uses extract_pages_and_tables.
     """
     tables_per_page = []
     with pdfplumber.open(pdf_path) as pdf:
@@ -124,29 +333,231 @@ def make_chunks(pages: List[dict], chunk_size: int = 3, overlap: int = 1) -> Lis
         chunks.append(chunk)
         if i + chunk_size >= n:
             break
-        print("start of chunk", i)
-        print("end of chunk", min(i + chunk_size, n))
+        logger.debug("page window", extra={"start": i, "end": min(i + chunk_size, n)})
         i += chunk_size - overlap
     return chunks
 
+def estimate_tokens(text: str) -> int:
+    """Rough token count for Gemini (~4 characters per token for English spec text)"""
+    return (len(text) + 3) // 4
+
+def page_tokens(page: dict) -> int:
+    """Estimated prompt tokens for a page dict, including its tables rendered as markdown"""
+    return estimate_tokens(page['text']) + sum(
+        estimate_tokens(table_to_prompt_markdown(tbl)) for tbl in page.get('tables', [])
+    )
+
+def slice_page(page: dict, start: int, end: Optional[int] = None) -> dict:
+    """
+    Fragment of a page dict covering text[start:end]. Tables whose position
+    falls in that range move with it, their positions made relative to `start`.
+    """
+    text = page['text']
+    end = len(text) if end is None else end
+    tables = []
+    for tbl in page.get('tables', []):
+        pos = tbl.get('position', len(text))
+        if start <= pos < end or (pos == end == len(text)):
+            tables.append({**tbl, 'position': pos - start})
+    return {"text": text[start:end], "tables": tables}
+
+def split_page(page: dict, token_budget: int) -> List[dict]:
+    """
+    Split a page that is over budget into line-aligned fragments that fit.
+    Each table stays with the fragment its position falls in, and counts
+    toward that fragment's budget.
+    """
+    text = page['text']
+    table_tokens: Dict[int, int] = {}
+    for tbl in page.get('tables', []):
+        pos = tbl.get('position', len(text))
+        table_tokens[pos] = table_tokens.get(pos, 0) + estimate_tokens(table_to_prompt_markdown(tbl))
+    cuts = [0]
+    current_tokens = 0
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line) + sum(
+            tokens for pos, tokens in table_tokens.items() if offset <= pos < offset + len(line)
+        )
+        if offset > cuts[-1] and current_tokens + line_tokens > token_budget:
+            cuts.append(offset)
+            current_tokens = 0
+        current_tokens += line_tokens
+        offset += len(line)
+    cuts.append(None)
+    return [slice_page(page, cuts[i], cuts[i + 1]) for i in range(len(cuts) - 1)]
+
+def tail_text(text: str, token_limit: int) -> str:
+    """Last whole lines of `text` that fit in `token_limit` tokens"""
+    tail: List[str] = []
+    tokens = 0
+    for line in reversed(text.splitlines(keepends=True)):
+        line_tokens = estimate_tokens(line)
+        if tokens + line_tokens > token_limit:
+            break
+        tail.append(line)
+        tokens += line_tokens
+    return "".join(reversed(tail))
+
+def make_token_chunks(pages: List[dict], token_budget: int = CHUNK_TOKEN_BUDGET,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[List[dict]]:
+    """
+    Packs pages into chunks of at most `token_budget` estimated tokens.
+    Instead of repeating a whole page, each chunk after the first starts with
+    the last `overlap_tokens` worth of lines from the previous chunk.
+    """
+    units: List[dict] = []
+    for page in pages:
+        if page_tokens(page) > token_budget - overlap_tokens:
+            units.extend(split_page(page, token_budget - overlap_tokens))
+        else:
+            units.append(page)
+
+    chunks: List[List[dict]] = []
+    current: List[dict] = []
+    current_tokens = 0
+    for unit in units:
+        unit_tokens = page_tokens(unit)
+        if current and current_tokens + unit_tokens > token_budget:
+            chunks.append(current)
+            overlap_text = tail_text(current[-1]['text'], overlap_tokens) if overlap_tokens else ""
+            current = [{"text": overlap_text, "tables": []}] if overlap_text.strip() else []
+            current_tokens = estimate_tokens(overlap_text) if current else 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def section_segments(pages: List[dict], boundaries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Cut the document into segments at article boundaries: the preamble, then
+    one segment per article. The first article of a part is cut at its PART
+    heading instead, so the heading travels with the part's content.
+    Each segment: {"fragments": [page dicts], "part": int | None,
+                   "part_title": str, "heading": str, "first_in_part": bool}
+    """
+    cuts = []
+    part_titles = {}
+    pending_part = None
+    for b in boundaries:
+        if b['kind'] == 'part':
+            part_titles[b['part']] = b['title']
+            pending_part = b
+            continue
+        start = pending_part if pending_part is not None and pending_part['part'] == b['part'] else b
+        cuts.append({
+            "page": start['page'],
+            "offset": start['offset'],
+            "part": b['part'],
+            "heading": f"{b['index']} {b['title']}".strip(),
+            "first_in_part": start is pending_part,
+        })
+        pending_part = None
+
+    segments = []
+    starts = [{"page": 0, "offset": 0, "part": None, "heading": "", "first_in_part": False}] + cuts
+    for i, cut in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else {"page": len(pages) - 1, "offset": None}
+        fragments = []
+        for page_num in range(cut['page'], end['page'] + 1):
+            frag_start = cut['offset'] if page_num == cut['page'] else 0
+            frag_end = end['offset'] if page_num == end['page'] else None
+            fragment = slice_page(pages[page_num], frag_start, frag_end)
+            if fragment['text'].strip() or fragment['tables']:
+                fragments.append(fragment)
+        if not fragments:
+            continue
+        segments.append({
+            "fragments": fragments,
+            "part": cut['part'],
+            "part_title": part_titles.get(cut['part'], f"PART {cut['part']}") if cut['part'] else "",
+            "heading": cut['heading'],
+            "first_in_part": cut['first_in_part'],
+        })
+    return segments
+
+def make_section_chunks(pages: List[dict], token_budget: int = CHUNK_TOKEN_BUDGET,
+                        overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[List[dict]]:
+    """
+    Chunks that only cut at MasterFormat article boundaries. Whole articles are
+    packed up to `token_budget`; an article over budget on its own is split
+    with make_token_chunks. A chunk that starts inside a PART (or inside an
+    article) begins with a short "(continued)" heading line, so the LLM files
+    its items under the right part. Falls back to make_token_chunks when no
+    headings are found.
+    """
+    boundaries = find_boundaries(pages)
+    if not any(b['kind'] == 'article' for b in boundaries):
+        return make_token_chunks(pages, token_budget, overlap_tokens)
+
+    def context(segment: Dict[str, Any], inside_article: bool = False) -> List[dict]:
+        lines = []
+        if segment['part'] and (inside_article or not segment['first_in_part']):
+            lines.append(f"{segment['part_title']} (continued)")
+        if inside_article and segment['heading']:
+            lines.append(f"{segment['heading']} (continued)")
+        return [{"text": "\n".join(lines), "tables": []}] if lines else []
+
+    chunks: List[List[dict]] = []
+    current: List[dict] = []
+    current_tokens = 0
+    for segment in section_segments(pages, boundaries):
+        segment_tokens = sum(page_tokens(frag) for frag in segment['fragments'])
+        if segment_tokens > token_budget:
+            # Oversized article: split inside it, repeating its heading on every piece
+            if current:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            pieces = make_token_chunks(segment['fragments'], token_budget, overlap_tokens)
+            for i, piece in enumerate(pieces):
+                chunks.append(context(segment, inside_article=i > 0) + piece)
+            continue
+        if current and current_tokens + segment_tokens > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        if not current:
+            current = context(segment)
+        current.extend(segment['fragments'])
+        current_tokens += segment_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
 # --- LLM Prompt Construction ---
 
+def table_to_prompt_markdown(tbl: dict) -> str:
+    """Render an extracted table as a markdown block for the prompt"""
+    headers = " | ".join(str(h) for h in tbl['headers'])
+    separator = " | ".join(['---'] * len(tbl['headers']))
+    rows = "\n".join(" | ".join(str(cell) for cell in row) for row in tbl['rows'])
+    return f"\nTABLE:\n| {headers} |\n| {separator} |\n{rows}\n"
+
+def chunk_prompt_text(chunk_pages: List[dict]) -> str:
+    """A chunk's text with its tables inlined as markdown"""
+    text_blocks = []
+    for page in chunk_pages:
+        # Add tables as markdown where they sit in the page, so Gemini can "see" them in context
+        text = page['text']
+        cursor = 0
+        trailing = []
+        for tbl in sorted(page.get('tables', []), key=lambda t: t.get('position', len(text))):
+            if 'position' not in tbl:
+                trailing.append(tbl)
+                continue
+            text_blocks.append(text[cursor:tbl['position']].rstrip("\n"))
+            text_blocks.append(table_to_prompt_markdown(tbl))
+            cursor = tbl['position']
+        text_blocks.append(text[cursor:])
+        for tbl in trailing:
+            text_blocks.append(table_to_prompt_markdown(tbl))
+    return "\n".join(text_blocks)
+
 def build_prompt(chunk_pages: List[dict], chunk_num: int, total_chunks: int) -> str:
     """
     Builds the LLM prompt for a given chunk.
     """
-    # Join all text and tables in this chunk
-    text_blocks = []
-    for page in chunk_pages:
-        text_blocks.append(page['text'])
-        # Add tables as markdown, so Gemini can "see" them in the chunk
-        for tbl in page.get('tables', []):
-            headers = " | ".join(str(h) for h in tbl['headers'])
-            separator = " | ".join(['---'] * len(tbl['headers']))
-            rows = "\n".join(" | ".join(str(cell) for cell in row) for row in tbl['rows'])
-            table_md = f"\nTABLE:\n| {headers} |\n| {separator} |\n{rows}\n"
-            text_blocks.append(table_md)
-    chunk_text = "\n".join(text_blocks)
+    chunk_text = chunk_prompt_text(chunk_pages)
     
     return f"""
     You are an expert at parsing construction specifications formatted in MasterFormat.
@@ -240,118 +651,460 @@ def build_prompt(chunk_pages: List[dict], chunk_num: int, total_chunks: int) ->
     \"\"\"
     """
 
+def chunk_cache_text(prompt_builder: Callable[[List[dict], int, int], str], chunk_pages: List[dict]) -> str:
+    """
+    What a chunk's response is cached under: its prompt with the position
+    ("chunk N of M") left out, so the template, instructions and chunk text.
+    A revision that adds or removes chunks elsewhere keeps this chunk's key.
+    """
+    return prompt_builder(chunk_pages, 0, 0)
+
+def build_structured_prompt(chunk_pages: List[dict], chunk_num: int, total_chunks: int) -> str:
+    """
+    Prompt for a chunk in structured-output mode: the JSON shape comes from
+    SECTION_SCHEMA, so only the extraction rules are spelled out.
+    """
+    chunk_text = chunk_prompt_text(chunk_pages)
+
+    return f"""
+    You are an expert at parsing construction specifications formatted in MasterFormat.
+
+    This is chunk {chunk_num} of {total_chunks}. Only extract content present in this chunk.
+
+    - Extract all content verbatim. Do not summarize, rephrase or omit technical content.
+    - Ignore headers, footers, cover page text and metadata.
+    - "section" is the section number and "name" its title; items of PART 1, 2 and 3 go in part1, part2 and part3.
+    - Use the numbering exactly as printed ("1.04", "A.", "1.", "a.") as "index" and the rest of the item as "text".
+    - Nest sub-items under "children" (article -> A. -> 1. -> a. -> 1) -> a)); use null when there are none.
+    - Attach each table to the item it belongs to as "tables", with its headers and rows as shown.
+    - Join lines broken by the page layout into continuous sentences.
+    - If a heading near the start or end of the chunk seems incomplete, extract it with whatever content is available.
+
+    PDF Text (Chunk {chunk_num} of {total_chunks}):
+    \"\"\"
+    {chunk_text}
+    \"\"\"
+    """
+
+def region_page(region: Dict[str, Any]) -> dict:
+    """A region's source lines and tables as one page dict, tables placed where they occurred"""
+    lines: List[str] = []
+    tables = []
+    offset = 0
+    for item in region['content']:
+        if isinstance(item, dict):
+            tables.append({**item, 'position': offset})
+        else:
+            lines.append(item + "\n")
+            offset += len(item) + 1
+    return {"text": "".join(lines), "tables": tables}
+
+def split_region(region: Dict[str, Any], token_budget: int = CHUNK_TOKEN_BUDGET,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[List[dict]]:
+    """
+    A region's content in pieces of at most `token_budget` tokens: one piece
+    if it fits, else split with make_token_chunks, each later piece starting
+    with its heading marked "(continued)" like an oversized article chunk.
+    """
+    page = region_page(region)
+    if not token_budget or page_tokens(page) <= token_budget:
+        return [[page]]
+    continued = [{"text": f"{region['heading']} (continued)", "tables": []}] if region['heading'] else []
+    heading_tokens = sum(page_tokens(line) for line in continued)
+    pieces = make_token_chunks([page], token_budget - heading_tokens, overlap_tokens)
+    return [pieces[0]] + [continued + piece for piece in pieces[1:]]
+
+def build_region_prompt(region: Dict[str, Any], section: str, name: str,
+                        previous_heading: str, next_heading: str,
+                        piece: Optional[List[dict]] = None, split: bool = False) -> str:
+    """
+    Short prompt for one region the rules parser was unsure about. The rest of
+    the section is already structured, so the LLM only sees this region's
+    lines plus where it sits in the document, and returns just its items.
+    A region over the token budget is sent in pieces (see split_region):
+    `piece` is one of them and `split` says there are others.
+    """
+    region_text = chunk_prompt_text(piece if piece is not None else [region_page(region)])
+    split_note = (
+        "\n    - The fragment is too long to send at once; this is one piece of it. Structure only this piece,"
+        " giving each item its full index path (nest continued items under their article or paragraph)."
+        if split else ""
+    )
+    return f"""
+    You are an expert at parsing construction specifications formatted in MasterFormat.
+
+    The section below has already been parsed, except for one fragment. Structure only that fragment.
+
+    Section: {section} {name}
+    Part: {region['part_title']}
+    Preceding item: {previous_heading or "(none, the fragment starts the part)"}
+    Following item: {next_heading or "(none, the fragment ends the part)"}
+
+    **Instructions:**
+    - Return only a JSON object: {{"partItems": [ ... ]}}, with no explanations or markdown.
+    - Each item is {{"index": "string", "text": "string", "children": [ ... ] or null}}, nested as article -> A. -> 1. -> a. -> 1) -> a).
+    - Use the numbering exactly as printed ("1.04", "A.", "1.", "a.") as "index"; "text" is the item text without its number, verbatim.
+    - Attach each table to the item it belongs to as "tables": [{{"headers": [...], "rows": [[...]]}}].
+    - Do not repeat the preceding or following items, and drop page headers, footers and page numbers.
+    - Join lines broken by the page layout into continuous sentences.{split_note}
+
+    Fragment:
+    \"\"\"
+    {region_text}
+    \"\"\"
+    """
+
+def merge_region_pieces(part: int, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    One region's items from its pieces' answers, merged by index path like
+    overlapping chunks (the earlier piece's text wins). Empty if any piece
+    came back without items, so the region keeps its rule-based version.
+    """
+    item_lists = [result.get('partItems') for result in results]
+    if not all(isinstance(items, list) and items for items in item_lists):
+        return []
+    if len(item_lists) == 1:
+        return item_lists[0]
+    merger = TreeMerger()
+    for order, items in enumerate(item_lists):
+        merger.add({f"part{part}": {"partItems": items}}, order=order)
+    document = merger.snapshot(inline_tables=False)
+    return [item for n in (1, 2, 3) for item in document[f"part{n}"]["partItems"]]
+
+def build_repair_prompt(response_text: str, error: str) -> str:
+    """
+    Cheap second try for a response that arrived but could not be used:
+    only the broken output goes back, not the source text.
+    """
+    return f"""
+    The JSON below was meant to be a MasterFormat section parsed into
+    {{"section", "name", "part1", "part2", "part3"}} (each part a {{"partItems": [...]}} list of
+    {{"index", "text", "children", "tables"}} items), or a bare {{"partItems": [...]}} fragment.
+    It could not be used: {error}
+
+    Return the same content as one valid JSON object of that shape. Fix only syntax and structure;
+    do not add, drop or reword any text. Return only the JSON, with no explanations or markdown.
+
+    JSON:
+    \"\"\"
+    {response_text}
+    \"\"\"
+    """
+
 # --- LLM Call + JSON Parsing for One Chunk ---
 
-def parse_chunk_with_gemini(prompt: str) -> Dict[str, Any]:
+def empty_chunk_result() -> Dict[str, Any]:
+    """Empty section skeleton used when a chunk could not be parsed"""
+    return {
+        "section": "",
+        "name": "",
+        "part1": {"partItems": []},
+        "part2": {"partItems": []},
+        "part3": {"partItems": []}
+    }
+
+# A streamed response is also abandoned after this many JSON repairs, or if no object starts this early
+STREAM_MAX_REPAIRS = 20
+STREAM_MAX_PREAMBLE_CHARS = 2000
+
+class MalformedResponse(ValueError):
     """
-    Sends prompt to Gemini, cleans and parses response, handles errors.
+    A response that arrived but cannot be used. `response_text` is kept when
+    a repair prompt could fix it (empty for runaway or non-JSON output).
     """
-    if not GEMINI_API_KEY:
-        raise Exception("GEMINI_API_KEY environment variable is not set")
-    
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-pro')
-    
+
+    def __init__(self, message: str, response_text: str = ""):
+        super().__init__(message)
+        self.response_text = response_text
+
+class ChunkFailed(Exception):
+    """A chunk that could not be parsed within its retries"""
+
+def is_quota_error(error: Exception) -> bool:
+    """Gemini's "429 Resource has been exhausted", by type or HTTP status (not by message text)"""
+    return isinstance(error, ResourceExhausted) or getattr(error, "code", None) == 429
+
+# Called as on_item(fragment) with each top-level item of a response as soon as it closes,
+# wrapped like the response itself (e.g. {"part2": {"partItems": [item]}})
+ResponseItemCallback = Callable[[Dict[str, Any]], None]
+
+def stream_chunk_response(client, prompt: str, model_name: str,
+                          on_item: Optional[ResponseItemCallback] = None,
+                          schema: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Generate with streaming and parse the response while it arrives. The
+    generation is abandoned as soon as the output is clearly malformed or
+    stuck repeating itself, keeping the items completed before that.
+    Returns (result, complete) like parse_llm_json.
+    """
+    def emit(path: Tuple[str, ...], item: Any) -> None:
+        if on_item and isinstance(item, dict):
+            fragment: Any = [normalize_quotes_in_place(item)]
+            for key in reversed(path):
+                fragment = {key: fragment}
+            on_item(fragment)
+
+    extractor = JSONExtractor(on_item=emit)
+    fragments: List[str] = []
+    received, tail, reason = 0, "", None
+    # Parsing (and the on_item callbacks) happens between fragments; it is timed as json, not llm
+    parse_seconds = 0.0
+    start = time.perf_counter()
+    stream = client.generate_stream(prompt, model_name, schema)
     try:
-        response = model.generate_content(prompt)
-        response_text = clean_llm_response(response.text)
-        
+        for fragment in stream:
+            fed = time.perf_counter()
+            extractor.feed(fragment)
+            parse_seconds += time.perf_counter() - fed
+            fragments.append(fragment)
+            received += len(fragment)
+            tail = (tail + fragment)[-STREAM_REPEAT_CHARS:]
+            if extractor.complete:
+                break
+            if not extractor.started and received > STREAM_MAX_PREAMBLE_CHARS:
+                reason = "no JSON object"
+            elif extractor.repairs > STREAM_MAX_REPAIRS:
+                reason = "malformed JSON"
+            elif repeating_tail(tail, STREAM_REPEAT_CHARS):
+                reason = "repeating output"
+            if reason:
+                break
+    finally:
+        # Stops the generation if we broke off early
+        stream.close()
+        STAGE_SECONDS.observe(time.perf_counter() - start - parse_seconds, stage="llm")
+        LLM_TOKENS.inc(estimate_tokens("".join(fragments)), direction="output")
+
+    start = time.perf_counter()
+    try:
+        if reason:
+            logger.warning("generation abandoned", extra={"chars": received, "reason": reason})
+            try:
+                result = extractor.parse(checkpoint=True)
+            except ValueError as e:
+                raise MalformedResponse(f"{reason}: {str(e)}")
+        else:
+            try:
+                result = extractor.parse()
+            except ValueError as e:
+                # Output without any JSON object is not worth a repair prompt
+                raise MalformedResponse(str(e), "".join(fragments) if extractor.started else "")
+        if not isinstance(result, dict):
+            raise MalformedResponse("JSON response is not an object", "".join(fragments))
+    finally:
+        STAGE_SECONDS.observe(parse_seconds + time.perf_counter() - start, stage="json")
+    return result, extractor.complete
+
+def request_chunk(client, prompt: str, model_name: str,
+                  on_item: Optional[ResponseItemCallback] = None,
+                  schema: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], bool]:
+    """One generation, parsed and validated: (result, complete). Raises MalformedResponse."""
+    response_text = ""
+    if LLM_STREAMING:
+        result, complete = stream_chunk_response(client, prompt, model_name, on_item, schema)
+    else:
+        with timed("llm"):
+            response_text = client.generate(prompt, model_name, schema)
+        LLM_TOKENS.inc(estimate_tokens(response_text or ""), direction="output")
+        try:
+            with timed("json"):
+                result, complete = parse_llm_json(response_text)
+        except ValueError as e:
+            raise MalformedResponse(str(e), response_text if "{" in response_text else "")
+    errors: List[str] = []
+    if schema is not None:
+        with timed("validate"):
+            errors = validate(result, schema)
+    if errors:
+        raise MalformedResponse(
+            f"Response does not match the schema: {'; '.join(errors[:3])}"
+            f"{f' (+{len(errors) - 3} more)' if len(errors) > 3 else ''}",
+            response_text or json.dumps(result, ensure_ascii=False),
+        )
+    return result, complete
+
+def fetch_chunk(prompt: str, on_item: Optional[ResponseItemCallback] = None,
+                schema: Optional[Dict[str, Any]] = None,
+                report: Optional[ParseReport] = None,
+                cache_text: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Sends prompt to Gemini and parses the response, retrying on failure.
+    Returns (result, complete): `complete` is False for items recovered from
+    a response that was cut off or abandoned mid-stream, or rebuilt by a
+    repair prompt, which may be missing content.
+    A response that arrived but is unusable is first sent back alone with a
+    repair prompt; API errors and output that cannot be repaired are retried
+    with jittered exponential backoff. Each retry is drawn from the document's
+    `report` budget, and at most LLM_MAX_RETRIES are made per chunk.
+    Raises ChunkFailed once out of retries.
+
+    Every call waits its turn in the process-wide scheduler (ratelimit.py),
+    as part of `report`'s document and with its priority. A quota error
+    pauses all calls for the backoff delay.
+
+    Complete responses are cached by model name, schema and `cache_text`
+    (the prompt itself by default; see chunk_cache_text).
+    With LLM_STREAMING, `on_item` gets each item as soon as it is generated.
+    With a `schema`, Gemini answers in JSON mode and the result is validated against it.
+    """
+    client = get_llm_client()
+    client.ensure_ready()
+    model_name = client.model_name
+
+    cache = get_cache()
+    key = chunk_key(prompt if cache_text is None else cache_text, model_name, schema)
+    if cache is not None:
+        cached = cache.get("chunk", key)
+        if cached is not None:
+            CACHE_HITS.inc(kind="chunk")
+            return cached, True
+
+    report = report if report is not None else ParseReport()
+    scheduler = get_scheduler()
+    request = prompt
+    attempt = 0
+    while True:
+        quota_error = False
+        try:
+            tokens = estimate_tokens(request)
+            LLM_QUEUE_SECONDS.observe(scheduler.acquire(tokens, report, report.priority), priority=report.priority)
+            LLM_TOKENS.inc(tokens, direction="input")
+            result, complete = request_chunk(client, request, model_name, on_item, schema)
+            LLM_REQUESTS.inc(outcome="ok")
+            result = normalize_quotes_in_place(result)
+            # A repair prompt only sees the broken output, which may itself have been cut short
+            complete = complete and request is prompt
+            if not complete:
+                # Keep what the response holds, but let a later run try for all of it
+                logger.warning("recovered items from an incomplete response")
+            elif cache is not None:
+                cache.set("chunk", key, result)
+            return result, complete
+        except MalformedResponse as e:
+            error, response_text = e, e.response_text
+            LLM_REQUESTS.inc(outcome="malformed")
+            logger.warning("malformed response", extra={"error": str(e), "response_head": response_text[:200]})
+        except Exception as e:
+            error, response_text = e, ""
+            quota_error = is_quota_error(e)
+            LLM_REQUESTS.inc(outcome="error")
+            logger.warning("Gemini request failed", extra={"error": str(e)})
+
+        if attempt >= LLM_MAX_RETRIES or not report.take_retry():
+            raise ChunkFailed(str(error))
+        attempt += 1
+        if response_text and request is prompt:
+            LLM_RETRIES.inc(kind="repair")
+            logger.info("asking Gemini to repair the response", extra={"retry": attempt, "max_retries": LLM_MAX_RETRIES})
+            report.count_repair()
+            request = build_repair_prompt(response_text, str(error))
+        else:
+            delay = backoff_delay(attempt - 1)
+            LLM_RETRIES.inc(kind="backoff")
+            logger.info("retrying chunk", extra={"retry": attempt, "max_retries": LLM_MAX_RETRIES,
+                                                 "delay": round(delay, 2), "quota_error": quota_error})
+            if quota_error:
+                # Everyone backs off, not just this chunk; acquire() waits it out
+                scheduler.pause(delay)
+            else:
+                time.sleep(delay)
+            request = prompt
+
+def parse_chunk_with_gemini(prompt: str, on_item: Optional[ResponseItemCallback] = None,
+                            schema: Optional[Dict[str, Any]] = None,
+                            report: Optional[ParseReport] = None) -> Dict[str, Any]:
+    """fetch_chunk's result, with the empty section skeleton in place of a chunk that failed"""
+    try:
+        return fetch_chunk(prompt, on_item, schema, report)[0]
+    except ChunkFailed as e:
+        CHUNKS_FAILED.inc()
+        logger.warning("giving up on chunk", extra={"error": str(e)})
+        return empty_chunk_result()
+
+# --- Concurrent Chunk Dispatch ---
+
+# Called as on_chunk(chunk_index, total_chunks, chunk_json) whenever a chunk finishes
+ChunkCallback = Callable[[int, int, Dict[str, Any]], None]
+# Called as on_item(chunk_index, chunk_json) with a chunk fragment holding one item, as soon as it is generated
+ItemCallback = Callable[[int, Dict[str, Any]], None]
+
+def dispatch_chunks(prompts: List[str], max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                    on_chunk: Optional[ChunkCallback] = None,
+                    on_item: Optional[ItemCallback] = None,
+                    schema: Optional[Dict[str, Any]] = None,
+                    report: Optional[ParseReport] = None,
+                    labels: Optional[List[Dict[str, Any]]] = None,
+                    cache_texts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Sends chunk prompts to Gemini in parallel, with at most `max_concurrency`
+    requests in flight. Results are returned in chunk order; `on_chunk` is
+    notified in completion order, `on_item` while chunks are still generating.
+    `schema` is the response schema for structured output, if used, and
+    `cache_texts` what each response is cached under (see fetch_chunk).
+    Retries are drawn from `report`, which also records each chunk that
+    failed or came back incomplete (described by its entry in `labels`); a
+    failed chunk's result is the empty section skeleton.
+    """
+    report = report if report is not None else ParseReport()
+
+    def item_relay(idx: int) -> Optional[ResponseItemCallback]:
+        return (lambda fragment: on_item(idx, fragment)) if on_item else None
+
+    def run(idx: int, prompt: str) -> Dict[str, Any]:
         try:
-            result = json.loads(response_text)
-            result = normalize_json_quotes(result)
+            result, complete = fetch_chunk(prompt, item_relay(idx), schema, report,
+                                           cache_texts[idx] if cache_texts else None)
+            if not complete:
+                report.chunk_incomplete(**(labels[idx] if labels else {"chunk": idx + 1}))
             return result
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error in chunk: {str(e)}")
-            print(f"Raw response: {response_text[:200]}...")
-            # Return empty structure instead of failing
-            return {
-                "section": "",
-                "name": "",
-                "part1": {"partItems": []},
-                "part2": {"partItems": []},
-                "part3": {"partItems": []}
-            }
-    except Exception as e:
-        print(f"Error processing chunk with Gemini: {str(e)}")
-        # Return empty structure instead of failing
-        return {
-            "section": "",
-            "name": "",
-            "part1": {"partItems": []},
-            "part2": {"partItems": []},
-            "part3": {"partItems": []}
+        except ChunkFailed as e:
+            CHUNKS_FAILED.inc()
+            logger.warning("giving up on chunk", extra={"chunk": idx + 1, "error": str(e)})
+            report.chunk_failed(str(e), **(labels[idx] if labels else {"chunk": idx + 1}))
+            return empty_chunk_result()
+
+    total_chunks = len(prompts)
+    if max_concurrency <= 1 or total_chunks <= 1:
+        results = []
+        for idx, prompt in enumerate(prompts):
+            logger.debug("chunk started", extra={"chunk": idx + 1, "total": total_chunks})
+            results.append(run(idx, prompt))
+            if on_chunk:
+                on_chunk(idx, total_chunks, results[idx])
+        return results
+
+    results: List[Dict[str, Any]] = [None] * total_chunks
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, total_chunks)) as executor:
+        futures = {
+            executor.submit(run, idx, prompt): idx
+            for idx, prompt in enumerate(prompts)
         }
+        for future in as_completed(futures):
+            idx = futures[future]
+            results[idx] = future.result()
+            logger.debug("chunk finished", extra={"chunk": idx + 1, "total": total_chunks})
+            if on_chunk:
+                on_chunk(idx, total_chunks, results[idx])
+    return results
 
 # --- Merge and Deduplicate ---
 
-def table_hash(tbl):
-    """Create a hash for table deduplication"""
-    # Use headers + all rows for hashable tuple
-    return (tuple(tbl['headers']), tuple(tuple(row) for row in tbl['rows']))
-
 def dedupe_tables(node, seen_tables=None):
     """Recursively deduplicate tables in the JSON structure"""
-    if seen_tables is None:
-        seen_tables = set()
-    # Dedupe tables at this node
-    if 'tables' in node:
-        unique_tables = []
-        for tbl in node['tables']:
-            thash = table_hash(tbl)
-            if thash not in seen_tables:
-                unique_tables.append(tbl)
-                seen_tables.add(thash)
-        node['tables'] = unique_tables
-    # Recurse to children
-    for k in ['children', 'partItems']:
-        if k in node and node[k]:
-            for child in node[k]:
-                dedupe_tables(child, seen_tables)
+    walk_document(node, [dedupe_tables_hook], {"seen_tables": set() if seen_tables is None else seen_tables})
 
 def remove_empty_tables(node):
     """Remove empty 'tables' fields at any level"""
-    if isinstance(node, dict):
-        # Remove tables if empty
-        if 'tables' in node and isinstance(node['tables'], list) and not node['tables']:
-            del node['tables']
-        # Recurse for all keys
-        for k, v in node.items():
-            remove_empty_tables(v)
-    elif isinstance(node, list):
-        for item in node:
-            remove_empty_tables(item)
+    walk_document(node, [remove_empty_tables_hook])
+
 def tables_to_markdown(node):
     """
     Recursively traverse the JSON structure.
     If a node contains 'tables', append their markdown to the 'text' field,
     and remove the 'tables' key.
     """
-    if isinstance(node, dict):
-        # Process tables at this node
-        if 'tables' in node and isinstance(node['tables'], list) and node['tables']:
-            md_tables = []
-            for tbl in node['tables']:
-                headers = " | ".join(str(h) for h in tbl['headers'])
-                separator = " | ".join(['---'] * len(tbl['headers']))
-                rows = "\n".join(" | ".join(str(cell) for cell in row) for row in tbl['rows'])
-                title = f"**{tbl.get('title', '')}**\n" if tbl.get('title') else ""
-                table_md = f"{title}| {headers} |\n| {separator} |\n{rows}"
-                md_tables.append(table_md)
-            # Append the markdown tables to the text field
-            if 'text' in node and isinstance(node['text'], str):
-                node['text'] = node['text'].rstrip() + "\n\n" + "\n\n".join(md_tables)
-            else:
-                node['text'] = "\n\n".join(md_tables)
-            # Remove the original 'tables' array
-            del node['tables']
-        # Recursively process children/partItems
-        for k in ['children', 'partItems']:
-            if k in node and node[k]:
-                for child in node[k]:
-                    tables_to_markdown(child)
-    elif isinstance(node, list):
-        for item in node:
-            tables_to_markdown(item)
+    walk_document(node, [tables_to_markdown_hook])
+
 def deduplicate_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Remove duplicate items based on index and text.
@@ -365,98 +1118,434 @@ def deduplicate_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             seen.add(identifier)
     return result
 
-def merge_json_chunks(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
-    def merge_part_items(all_items):
-        seen = {}
-        for item in all_items:
-            idx = item.get('index')
-            # Prefer item with more children, then longer text
-            if idx in seen:
-                prev = seen[idx]
-                prev_children = prev.get('children') or []
-                curr_children = item.get('children') or []
-                if len(str(curr_children)) > len(str(prev_children)):
-                    seen[idx] = item
-                elif len(str(curr_children)) == len(str(prev_children)):
-                    # Fall back to longer text
-                    if len(str(item.get('text', ''))) > len(str(prev.get('text', ''))):
-                        seen[idx] = item
-            else:
-                seen[idx] = item
-        return list(seen.values())
-    
-    # Merge as before, but use new merge_part_items
-    merged = None
-    for chunk in chunks:
-        if chunk.get('section') or chunk.get('name'):
-            merged = chunk.copy()
-            break
-    if merged is None:
-        merged = chunks[0].copy()
-    for part in ['part1', 'part2', 'part3']:
-        all_items = []
-        for chunk in chunks:
-            if part in chunk and isinstance(chunk[part], dict):
-                part_items = chunk[part].get('partItems', [])
-                all_items.extend(part_items)
-        merged[part]['partItems'] = merge_part_items(all_items)
-    return merged
+def merge_json_chunks(chunks: List[Dict[str, Any]],
+                      coverages: Optional[List[Dict[str, int]]] = None) -> Dict[str, Any]:
+    """
+    Merge chunk results by index path (see merge.TreeMerger). `coverages`,
+    one chunk_coverage per chunk, decides which chunk's text wins when
+    overlapping chunks disagree about a node.
+    """
+    merger = TreeMerger()
+    for i, chunk in enumerate(chunks):
+        merger.add(chunk, coverages[i] if coverages else None, order=i)
+    return merger.snapshot(inline_tables=False)
+
+# --- Single-pass Post-processing ---
+
+# Called as hook(node, state) on every node, parents before children; `state` is shared for one walk
+NodeHook = Callable[[Dict[str, Any], Dict[str, Any]], None]
+
+PART_KEYS = ('part1', 'part2', 'part3')
+NODE_LIST_KEYS = ('children', 'partItems')
+
+def walk_document(node, hooks: List[NodeHook], state: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Visit a document, part, item or list of items once, in document order,
+    running every hook on each node in turn. Hooks mutate nodes in place.
+    """
+    state = {} if state is None else state
+    if isinstance(node, dict) and any(key in node for key in PART_KEYS):
+        # Document root: visit it, then its parts, which hold the partItems
+        for hook in hooks:
+            hook(node, state)
+        node = [node[key] for key in PART_KEYS if isinstance(node.get(key), dict)]
+    stack = list(reversed(node)) if isinstance(node, list) else [node]
+    while stack:
+        current = stack.pop()
+        if not isinstance(current, dict):
+            continue
+        for hook in hooks:
+            hook(current, state)
+        for key in NODE_LIST_KEYS:
+            children = current.get(key)
+            if children and isinstance(children, list):
+                stack.extend(reversed(children))
+
+def normalize_quotes_in_place(obj):
+    """Normalize quotes in every string of a parsed JSON value, without rebuilding it"""
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, str):
+                obj[key] = normalize_quotes(value)
+            elif isinstance(value, (dict, list)):
+                normalize_quotes_in_place(value)
+    elif isinstance(obj, list):
+        for i, value in enumerate(obj):
+            if isinstance(value, str):
+                obj[i] = normalize_quotes(value)
+            elif isinstance(value, (dict, list)):
+                normalize_quotes_in_place(value)
+    return obj
+
+def normalize_quotes_hook(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+    """Normalize quotes in a node's own fields and tables (child nodes get their own visit)"""
+    for key, value in node.items():
+        if isinstance(value, str):
+            node[key] = normalize_quotes(value)
+        elif key not in PART_KEYS and key not in NODE_LIST_KEYS and isinstance(value, (dict, list)):
+            normalize_quotes_in_place(value)
+
+def dedupe_tables_hook(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+    """Drop tables already seen earlier in the document"""
+    if not isinstance(node.get('tables'), list):
+        return
+    seen_tables = state.setdefault('seen_tables', set())
+    unique_tables = []
+    for tbl in node['tables']:
+        thash = table_hash(tbl)
+        if thash not in seen_tables:
+            unique_tables.append(tbl)
+            seen_tables.add(thash)
+    node['tables'] = unique_tables
+
+def tables_to_markdown_hook(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+    """Append a node's tables to its text as markdown and drop the 'tables' key"""
+    if not (isinstance(node.get('tables'), list) and node['tables']):
+        return
+    md_tables = [table_markdown(tbl) for tbl in node['tables']]
+    if isinstance(node.get('text'), str):
+        node['text'] = node['text'].rstrip() + "\n\n" + "\n\n".join(md_tables)
+    else:
+        node['text'] = "\n\n".join(md_tables)
+    del node['tables']
+
+def remove_empty_tables_hook(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+    """Remove an empty 'tables' field"""
+    if isinstance(node.get('tables'), list) and not node['tables']:
+        del node['tables']
+
+# Final clean-up, applied per node in this order during a single walk
+POSTPROCESS_HOOKS: List[NodeHook] = [
+    normalize_quotes_hook,
+    dedupe_tables_hook,
+    remove_empty_tables_hook,
+]
+# The same with INLINE_TABLES, rendering tables into their item's text before the clean-up
+INLINE_POSTPROCESS_HOOKS: List[NodeHook] = [
+    normalize_quotes_hook,
+    dedupe_tables_hook,
+    tables_to_markdown_hook,
+    remove_empty_tables_hook,
+]
+
+# Stage each hook's time is recorded under
+HOOK_STAGES: Dict[NodeHook, str] = {
+    normalize_quotes_hook: "quotes",
+    dedupe_tables_hook: "dedupe",
+    tables_to_markdown_hook: "markdown",
+    remove_empty_tables_hook: "cleanup",
+}
+
+def timed_hooks(hooks: List[NodeHook], seconds: Dict[str, float]) -> List[NodeHook]:
+    """The hooks, each adding the time it spends over a walk to seconds[its stage]"""
+    def timed_hook(hook: NodeHook, stage: str) -> NodeHook:
+        def run(node: Dict[str, Any], state: Dict[str, Any]) -> None:
+            start = time.perf_counter()
+            hook(node, state)
+            seconds[stage] += time.perf_counter() - start
+        return run
+
+    wrapped = []
+    for hook in hooks:
+        stage = HOOK_STAGES.get(hook, hook.__name__)
+        seconds.setdefault(stage, 0.0)
+        wrapped.append(timed_hook(hook, stage))
+    return wrapped
+
+def postprocess_document(merged: Dict[str, Any], hooks: Optional[List[NodeHook]] = None) -> None:
+    """
+    Final clean-up of a merged document, in place and in one walk: normalize
+    quotes, deduplicate tables, drop empty tables (and with INLINE_TABLES,
+    inline tables as markdown first).
+    Each hook's total time is recorded as a stage (see HOOK_STAGES).
+    """
+    logger.debug("post-processing document")
+    if hooks is None:
+        hooks = INLINE_POSTPROCESS_HOOKS if INLINE_TABLES else POSTPROCESS_HOOKS
+    seconds: Dict[str, float] = {}
+    walk_document(merged, timed_hooks(hooks, seconds))
+    observe_stages(seconds)
 
 # --- Main Entry Point for FastAPI ---
 
-def parse_pdf_to_json_chunked(pdf_path: str, chunk_size: int = 3, overlap: int = 1) -> Dict[str, Any]:
+def parse_pdf(pdf_path: str, mode: str = PARSE_MODE, **kwargs) -> Dict[str, Any]:
+    """Parse a PDF with the configured engine ("rules" or "llm")"""
+    mode = "llm" if mode == "llm" else "rules"
+    start = time.perf_counter()
+    if mode == "llm":
+        result = parse_pdf_to_json_chunked(pdf_path, **kwargs)
+    else:
+        result = parse_pdf_to_json_rules(pdf_path, **kwargs)
+    DOCUMENT_SECONDS.observe(time.perf_counter() - start, mode=mode)
+    DOCUMENTS.inc(mode=mode, outcome="success" if result.get("success") else "failure")
+    return result
+
+def parse_pdf_to_json_rules(pdf_path: str, max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                            on_chunk: Optional[ChunkCallback] = None,
+                            token_budget: int = CHUNK_TOKEN_BUDGET,
+                            overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                            min_confidence: float = RULES_MIN_CONFIDENCE,
+                            on_item: Optional[ItemCallback] = None,
+                            priority: str = INTERACTIVE,
+                            pages: Optional[List[dict]] = None) -> Dict[str, Any]:
     """
-    Main pipeline: extract pages, chunk, process each chunk, merge, return output.
+    Rule-based pipeline (see rules_document) over every page of the PDF.
+    Complete results are cached by PDF content and pipeline parameters.
+    `priority` ("interactive" or "batch") is how its Gemini calls are scheduled.
+    `pages` skips extraction when the caller already ran extract_pages_and_tables.
     """
     try:
-        print(f"Starting chunked PDF parsing with chunk_size={chunk_size}, overlap={overlap}")
+        cache = get_cache()
+        doc_key = document_key(hash_file(pdf_path), mode="rules", token_budget=token_budget,
+                               overlap_tokens=overlap_tokens, min_confidence=min_confidence,
+                               furniture=STRIP_PAGE_FURNITURE, structured=LLM_STRUCTURED_OUTPUT,
+                               inline_tables=INLINE_TABLES, model=get_llm_client().model_name)
+        if cache is not None:
+            cached = cache.get("document", doc_key)
+            if cached is not None:
+                CACHE_HITS.inc(kind="document")
+                logger.info("returning cached result for unchanged PDF")
+                return cached
+
+        if pages is None:
+            pages = extract_pages_and_tables(pdf_path)
+            logger.info("pages extracted", extra={"pages": len(pages)})
+        report = ParseReport(priority=priority)
+        report.furniture_removed(**furniture_savings(pages))
+        document = rules_document(pages, max_concurrency, on_chunk, token_budget, overlap_tokens, min_confidence,
+                                  on_item, report)
+        result = {
+            "success": True,
+            "data": document,
+            "error": None,
+            "meta": report.meta()
+        }
+        # Only cache complete results, so a region that failed or was cut short is retried on re-upload
+        if cache is not None and report.complete():
+            cache.set("document", doc_key, result)
+        return result
+
+    except Exception as e:
+        logger.exception("rule-based parsing failed")
+        return {
+            "success": False,
+            "data": None,
+            "error": f"Error processing PDF: {str(e)}"
+        }
+
+def rules_document(pages: List[dict], max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                   on_chunk: Optional[ChunkCallback] = None,
+                   token_budget: int = CHUNK_TOKEN_BUDGET,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                   min_confidence: float = RULES_MIN_CONFIDENCE,
+                   on_item: Optional[ItemCallback] = None,
+                   report: Optional[ParseReport] = None,
+                   last_articles: Optional[Dict[int, int]] = None) -> Dict[str, Any]:
+    """
+    Hybrid pipeline: build the section tree from the extracted text with the
+    MasterFormat numbering grammar, then send only the regions it scored below
+    `min_confidence` to Gemini, each with its part and neighbouring headings,
+    and splice the answers back in place. A region over `token_budget` is sent
+    in pieces (overlapping by `overlap_tokens`) whose answers are merged.
+    Well-formed specs make no LLM calls; a region Gemini cannot parse keeps
+    its rule-based version.
+    The rule-based tree is reported to `on_chunk` as chunk 0, and region
+    items to `on_item` as they are generated. Regions Gemini failed on or
+    answered incompletely are recorded in `report`. `last_articles` seeds the article numbering when
+    the pages are cut out of a longer document (see MasterFormatParser).
+    """
+    with timed("structure"):
+        # Stripped pages have no headers or footers left for the parser's own text-only detector to find
+        document, regions = parse_masterformat(pages, last_articles, skip_repeated=not STRIP_PAGE_FURNITURE)
+
+    if not any(region['node'] is not None for region in regions):
+        # No numbering structure at all: the whole document goes through the chunked LLM path
+        logger.info("no MasterFormat structure found, sending the whole document to Gemini")
+        merged, _ = llm_document(pages, max_concurrency=max_concurrency, on_chunk=on_chunk,
+                                 token_budget=token_budget, overlap_tokens=overlap_tokens, chunking="sections",
+                                 on_item=on_item, report=report)
+        return merged
+
+    uncertain = [region for region in regions if region['confidence'] < min_confidence]
+    logger.info("regions below confidence sent to Gemini",
+                extra={"uncertain": len(uncertain), "regions": len(regions), "min_confidence": min_confidence})
+    # One prompt per region, or per piece of a region over the token budget
+    prompts, owners, labels = [], [], []
+    with timed("prompt"):
+        for i, region in enumerate(uncertain):
+            logger.info("uncertain region", extra={
+                "part": region['part_title'], "region": region['heading'] or "(loose text)",
+                "page_range": f"{region['pages'][0]+1}-{region['pages'][1]+1}",
+                "confidence": round(region['confidence'], 2), "issues": sorted(set(region['issues'])),
+            })
+            siblings = [r for r in regions if r['part'] == region['part']]
+            # By identity: two loose regions can hold equal content
+            at = next(n for n, sibling in enumerate(siblings) if sibling is region)
+            previous_heading = siblings[at - 1]['heading'] if at > 0 else ""
+            next_heading = siblings[at + 1]['heading'] if at + 1 < len(siblings) else ""
+            pieces = split_region(region, token_budget, overlap_tokens)
+            label = {"region": region['heading'] or "(loose text)", "part": region['part'],
+                     "pages": [region['pages'][0] + 1, region['pages'][1] + 1]}
+            for n, piece in enumerate(pieces, 1):
+                prompts.append(build_region_prompt(region, document['section'], document['name'],
+                                                   previous_heading, next_heading, piece, len(pieces) > 1))
+                owners.append(i)
+                labels.append({**label, "piece": n} if len(pieces) > 1 else label)
+
+    total_chunks = len(prompts) + 1
+    if on_chunk:
+        normalize_quotes_in_place(document)
+        on_chunk(0, total_chunks, document)
+
+    def as_chunk(idx: int, result: Dict[str, Any]) -> Dict[str, Any]:
+        """A region's answer in the section schema, for progress reporting"""
+        chunk = empty_chunk_result()
+        chunk['section'], chunk['name'] = document['section'], document['name']
+        chunk[f"part{uncertain[owners[idx]]['part']}"]['partItems'] = result.get('partItems') or []
+        return chunk
+
+    relay = (lambda idx, total, result: on_chunk(idx + 1, total_chunks, as_chunk(idx, result))) if on_chunk else None
+    item_relay = (lambda idx, fragment: on_item(idx + 1, as_chunk(idx, fragment))) if on_item else None
+    results = dispatch_chunks(prompts, max_concurrency, relay, item_relay,
+                              REGION_SCHEMA if LLM_STRUCTURED_OUTPUT else None, report, labels)
+
+    # Loose text is inserted after its anchor before any anchor is replaced
+    order = sorted(range(len(uncertain)), key=lambda i: uncertain[i]['node'] is not None)
+    with timed("merge"):
+        for i in order:
+            items = merge_region_pieces(uncertain[i]['part'],
+                                        [result for result, owner in zip(results, owners) if owner == i])
+            if items:
+                splice_region(document, uncertain[i], items)
+            elif uncertain[i]['node'] is not None:
+                logger.info("keeping rule-based parse", extra={"region": uncertain[i]['heading']})
+
+    postprocess_document(document)
+    return document
+
+
+def parse_pdf_to_json_chunked(pdf_path: str, chunk_size: int = 3, overlap: int = 1,
+                              max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                              on_chunk: Optional[ChunkCallback] = None,
+                              token_budget: Optional[int] = CHUNK_TOKEN_BUDGET,
+                              overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                              chunking: str = CHUNKING_STRATEGY,
+                              on_item: Optional[ItemCallback] = None,
+                              priority: str = INTERACTIVE,
+                              pages: Optional[List[dict]] = None) -> Dict[str, Any]:
+    """
+    Main pipeline: extract pages, then chunk, process, merge (see llm_document).
+    Complete results are cached by PDF content and pipeline parameters.
+    `priority` ("interactive" or "batch") is how its Gemini calls are scheduled.
+    `pages` skips extraction when the caller already ran extract_pages_and_tables.
+    """
+    try:
+        logger.info("chunked parsing started", extra={
+            "chunking": chunking, "token_budget": token_budget, "overlap_tokens": overlap_tokens,
+            "chunk_size": chunk_size, "overlap": overlap, "max_concurrency": max_concurrency,
+        })
+
+        # 0. Return the stored result if this exact PDF was parsed before
+        cache = get_cache()
+        doc_key = document_key(hash_file(pdf_path), mode="llm", chunk_size=chunk_size, overlap=overlap,
+                               token_budget=token_budget, overlap_tokens=overlap_tokens, chunking=chunking,
+                               furniture=STRIP_PAGE_FURNITURE, structured=LLM_STRUCTURED_OUTPUT,
+                               inline_tables=INLINE_TABLES, model=get_llm_client().model_name)
+        if cache is not None:
+            cached = cache.get("document", doc_key)
+            if cached is not None:
+                CACHE_HITS.inc(kind="document")
+                logger.info("returning cached result for unchanged PDF")
+                return cached
         
         # 1. Extract pages from PDF
-        pages = extract_pages_and_tables(pdf_path)
-        print(f"Extracted {len(pages)} pages from PDF")
-        
-        # 2. Make overlapping chunks
-        chunks = make_chunks(pages, chunk_size, overlap)
-        total_chunks = len(chunks)
-        print(f"Created {total_chunks} chunks")
-        
-        # 3. Process each chunk
-        results = []
-        for idx, chunk_pages in enumerate(chunks):
-            print(f"Processing chunk {idx+1}/{total_chunks}")
-            prompt = build_prompt(chunk_pages, idx+1, total_chunks)
-            chunk_json = parse_chunk_with_gemini(prompt)
-            results.append(chunk_json)
-        
-        # 4. Merge and deduplicate outputs
-        print("Merging chunks...")
-        merged = merge_json_chunks(results)
-        
-        # 5. Deduplicate tables across the entire structure
-        print("Deduplicating tables...")
-        dedupe_tables(merged)
-        
-        # 6. Convert tables to markdown and inline in text fields
-        print("Converting tables to markdown and inlining...")
-        tables_to_markdown(merged)
-        
-        # 7. Remove any empty tables arrays (for safety)
-        remove_empty_tables(merged)
-        
-        return {
+        if pages is None:
+            pages = extract_pages_and_tables(pdf_path)
+            logger.info("pages extracted", extra={"pages": len(pages)})
+
+        report = ParseReport(priority=priority)
+        report.furniture_removed(**furniture_savings(pages))
+        merged, complete = llm_document(pages, chunk_size, overlap, max_concurrency, on_chunk,
+                                        token_budget, overlap_tokens, chunking, on_item, report)
+        result = {
             "success": True,
             "data": merged,
-            "error": None
+            "error": None,
+            "meta": report.meta()
         }
+        # Only cache complete results, so a chunk that failed or was cut short is retried on re-upload
+        if cache is not None and complete:
+            cache.set("document", doc_key, result)
+        return result
         
     except Exception as e:
-        print(f"Error in chunked parsing: {str(e)}")
+        logger.exception("chunked parsing failed")
         return {
             "success": False,
             "data": None,
             "error": f"Error processing PDF: {str(e)}"
         }
 
+def llm_document(pages: List[dict], chunk_size: int = 3, overlap: int = 1,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 on_chunk: Optional[ChunkCallback] = None,
+                 token_budget: Optional[int] = CHUNK_TOKEN_BUDGET,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 chunking: str = CHUNKING_STRATEGY,
+                 on_item: Optional[ItemCallback] = None,
+                 report: Optional[ParseReport] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Chunk extracted pages, process chunks concurrently, merge. Returns the
+    document and whether every chunk parsed in full (False if any failed or
+    came back incomplete, see fetch_chunk; with a shared `report`, any chunk
+    recorded in it counts).
+    `chunking` picks the chunker: "sections" cuts at article boundaries and
+    "tokens" packs pages by `token_budget`; "pages" (or token_budget=None) uses
+    the fixed `chunk_size`/`overlap` page windows.
+    `on_chunk` is called with each chunk's parsed JSON as soon as it is available,
+    `on_item` with each of its items while the chunk is still being generated.
+    Retries are drawn from, and failed or incomplete chunks recorded in, `report`.
+    """
+    report = report if report is not None else ParseReport()
+    # 2. Make chunks
+    with timed("chunking"):
+        if not token_budget or chunking == "pages":
+            chunks = make_chunks(pages, chunk_size, overlap)
+        elif chunking == "tokens":
+            chunks = make_token_chunks(pages, token_budget, overlap_tokens)
+        else:
+            chunks = make_section_chunks(pages, token_budget, overlap_tokens)
+    total_chunks = len(chunks)
+    logger.info("chunks created", extra={"chunks": total_chunks})
+    
+    # 3. Process all chunks in parallel (results come back in chunk order)
+    prompt_builder = build_structured_prompt if LLM_STRUCTURED_OUTPUT else build_prompt
+    with timed("prompt"):
+        prompts = [
+            prompt_builder(chunk_pages, idx+1, total_chunks)
+            for idx, chunk_pages in enumerate(chunks)
+        ]
+        cache_texts = [chunk_cache_text(prompt_builder, chunk_pages) for chunk_pages in chunks]
+    # 4. Merge each result as it arrives, while later chunks are still in flight;
+    #    the merger also dedupes tables (and renders them as markdown, so that is timed as merge)
+    coverages = [chunk_coverage(chunk_pages) for chunk_pages in chunks]
+    merger = TreeMerger()
+    merge_seconds = [0.0]
+
+    def fold(idx: int, total: int, chunk_json: Dict[str, Any]) -> None:
+        if on_chunk:
+            on_chunk(idx, total, chunk_json)
+        start = time.perf_counter()
+        merger.add(chunk_json, coverages[idx], order=idx)
+        merge_seconds[0] += time.perf_counter() - start
+
+    dispatch_chunks(prompts, max_concurrency, fold, on_item,
+                    SECTION_SCHEMA if LLM_STRUCTURED_OUTPUT else None, report, cache_texts=cache_texts)
+    start = time.perf_counter()
+    merged = merger.snapshot(inline_tables=INLINE_TABLES)
+    STAGE_SECONDS.observe(merge_seconds[0] + time.perf_counter() - start, stage="merge")
+    return merged, report.complete()
+
 # --- Backward Compatibility ---
 
 def parse_pdf_to_json(pdf_path: str) -> Dict[str, Any]:
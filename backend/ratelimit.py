@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, Hashable, Optional
+
+# Gemini quota of the API key: requests and input tokens per minute (0 disables that limit)
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "360"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "4000000"))
+# Seconds of quota that may go out in one burst; beyond that calls are paced evenly
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", "5"))
+
+# Call priorities: uploads someone is waiting on go before batch work
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# --- Token Bucket ---
+
+class TokenBucket:
+    """
+    Refills at `per_minute` / 60 per second up to `burst_seconds` worth.
+    A call may take more than is left (the level goes negative), as long as
+    the bucket holds what it needs up to a full bucket: large prompts are
+    not starved, and later calls wait off the debt, so the long-run rate is
+    exact. Not thread-safe on its own (LLMScheduler holds the lock).
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = LLM_RATE_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` may be taken (0 for an unlimited bucket)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.level -= amount
+
+# --- Scheduler ---
+
+class LLMScheduler:
+    """
+    Process-wide gate every LLM call passes through before it is sent.
+    Calls wait in one queue per priority and, within a priority, per
+    document; the next call out is taken from the highest priority with
+    waiting calls, round-robin over its documents, so one large upload
+    cannot hold back the rest. It leaves once both the request and the
+    token bucket allow it. pause() holds every call, e.g. after a quota error.
+    """
+
+    def __init__(self, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM,
+                 burst_seconds: float = LLM_RATE_BURST_SECONDS):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        # Priority -> document -> waiting tickets; dict order is the round-robin order
+        self._queues: Dict[str, Dict[Hashable, Deque[object]]] = {p: {} for p in PRIORITIES}
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int, document: Hashable, priority: str = INTERACTIVE) -> float:
+        """Block until a call of about `tokens` input tokens may go out; returns seconds waited"""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority: {priority}")
+        ticket = object()
+        start = time.monotonic()
+        with self._cond:
+            self._queues[priority].setdefault(document, deque()).append(ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._head() is ticket:
+                        wait = max(self._paused_until - time.monotonic(),
+                                   self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            return time.monotonic() - start
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._remove(priority, document, ticket)
+                self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every call for `seconds` (the quota was hit despite the buckets)"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def waiting(self) -> Dict[str, int]:
+        """Calls queued per priority"""
+        with self._cond:
+            return {p: sum(len(q) for q in docs.values()) for p, docs in self._queues.items()}
+
+    def _head(self) -> Optional[object]:
+        for priority in PRIORITIES:
+            for tickets in self._queues[priority].values():
+                return tickets[0]
+        return None
+
+    def _remove(self, priority: str, document: Hashable, ticket: object) -> None:
+        """Drop a ticket; its document moves to the back of the round-robin order"""
+        docs = self._queues[priority]
+        tickets = docs.pop(document)
+        tickets.remove(ticket)
+        if tickets:
+            docs[document] = tickets
+
+# --- Process-wide Instance ---
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
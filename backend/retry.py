@@ -0,0 +1,91 @@
+import os
+import random
+import threading
+from typing import Any, Dict, List
+
+from ratelimit import INTERACTIVE
+
+# Extra attempts one chunk may make, and how many a whole document may spend across its chunks
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BUDGET = int(os.getenv("LLM_RETRY_BUDGET", "10"))
+# Exponential backoff between attempts: base delay, doubled per attempt up to the cap (seconds)
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "30.0"))
+
+# --- Backoff ---
+
+def backoff_delay(attempt: int, base: float = LLM_RETRY_BASE_DELAY, cap: float = LLM_RETRY_MAX_DELAY) -> float:
+    """
+    Seconds to wait before retry number `attempt` (0-based): uniformly random
+    up to base * 2^attempt, capped ("full jitter"), so chunks that failed
+    together do not retry together.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# --- Per-document Report ---
+
+class ParseReport:
+    """
+    Shared by all chunk workers of one document parse: the retry budget
+    they draw from, the priority their calls are scheduled with (the report
+    itself identifies the document to the scheduler), and a record of
+    repairs, retries, chunks that failed for good and chunks whose answer may
+    be missing content (cut off, abandoned mid-stream or rebuilt by a repair
+    prompt), along with what stripping page furniture saved. meta() is what
+    the parse result reports as "meta".
+    """
+
+    def __init__(self, retry_budget: int = LLM_RETRY_BUDGET, priority: str = INTERACTIVE):
+        self.retry_budget = retry_budget
+        self.priority = priority
+        self.retries = 0
+        self.repairs = 0
+        self.failed_chunks: List[Dict[str, Any]] = []
+        self.incomplete_chunks: List[Dict[str, Any]] = []
+        self.chars_removed = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def take_retry(self) -> bool:
+        """Spend one retry from the budget; False once it is used up"""
+        with self._lock:
+            if self.retries >= self.retry_budget:
+                return False
+            self.retries += 1
+            return True
+
+    def count_repair(self) -> None:
+        with self._lock:
+            self.repairs += 1
+
+    def chunk_failed(self, error: str, **details) -> None:
+        """Record a chunk whose content is missing from the result"""
+        with self._lock:
+            self.failed_chunks.append({**details, "error": error})
+
+    def chunk_incomplete(self, **details) -> None:
+        """Record a chunk whose content is in the result, but possibly not all of it"""
+        with self._lock:
+            self.incomplete_chunks.append(details)
+
+    def furniture_removed(self, chars_removed: int, tokens_saved: int) -> None:
+        """Record the page furniture stripped from the document before it was parsed"""
+        with self._lock:
+            self.chars_removed = chars_removed
+            self.tokens_saved = tokens_saved
+
+    def complete(self) -> bool:
+        """Whether every chunk parsed in full, so the result may be cached"""
+        with self._lock:
+            return not self.failed_chunks and not self.incomplete_chunks
+
+    def meta(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "repairs": self.repairs,
+                "failed_chunks": list(self.failed_chunks),
+                "incomplete_chunks": list(self.incomplete_chunks),
+                "chars_removed": self.chars_removed,
+                "tokens_saved": self.tokens_saved,
+            }
@@ -2,7 +2,6 @@
 
 import os
 import json
-import google.generativeai as genai
 from PyPDF2 import PdfReader
 from typing import Dict, Any, List
 from dotenv import load_dotenv
@@ -12,6 +11,8 @@ import fitz  # PyMuPDF
 # Load environment variables from .env file
 load_dotenv()
 
+from llm import get_llm_client
+
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -74,33 +75,12 @@ def parse_pdf_to_json_robust(pdf_path: str) -> Dict[str, Any]:
     
     print(f"🔑 Using API key: {GEMINI_API_KEY[:20]}...")
     
-    # Test API key first
+    # Resolve a working model from the cached availability list (no test generation)
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        
-        # Try different model versions in order of preference
-        model_versions = ['gemini-1.5-pro', 'gemini-1.5-pro-latest', 'gemini-pro']
-        model = None
-        
-        for version in model_versions:
-            try:
-                print(f"🧪 Testing model: {version}")
-                test_model = genai.GenerativeModel(version)
-                test_response = test_model.generate_content("Test")
-                model = test_model
-                print(f"✅ Successfully using model: {version}")
-                break
-            except Exception as e:
-                print(f"❌ Model {version} failed: {str(e)}")
-                continue
-        
-        if not model:
-            return {
-                "success": False,
-                "data": None,
-                "error": "No working Gemini model found"
-            }
-        
+        client = get_llm_client()
+        model_name = client.model_name
+        client.ensure_ready()
+        print(f"✅ Successfully using model: {model_name}")
     except Exception as e:
         return {
             "success": False,
@@ -179,10 +159,10 @@ def parse_pdf_to_json_robust(pdf_path: str) -> Dict[str, Any]:
         for attempt in range(max_retries):
             try:
                 print(f"🚀 Attempt {attempt + 1} to generate content...")
-                response = model.generate_content(prompt)
+                response_text = client.generate(prompt, model_name)
                 
                 # Clean the response text
-                response_text = clean_llm_response(response.text)
+                response_text = clean_llm_response(response_text)
                 
                 # Parse the JSON response
                 result = json.loads(response_text)
@@ -0,0 +1,106 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+# Nesting levels an item may have: article -> A. -> 1. -> a. -> 1) -> a)
+SCHEMA_MAX_DEPTH = 6
+# Validation stops collecting errors after this many
+MAX_SCHEMA_ERRORS = 20
+
+# --- Response Schemas ---
+# OpenAPI-style schemas as accepted by Gemini's response_schema. They cannot
+# refer to themselves, so the recursive "children" is unrolled to a fixed depth.
+
+TABLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "nullable": True},
+        "headers": {"type": "array", "items": {"type": "string"}},
+        "rows": {"type": "array", "items": {"type": "array", "items": {"type": "string"}}},
+    },
+    "required": ["headers", "rows"],
+}
+
+def item_schema(depth: int = SCHEMA_MAX_DEPTH) -> Dict[str, Any]:
+    """Schema of a partItems entry with up to `depth` levels of children"""
+    properties = {
+        "index": {"type": "string"},
+        "text": {"type": "string", "nullable": True},
+        "tables": {"type": "array", "items": TABLE_SCHEMA, "nullable": True},
+    }
+    if depth > 1:
+        properties["children"] = {"type": "array", "items": item_schema(depth - 1), "nullable": True}
+    return {"type": "object", "properties": properties, "required": ["index", "text"]}
+
+def part_items_schema() -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"partItems": {"type": "array", "items": item_schema()}},
+        "required": ["partItems"],
+    }
+
+# A chunk of a section (build_prompt / build_structured_prompt)
+SECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "section": {"type": "string"},
+        "name": {"type": "string"},
+        "part1": part_items_schema(),
+        "part2": part_items_schema(),
+        "part3": part_items_schema(),
+    },
+    "required": ["section", "name", "part1", "part2", "part3"],
+}
+
+# One region of a rule-parsed document (build_region_prompt)
+REGION_SCHEMA = part_items_schema()
+
+# --- Validation ---
+
+PY_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+def schema_path(trail: Optional[Tuple[Any, Any]]) -> str:
+    """Render a (parent, key) trail as $.part1.partItems[0].index"""
+    keys = []
+    while trail is not None:
+        trail, key = trail
+        keys.append(f"[{key}]" if isinstance(key, int) else f".{key}")
+    return "$" + "".join(reversed(keys))
+
+def validate(value: Any, schema: Dict[str, Any], max_errors: int = MAX_SCHEMA_ERRORS) -> List[str]:
+    """
+    Check a decoded response against one of the schemas above and return
+    what does not match (empty if valid). Handles only the keywords these
+    schemas use (type, nullable, properties, required, items); extra keys
+    are allowed. Iterative, and paths are only rendered for errors.
+    """
+    errors: List[str] = []
+    stack: List[Tuple[Any, Dict[str, Any], Optional[Tuple[Any, Any]]]] = [(value, schema, None)]
+    while stack and len(errors) < max_errors:
+        value, schema, trail = stack.pop()
+        if value is None:
+            if not schema.get("nullable"):
+                errors.append(f"{schema_path(trail)}: null is not allowed")
+            continue
+        expected = schema["type"]
+        if not isinstance(value, PY_TYPES[expected]) or \
+                (isinstance(value, bool) and expected in ("number", "integer")):
+            errors.append(f"{schema_path(trail)}: expected {expected}, got {type(value).__name__}")
+            continue
+        if expected == "object":
+            for key in schema.get("required", ()):
+                if key not in value:
+                    errors.append(f"{schema_path(trail)}: missing \"{key}\"")
+            properties = schema.get("properties", {})
+            for key, child in value.items():
+                if key in properties:
+                    stack.append((child, properties[key], (trail, key)))
+        elif expected == "array":
+            items = schema["items"]
+            stack.extend((child, items, (trail, i)) for i, child in enumerate(value))
+    return errors
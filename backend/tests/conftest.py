@@ -0,0 +1,84 @@
+import os
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# Read at import time: keep the test run away from the on-disk cache
+os.environ["PARSE_CACHE_ENABLED"] = "0"
+
+import pytest
+
+import cache
+import llm
+import parsing
+import ratelimit
+
+# --- Fake LLM ---
+
+class ScriptedBackend(llm.LLMBackend):
+    """
+    Answers each prompt with respond(prompt), which returns the response
+    text (or a list of stream fragments). Every prompt sent is recorded.
+    """
+
+    def __init__(self, respond: Callable[[str], Any], model_name: str = "fake"):
+        self.respond = respond
+        self._model_name = model_name
+        self.prompts: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def _answer(self, prompt: str) -> Any:
+        with self._lock:
+            self.prompts.append(prompt)
+        return self.respond(prompt)
+
+    def generate(self, prompt: str, model_name: Optional[str] = None,
+                 schema: Optional[Dict[str, Any]] = None) -> str:
+        answer = self._answer(prompt)
+        return answer if isinstance(answer, str) else "".join(answer)
+
+    def generate_stream(self, prompt: str, model_name: Optional[str] = None,
+                        schema: Optional[Dict[str, Any]] = None):
+        answer = self._answer(prompt)
+        yield from [answer] if isinstance(answer, str) else answer
+
+def section_json(part_items: List[Dict[str, Any]], part: int = 2, section: str = "23 30 00",
+                 name: str = "TEST SECTION") -> str:
+    """A chunk response holding `part_items` in the given part"""
+    document = {"section": section, "name": name,
+                "part1": {"partItems": []}, "part2": {"partItems": []}, "part3": {"partItems": []}}
+    document[f"part{part}"]["partItems"] = part_items
+    return json.dumps(document)
+
+@pytest.fixture
+def fake_llm():
+    """Install a ScriptedBackend; set its `respond` in the test"""
+    backend = ScriptedBackend(lambda prompt: section_json([]))
+    llm.set_llm_backend(backend)
+    yield backend
+    llm.set_llm_backend(None)
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    """An empty in-memory parse cache in place of the disabled one"""
+    store = cache.ResultCache(":memory:")
+    monkeypatch.setattr(cache, "PARSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "_cache", store)
+    return store
+
+@pytest.fixture
+def pdf(tmp_path):
+    """A PDF path to hash for the caches; tests pass its pages in already extracted"""
+    path = tmp_path / "spec.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    """No rate limiting and no backoff delays between retries"""
+    monkeypatch.setattr(ratelimit, "_scheduler", ratelimit.LLMScheduler(rpm=0, tpm=0))
+    monkeypatch.setattr(parsing, "backoff_delay", lambda attempt: 0.0)
@@ -0,0 +1,32 @@
+import re
+
+from cache import chunk_key
+from conftest import section_json
+from parsing import build_prompt, chunk_cache_text, llm_document
+
+def page(marker: str) -> dict:
+    return {"text": f"PART 2 - PRODUCTS\n2.01 {marker}\nA. Body of {marker}.", "tables": []}
+
+def answer(prompt: str) -> str:
+    markers = sorted(set(re.findall(r"MARKER-\w+", prompt)))
+    return section_json([{"index": "2.01", "text": marker, "children": None} for marker in markers])
+
+def test_cache_text_leaves_out_chunk_position():
+    pages = [page("MARKER-A")]
+    assert build_prompt(pages, 1, 3) != build_prompt(pages, 2, 4)
+    assert chunk_cache_text(build_prompt, pages) == chunk_cache_text(build_prompt, [dict(pages[0])])
+    assert chunk_key(chunk_cache_text(build_prompt, pages), "fake") != \
+        chunk_key(chunk_cache_text(build_prompt, [page("MARKER-B")]), "fake")
+
+def test_inserting_a_chunk_reuses_the_other_chunks(fake_llm, memory_cache):
+    fake_llm.respond = answer
+    llm_document([page("MARKER-A"), page("MARKER-B"), page("MARKER-C")], chunk_size=1, overlap=0,
+                 max_concurrency=1, chunking="pages")
+    assert len(fake_llm.prompts) == 3
+
+    # A page added at the front shifts every chunk's "N of M"
+    fake_llm.prompts.clear()
+    llm_document([page("MARKER-NEW"), page("MARKER-A"), page("MARKER-B"), page("MARKER-C")], chunk_size=1,
+                 overlap=0, max_concurrency=1, chunking="pages")
+    assert len(fake_llm.prompts) == 1
+    assert "MARKER-NEW" in fake_llm.prompts[0]
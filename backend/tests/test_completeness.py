@@ -0,0 +1,71 @@
+import json
+
+from conftest import section_json
+from parsing import fetch_chunk, parse_pdf
+from retry import ParseReport
+from schema import REGION_SCHEMA
+
+ITEMS = [{"index": "2.01", "text": "DUCTS", "children": None},
+         {"index": "2.02", "text": "FITTINGS", "children": None}]
+PAGES = [{"text": "PART 2 - PRODUCTS\n2.01 DUCTS\n2.02 FITTINGS\n", "tables": []}]
+
+def fragments(text, size=16):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def truncated_response():
+    """A response cut off in the middle of the second item"""
+    full = section_json(ITEMS)
+    return fragments(full[:full.index("FITTINGS")])
+
+def parse(pdf):
+    return parse_pdf(pdf, mode="llm", chunking="pages", max_concurrency=1, pages=PAGES)
+
+def test_cut_off_stream_is_reported_and_parsed_again_on_reupload(pdf, fake_llm, memory_cache):
+    fake_llm.respond = lambda prompt: truncated_response()
+    first = parse(pdf)
+    items = first["data"]["part2"]["partItems"]
+    assert [item["index"] for item in items] == ["2.01", "2.02"] and items[1]["text"] != "FITTINGS"
+    assert first["meta"]["incomplete_chunks"] == [{"chunk": 1}]
+    assert first["meta"]["failed_chunks"] == []
+
+    # Neither the document nor the chunk was cached, so the re-upload asks again
+    fake_llm.respond = lambda prompt: fragments(section_json(ITEMS))
+    fake_llm.prompts.clear()
+    second = parse(pdf)
+    assert len(fake_llm.prompts) == 1
+    assert [item["index"] for item in second["data"]["part2"]["partItems"]] == ["2.01", "2.02"]
+    assert second["meta"]["incomplete_chunks"] == []
+
+    fake_llm.prompts.clear()
+    assert parse(pdf) == second
+    assert fake_llm.prompts == []
+
+def test_abandoned_stream_is_incomplete(pdf, fake_llm, memory_cache):
+    start = '{"section": "23 30 00", "name": "TEST", "part2": {"partItems": [' + json.dumps(ITEMS[0]) + \
+        ', {"index": "2.02", "text": "'
+    fake_llm.respond = lambda prompt: fragments(start) + ["looping output "] * 100
+    result = parse(pdf)
+    assert [item["index"] for item in result["data"]["part2"]["partItems"]] == ["2.01"]
+    assert result["meta"]["incomplete_chunks"] == [{"chunk": 1}]
+    assert memory_cache.total_size() == 0
+
+def test_answer_rebuilt_by_a_repair_prompt_is_incomplete(fake_llm, memory_cache):
+    answers = iter(['{"partItems": "2.01 DUCTS"}', json.dumps({"partItems": ITEMS[:1]})])
+    fake_llm.respond = lambda prompt: next(answers)
+    report = ParseReport()
+    result, complete = fetch_chunk("Structure this fragment", schema=REGION_SCHEMA, report=report)
+    assert result == {"partItems": ITEMS[:1]}
+    assert not complete
+    assert report.meta()["repairs"] == 1
+    assert memory_cache.total_size() == 0
+
+def test_report_meta():
+    report = ParseReport(retry_budget=1)
+    assert report.complete()
+    assert report.take_retry() and not report.take_retry()
+    report.chunk_incomplete(chunk=2)
+    report.chunk_failed("503", chunk=3)
+    report.furniture_removed(chars_removed=120, tokens_saved=30)
+    assert not report.complete()
+    assert report.meta() == {"retries": 1, "repairs": 0, "failed_chunks": [{"chunk": 3, "error": "503"}],
+                             "incomplete_chunks": [{"chunk": 2}], "chars_removed": 120, "tokens_saved": 30}
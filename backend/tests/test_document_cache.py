@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import ScriptedBackend, section_json
+from llm import set_llm_backend
+from metrics import CACHE_HITS
+from parsing import parse_pdf
+
+# 2.03 skips a number, so its region is sent to the LLM
+SPEC_TEXT = """SECTION 23 30 00 - TEST SECTION
+PART 1 - GENERAL
+1.01 SUMMARY
+A. Section includes ducts.
+PART 2 - PRODUCTS
+2.01 DUCTS
+A. Galvanized steel.
+2.03 FITTINGS
+A. Welded elbows.
+"""
+
+def region_answer(prompt: str) -> str:
+    return '{"partItems": [{"index": "2.03", "text": "FITTINGS", "children": null}]}'
+
+@pytest.mark.parametrize("mode", ["rules", "llm"])
+def test_unchanged_pdf_is_served_from_the_document_cache(mode, pdf, fake_llm, memory_cache):
+    fake_llm.respond = region_answer if mode == "rules" else (lambda prompt: section_json([]))
+    first = parse_pdf(pdf, mode=mode, max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+    assert first["success"] and fake_llm.prompts
+
+    fake_llm.prompts.clear()
+    hits = CACHE_HITS.value(kind="document")
+    second = parse_pdf(pdf, mode=mode, max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+    assert second == first
+    assert fake_llm.prompts == []
+    assert CACHE_HITS.value(kind="document") == hits + 1
+
+@pytest.mark.parametrize("mode", ["rules", "llm"])
+def test_document_cache_is_kept_per_model(mode, pdf, fake_llm, memory_cache):
+    fake_llm.respond = region_answer if mode == "rules" else (lambda prompt: section_json([]))
+    parse_pdf(pdf, mode=mode, max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+
+    other = ScriptedBackend(fake_llm.respond, model_name="other")
+    set_llm_backend(other)
+    hits = CACHE_HITS.value(kind="document")
+    parse_pdf(pdf, mode=mode, max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+    assert CACHE_HITS.value(kind="document") == hits
+    assert other.prompts
+
+def test_rules_result_with_a_failed_region_is_not_cached(pdf, fake_llm, memory_cache):
+    def fail(prompt):
+        raise RuntimeError("503 unavailable")
+
+    fake_llm.respond = fail
+    first = parse_pdf(pdf, mode="rules", max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+    assert first["meta"]["failed_chunks"]
+
+    fake_llm.respond = region_answer
+    fake_llm.prompts.clear()
+    second = parse_pdf(pdf, mode="rules", max_concurrency=1, pages=[{"text": SPEC_TEXT, "tables": []}])
+    assert len(fake_llm.prompts) == 1
+    assert second["meta"]["failed_chunks"] == []
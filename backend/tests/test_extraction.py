@@ -0,0 +1,50 @@
+import fitz  # PyMuPDF
+import pytest
+
+import parsing
+from parsing import discard_extraction_pool, extract_pages_and_tables, get_extraction_pool, parse_pdf
+
+@pytest.fixture
+def long_pdf(tmp_path):
+    """A PDF long enough to be extracted in the process pool"""
+    doc = fitz.open()
+    for n in range(parsing.PARALLEL_EXTRACTION_MIN_PAGES + 4):
+        page = doc.new_page()
+        if n == 0:
+            page.insert_text((72, 60), "SECTION 23 30 00 - DUCTWORK\nPART 2 - PRODUCTS", fontsize=10)
+        page.insert_text((72, 100), f"2.{n + 1:02d} ARTICLE {n + 1}\nA. Text of page {n + 1}.", fontsize=10)
+        page.insert_text((72, 800), f"ACME ENGINEERING PROJECT 1234 - PAGE {n + 1}", fontsize=8)
+    path = tmp_path / "long.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(parsing, "EXTRACTION_WORKERS", 2)
+    discard_extraction_pool()
+    yield
+    discard_extraction_pool()
+
+def test_pool_extraction_matches_in_process_extraction(long_pdf, pool):
+    assert extract_pages_and_tables(long_pdf, workers=2, strip=False) == \
+        extract_pages_and_tables(long_pdf, workers=1, strip=False)
+
+def test_documents_share_one_pool_started_without_fork(long_pdf, pool):
+    extract_pages_and_tables(long_pdf, workers=2, strip=False)
+    executor = get_extraction_pool()
+    extract_pages_and_tables(long_pdf, workers=2, strip=False)
+    assert get_extraction_pool() is executor
+    assert executor._mp_context.get_start_method() != "fork"
+
+    discard_extraction_pool(executor)
+    assert get_extraction_pool() is not executor
+
+def test_furniture_savings_are_reported_in_meta(long_pdf, fake_llm):
+    pages = extract_pages_and_tables(long_pdf, workers=1)
+    assert all("ACME" not in page["text"] for page in pages)
+    assert all(page["stripped"]["chars"] > 0 for page in pages)
+
+    meta = parse_pdf(long_pdf, mode="rules", max_concurrency=1, pages=pages)["meta"]
+    assert meta["chars_removed"] == sum(page["stripped"]["chars"] for page in pages)
+    assert 0 < meta["tokens_saved"] <= meta["chars_removed"]
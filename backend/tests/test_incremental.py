@@ -0,0 +1,69 @@
+import json
+
+import fitz  # PyMuPDF
+
+from incremental import cut_articles, page_ranges, parse_pdf_incremental, preceding_articles
+from masterformat import parse_masterformat
+
+def write_pdf(path, pages):
+    """A PDF with one page per list of lines"""
+    doc = fitz.open()
+    for lines in pages:
+        page = doc.new_page()
+        for i, line in enumerate(lines):
+            page.insert_text((72, 72 + 14 * i), line, fontsize=10)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+def spec(fittings_line="A. Welded elbows."):
+    return [
+        ["SECTION 23 30 00 - TEST SECTION", "PART 1 - GENERAL", "1.01 SUMMARY", "A. Section includes ducts."],
+        ["PART 2 - PRODUCTS", "2.01 DUCTS", "A. Galvanized steel."],
+        ["2.02 FITTINGS", fittings_line],
+        ["2.03 DAMPERS", "A. Opposed blade."],
+    ]
+
+def test_page_ranges():
+    assert page_ranges({5, 1, 2, 3, 7, 8}) == [(1, 3), (5, 5), (7, 8)]
+    assert page_ranges(set()) == []
+
+def test_cut_run_resumes_the_article_numbering():
+    pages = [{"text": "\n".join(lines), "tables": []} for lines in spec()]
+    runs = cut_articles(pages[2:3], {"2:2.2"}, {2: "PART 2 - PRODUCTS"}, preceding_articles(pages))
+    assert len(runs) == 1
+    sub_pages, last_articles = runs[0]
+    assert sub_pages[0]["text"] == "PART 2 - PRODUCTS"
+    assert last_articles == {2: 1}
+
+    # Unseeded, the cut looks like 2.01 is missing; seeded, the article is certain
+    _, regions = parse_masterformat(sub_pages)
+    assert regions[0]["confidence"] < 0.7
+    _, regions = parse_masterformat(sub_pages, last_articles)
+    assert regions[0]["confidence"] == 1.0
+
+def test_edited_article_is_reparsed_without_the_llm(tmp_path, fake_llm):
+    first = parse_pdf_incremental(write_pdf(tmp_path / "v1.pdf", spec()), mode="rules", max_concurrency=1)
+    assert first["success"]
+
+    revised = parse_pdf_incremental(write_pdf(tmp_path / "v2.pdf", spec("A. Long radius welded elbows.")),
+                                    previous=first, mode="rules", max_concurrency=1)
+    assert fake_llm.prompts == []
+    items = revised["data"]["part2"]["partItems"]
+    assert [item["index"] for item in items] == ["2.01", "2.02", "2.03"]
+    assert items[1]["children"][0]["text"] == "Long radius welded elbows."
+
+def test_article_missing_from_the_llm_answer_keeps_its_previous_version(tmp_path, fake_llm):
+    # "C." after "A." is out of sequence, so the revised 2.02 goes to the LLM, which renumbers it
+    fake_llm.respond = lambda prompt: json.dumps(
+        {"partItems": [{"index": "2.12", "text": "FITTINGS", "children": None}]}
+    )
+    first = parse_pdf_incremental(write_pdf(tmp_path / "v1.pdf", spec()), mode="rules", max_concurrency=1)
+    revised_pages = spec()
+    revised_pages[2] = ["2.02 FITTINGS", "A. Welded elbows.", "C.", "Flanged joints."]
+    revised = parse_pdf_incremental(write_pdf(tmp_path / "v2.pdf", revised_pages),
+                                    previous=first, mode="rules", max_concurrency=1)
+    assert len(fake_llm.prompts) == 1
+    items = revised["data"]["part2"]["partItems"]
+    assert [item["index"] for item in items] == ["2.01", "2.02", "2.03"]
+    assert items[1] == first["data"]["part2"]["partItems"][1]
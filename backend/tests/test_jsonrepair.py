@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from jsonrepair import JSONExtractor, extract_json, parse_llm_json, repeating_tail
+
+DOCUMENT = {"section": "23 30 00", "name": "DUCTWORK",
+            "part2": {"partItems": [{"index": "2.01", "text": "DUCTS", "children": None},
+                                    {"index": "2.02", "text": "FITTINGS \"A\"", "children": None}]}}
+
+def feed(text, size=7, **kwargs):
+    extractor = JSONExtractor(**kwargs)
+    for i in range(0, len(text), size):
+        extractor.feed(text[i:i + size])
+    return extractor
+
+def test_object_is_pulled_out_of_prose_and_fences():
+    text = "Here is the JSON:\n```json\n" + json.dumps(DOCUMENT, indent=2) + "\n```\nLet me know!"
+    extractor = feed(text)
+    assert extractor.complete
+    assert extractor.parse() == DOCUMENT
+
+def test_items_are_reported_as_they_close():
+    seen = []
+    feed(json.dumps(DOCUMENT), size=3, on_item=lambda path, item: seen.append((path, item["index"])))
+    assert seen == [(("part2", "partItems"), "2.01"), (("part2", "partItems"), "2.02")]
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": [1, 2,], "b": {"c": true,},}', {"a": [1, 2], "b": {"c": True}}),
+    ('{"a": [1, 2}', {"a": [1, 2]}),
+    ('{"a": {"b": 1], "c": 2}', {"a": {"b": 1, "c": 2}}),
+    ('{"a": "line one\nline two"}', {"a": "line one\nline two"}),
+])
+def test_malformed_json_is_repaired(text, expected):
+    assert json.loads(extract_json(text), strict=False) == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": "cut off mid-str', {"a": "cut off mid-str"}),
+    ('{"a": "escape \\u00', {"a": "escape "}),
+    ('{"a": 1, "b"', {"a": 1, "b": None}),
+    ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ('{"a": tr', {"a": None}),
+    ('{"a": [{"b": 12', {"a": [{"b": 12}]}),
+])
+def test_truncated_response_is_closed(text, expected):
+    extractor = feed(text)
+    assert not extractor.complete
+    assert extractor.parse() == expected
+
+def test_checkpoint_drops_the_partial_item():
+    text = json.dumps(DOCUMENT)
+    extractor = feed(text[:text.index("FITTINGS")])
+    assert extractor.parse(checkpoint=True) == {
+        "section": "23 30 00", "name": "DUCTWORK", "part2": {"partItems": DOCUMENT["part2"]["partItems"][:1]}
+    }
+    with pytest.raises(ValueError):
+        feed('{"part2": {"partItems": [{"index"').text(checkpoint=True)
+
+def test_parse_llm_json():
+    assert parse_llm_json("Sure: " + json.dumps(DOCUMENT)) == (DOCUMENT, True)
+    assert parse_llm_json('{"a": [1, 2') == ({"a": [1, 2]}, False)
+    with pytest.raises(ValueError):
+        parse_llm_json("I could not find any articles.")
+
+def test_repeating_tail():
+    assert repeating_tail('{"text": "' + "the same words " * 40, 300)
+    assert not repeating_tail(json.dumps(DOCUMENT) * 2, 300)
+    assert not repeating_tail(" " * 400, 300)
@@ -0,0 +1,57 @@
+import pytest
+
+from masterformat import ISSUE_WEIGHTS, find_boundaries, parse_masterformat
+
+def pages(*texts):
+    return [{"text": text, "tables": []} for text in texts]
+
+SPEC = pages(
+    "SECTION 23 30 00 - DUCTWORK\nPART 1 - GENERAL\n1.01 SUMMARY\nA. Section includes ducts.\n",
+    "PART 2 - PRODUCTS\n2.01 DUCTS\nA. Galvanized steel.\n1. G90 coating.\nB. Aluminum.\n"
+    "2.02 FITTINGS\nA. Welded elbows.\nEND OF SECTION 23 30 00\n",
+)
+
+def test_clean_spec_builds_the_tree_with_full_confidence():
+    document, regions = parse_masterformat(SPEC)
+    assert (document["section"], document["name"]) == ("23 30 00", "DUCTWORK")
+    ducts = document["part2"]["partItems"][0]
+    assert [child["index"] for child in ducts["children"]] == ["A.", "B."]
+    assert ducts["children"][0]["children"][0] == {"index": "1.", "text": "G90 coating.", "children": None}
+    assert [region["heading"] for region in regions] == ["1.01 SUMMARY", "2.01 DUCTS", "2.02 FITTINGS"]
+    assert all(region["confidence"] == 1.0 and region["issues"] == [] for region in regions)
+
+@pytest.mark.parametrize("text, issues", [
+    ("2.01 DUCTS\nA. Steel.\n2.03 DAMPERS\nA. Blades.\n", [[], ["numbering"]]),
+    ("2.01 DUCTS\nA. Steel.\nC.\nSeams.\n", [["numbering"]]),
+    ("2.01 DUCTS\nA. Steel.\nC. Seams sealed.\n", [["broken_line"]]),
+    ("2.01 DUCTS\nA. Steel.\nPART 1 - GENERAL\n", [["heading"]]),
+])
+def test_irregularities_lower_the_region_confidence(text, issues):
+    _, regions = parse_masterformat(pages("PART 2 - PRODUCTS\n" + text))
+    assert [region["issues"] for region in regions] == issues
+    for region, expected in zip(regions, issues):
+        assert region["confidence"] == 1.0 - sum(ISSUE_WEIGHTS[issue] for issue in expected)
+
+def test_loose_text_gets_a_region_with_no_confidence():
+    document, regions = parse_masterformat(pages("PART 3 - EXECUTION\nInstall per SMACNA.\n3.01 INSTALLATION\n"))
+    assert regions[0]["node"] is None and regions[0]["confidence"] == 0.0
+    assert [item["index"] for item in document["part3"]["partItems"]] == ["3.01"]
+
+def test_table_attaches_to_the_paragraph_before_it():
+    table = {"headers": ["Gauge"], "rows": [["26"]], "position": len("PART 2 - PRODUCTS\n2.01 DUCTS\nA. Steel.\n")}
+    spec = [{"text": "PART 2 - PRODUCTS\n2.01 DUCTS\nA. Steel.\nB. Seams.\n", "tables": [table]}]
+    document, regions = parse_masterformat(spec)
+    steel = document["part2"]["partItems"][0]["children"][0]
+    assert steel["tables"] == [{"headers": ["Gauge"], "rows": [["26"]]}]
+    assert regions[0]["confidence"] == 1.0 - ISSUE_WEIGHTS["table"]
+
+def test_find_boundaries_rejects_lines_that_only_look_like_headings():
+    boundaries = find_boundaries(pages(
+        "PART 1 - GENERAL\n1.01 SUMMARY\n2.05 is referenced here\n1.02 SUBMITTALS\n",
+        "PART 2 - PRODUCTS\n2.01 DUCTS\n1.5\n2.01\n2.02 FITTINGS\n",
+    ))
+    assert [(b["kind"], b["page"], b["index"]) for b in boundaries] == [
+        ("part", 0, "PART 1"), ("article", 0, "1.01"), ("article", 0, "1.02"),
+        ("part", 1, "PART 2"), ("article", 1, "2.01"), ("article", 1, "2.02"),
+    ]
+    assert boundaries[2]["offset"] == len("PART 1 - GENERAL\n1.01 SUMMARY\n2.05 is referenced here\n")
@@ -0,0 +1,93 @@
+import copy
+import itertools
+
+import parsing
+from merge import TreeMerger, node_key
+from parsing import postprocess_document
+
+TABLE = {"headers": ["Gauge", "Size"], "rows": [["26", "12 in"], ["24", "30 in"]]}
+
+def chunk(part_items, section="23 30 00", name="DUCTWORK"):
+    return {"section": section, "name": name, "part1": {"partItems": []},
+            "part2": {"partItems": part_items}, "part3": {"partItems": []}}
+
+def article(index, text, children=None, tables=None):
+    item = {"index": index, "text": text, "children": children}
+    if tables is not None:
+        item["tables"] = tables
+    return item
+
+def test_node_key():
+    assert node_key("2.01") == node_key("2.1") == "2.1"
+    assert node_key("A.") == node_key("(A)") == node_key("A") == "A"
+    assert node_key(None) == ""
+
+def test_overlapping_chunks_merge_by_index_path():
+    merger = TreeMerger()
+    merger.add(chunk([article("2.01", "DUCTS", [article("A.", "Steel.")])]), order=0)
+    merger.add(chunk([article("2.1", "DUCTS", [article("A.", "Steel."), article("B.", "Aluminum.")]),
+                      article("2.02", "FITTINGS")]), order=1)
+    items = merger.snapshot()["part2"]["partItems"]
+    assert [item["index"] for item in items] == ["2.01", "2.02"]
+    assert [child["index"] for child in items[0]["children"]] == ["A.", "B."]
+
+def test_text_comes_from_the_chunk_covering_the_article_best():
+    merger = TreeMerger()
+    merger.add(chunk([article("2.01", "DUCTS (cut off")]), coverage={"2.1": 40}, order=0)
+    merger.add(chunk([article("2.01", "DUCTS AND PLENUMS")]), coverage={"2.1": 900}, order=1)
+    assert merger.snapshot()["part2"]["partItems"][0]["text"] == "DUCTS AND PLENUMS"
+
+def test_articles_are_filed_under_the_part_their_number_names():
+    merger = TreeMerger()
+    merger.add({"section": "", "name": "", "part1": {"partItems": [article("3.01", "INSTALLATION")]}})
+    document = merger.snapshot()
+    assert document["part1"]["partItems"] == []
+    assert document["part3"]["partItems"][0]["index"] == "3.01"
+
+def test_result_does_not_depend_on_arrival_order():
+    chunks = [
+        chunk([article("2.01", "DUCTS", [article("A.", "Steel.")], [TABLE])]),
+        chunk([article("2.01", "DUCTS", [article("B.", "Seams.")], [TABLE]), article("2.02", "FITTINGS")]),
+        chunk([article("2.03", "DAMPERS")]),
+    ]
+    snapshots = []
+    for order in itertools.permutations(range(3)):
+        merger = TreeMerger()
+        for i in order:
+            merger.add(copy.deepcopy(chunks[i]), order=i)
+        snapshots.append(merger.snapshot())
+    assert all(snapshot == snapshots[0] for snapshot in snapshots)
+
+def test_tables_stay_structured_and_are_kept_once():
+    merger = TreeMerger()
+    merger.add(chunk([article("2.01", "DUCTS", tables=[TABLE])]), order=0)
+    merger.add(chunk([article("2.01", "DUCTS", tables=[TABLE]), article("2.02", "GAUGES", tables=[TABLE])]),
+               order=1)
+    items = merger.snapshot()["part2"]["partItems"]
+    assert items[0]["tables"] == [TABLE]
+    assert items[0]["text"] == "DUCTS"
+    assert "tables" not in items[1]
+
+def test_inline_tables_is_opt_in():
+    merger = TreeMerger()
+    merger.add(chunk([article("2.01", "DUCTS", tables=[TABLE])]))
+    item = merger.snapshot(inline_tables=True)["part2"]["partItems"][0]
+    assert "tables" not in item
+    assert item["text"].startswith("DUCTS\n\n| Gauge | Size |")
+
+def test_postprocessing_keeps_structured_tables(monkeypatch):
+    document = chunk([article("2.01", "DUCTS “A”", tables=[TABLE]),
+                      article("2.02", "GAUGES", tables=[TABLE, {"headers": [], "rows": []}]),
+                      article("2.03", "DAMPERS", tables=[])])
+    inlined = copy.deepcopy(document)
+
+    postprocess_document(document)
+    items = document["part2"]["partItems"]
+    assert items[0] == {"index": "2.01", "text": 'DUCTS "A"', "children": None, "tables": [TABLE]}
+    assert items[1]["tables"] == [{"headers": [], "rows": []}]
+    assert "tables" not in items[2]
+
+    monkeypatch.setattr(parsing, "INLINE_TABLES", True)
+    postprocess_document(inlined)
+    assert "tables" not in inlined["part2"]["partItems"][0]
+    assert "| Gauge | Size |" in inlined["part2"]["partItems"][0]["text"]
@@ -0,0 +1,45 @@
+import pytest
+
+import metrics
+from metrics import Counter, Histogram
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics made by a test register here instead of alongside the parser's"""
+    monkeypatch.setattr(metrics, "REGISTRY", [])
+
+def test_counter_render():
+    plain = Counter("test_requests_total", "Requests")
+    labelled = Counter("test_cache_hits_total", "Cache hits", ["kind"])
+    labelled.inc(kind="document")
+    labelled.inc(2, kind='chunk "a"\n')
+    assert metrics.render() == (
+        "# HELP test_requests_total Requests\n"
+        "# TYPE test_requests_total counter\n"
+        "test_requests_total 0.0\n"
+        "# HELP test_cache_hits_total Cache hits\n"
+        "# TYPE test_cache_hits_total counter\n"
+        'test_cache_hits_total{kind="chunk \\"a\\"\\n"} 2.0\n'
+        'test_cache_hits_total{kind="document"} 1.0\n'
+    )
+    assert plain.value() == 0 and labelled.value(kind="document") == 1
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_stage_seconds", "Stage time", ["stage"], buckets=[1.0, 0.1])
+    for value in (0.05, 0.1, 0.5, 7.0):
+        histogram.observe(value, stage="llm")
+    assert histogram.count(stage="llm") == 4
+    assert histogram.render() == [
+        "# HELP test_stage_seconds Stage time",
+        "# TYPE test_stage_seconds histogram",
+        'test_stage_seconds_bucket{stage="llm",le="0.1"} 2',
+        'test_stage_seconds_bucket{stage="llm",le="1.0"} 3',
+        'test_stage_seconds_bucket{stage="llm",le="+Inf"} 4',
+        'test_stage_seconds_sum{stage="llm"} 7.65',
+        'test_stage_seconds_count{stage="llm"} 4',
+    ]
+
+def test_labels_must_match():
+    counter = Counter("test_documents_total", "Documents", ["mode", "outcome"])
+    with pytest.raises(ValueError):
+        counter.inc(mode="rules")
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+
+import ratelimit
+from parsing import is_quota_error
+from ratelimit import BATCH, INTERACTIVE, LLMScheduler, TokenBucket
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+def test_bucket_starts_full_and_refills_at_its_rate(clock):
+    bucket = TokenBucket(per_minute=60, burst_seconds=5)
+    assert bucket.capacity == 5
+    for _ in range(5):
+        assert bucket.wait_time(1) == 0
+        bucket.take(1)
+    assert bucket.wait_time(1) == 1.0
+    clock.now += 0.5
+    assert bucket.wait_time(1) == 0.5
+    clock.now += 60
+    assert bucket.level == 0.5 and bucket.wait_time(1) == 0 and bucket.level == 5
+
+def test_oversized_take_waits_for_a_full_bucket_and_leaves_debt(clock):
+    bucket = TokenBucket(per_minute=600, burst_seconds=1)
+    bucket.take(5)
+    assert bucket.wait_time(30) == 0.5  # needs the bucket full again, not all 30
+    clock.now += 0.5
+    bucket.take(30)
+    assert bucket.level == -20
+    assert bucket.wait_time(1) == 2.1
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 9)
+    assert bucket.wait_time(10 ** 9) == 0
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(ValueError):
+        LLMScheduler(rpm=0, tpm=0).acquire(10, "doc", priority="urgent")
+
+def test_interactive_calls_go_before_batch_and_documents_take_turns():
+    scheduler = LLMScheduler(rpm=0, tpm=0)
+    scheduler.pause(60)
+    order = []
+
+    def call(document, priority):
+        scheduler.acquire(10, document, priority)
+        order.append((document, priority))
+
+    arrivals = [("big", BATCH), ("big", BATCH), ("small", BATCH),
+                ("big", INTERACTIVE), ("big", INTERACTIVE), ("upload", INTERACTIVE)]
+    threads = []
+    for arrival in arrivals:
+        thread = threading.Thread(target=call, args=arrival)
+        thread.start()
+        threads.append(thread)
+        while sum(scheduler.waiting().values()) < len(threads):
+            time.sleep(0.001)
+    assert scheduler.waiting() == {INTERACTIVE: 3, BATCH: 3}
+
+    with scheduler._cond:
+        scheduler._paused_until = 0.0
+        scheduler._cond.notify_all()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == [("big", INTERACTIVE), ("upload", INTERACTIVE), ("big", INTERACTIVE),
+                     ("big", BATCH), ("small", BATCH), ("big", BATCH)]
+
+class HTTPError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+def test_quota_errors_are_recognised_by_type_or_status_only():
+    assert is_quota_error(ResourceExhausted("Resource has been exhausted"))
+    assert is_quota_error(HTTPError(429))
+    assert not is_quota_error(HTTPError(503))
+    assert not is_quota_error(RuntimeError("page 429 of 1200 has no text"))
@@ -0,0 +1,80 @@
+import json
+import re
+
+import parsing
+from parsing import estimate_tokens, rules_document
+from retry import ParseReport
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def spec_pages(paragraphs: int) -> list:
+    """PART 2 whose article 2.03 skips a number (so it is uncertain) and has `paragraphs` paragraphs"""
+    lines = ["SECTION 23 30 00 - TEST SECTION", "PART 2 - PRODUCTS", "2.01 DUCTS", "A. Galvanized steel.",
+             "2.03 FITTINGS"]
+    lines += [f"{LETTERS[i]}. Fitting requirement number {i} for the long article." for i in range(paragraphs)]
+    return [{"text": "\n".join(lines) + "\n", "tables": []}]
+
+def fragment(prompt: str) -> str:
+    return prompt.split('Fragment:\n    """', 1)[1].rsplit('"""', 1)[0]
+
+def answer_fragment(prompt: str) -> str:
+    """Structure a fragment's paragraphs under 2.03, as the LLM would"""
+    children = [
+        {"index": f"{m.group(1)}.", "text": m.group(2), "children": None}
+        for m in re.finditer(r"^\s*([A-Z])\. (.*)$", fragment(prompt), re.MULTILINE)
+    ]
+    return json.dumps({"partItems": [{"index": "2.03", "text": "FITTINGS", "children": children}]})
+
+def test_oversized_region_is_sent_in_pieces_within_budget(fake_llm):
+    fake_llm.respond = answer_fragment
+    document = rules_document(spec_pages(20), max_concurrency=1, token_budget=120, overlap_tokens=20)
+
+    assert len(fake_llm.prompts) > 1
+    assert all(estimate_tokens(fragment(prompt)) <= 120 for prompt in fake_llm.prompts)
+    assert all("2.03 FITTINGS" in fragment(prompt) for prompt in fake_llm.prompts)
+    # Pieces overlap; their items are merged back into one article, each paragraph once
+    article = document["part2"]["partItems"][1]
+    assert article["index"] == "2.03"
+    assert [child["index"] for child in article["children"]] == [f"{letter}." for letter in LETTERS[:20]]
+
+def test_region_within_budget_is_one_prompt(fake_llm):
+    fake_llm.respond = answer_fragment
+    rules_document(spec_pages(3), max_concurrency=1, token_budget=3000)
+    assert len(fake_llm.prompts) == 1
+    assert "one piece of it" not in fake_llm.prompts[0]
+
+def test_region_with_a_failed_piece_keeps_its_rule_based_parse(fake_llm):
+    def answer(prompt):
+        if "(continued)" in fragment(prompt):
+            raise RuntimeError("503 unavailable")
+        return answer_fragment(prompt)
+
+    fake_llm.respond = answer
+    report = ParseReport()
+    document = rules_document(spec_pages(20), max_concurrency=1, token_budget=120, overlap_tokens=20,
+                              report=report)
+    assert report.failed_chunks and all("piece" in chunk for chunk in report.failed_chunks)
+    article = document["part2"]["partItems"][1]
+    assert len(article["children"]) == 20
+    assert article["children"][0]["text"] == "Fitting requirement number 0 for the long article."
+
+def test_equal_loose_regions_get_their_own_neighbours(fake_llm, monkeypatch):
+    ducts = {"index": "2.01", "text": "DUCTS", "children": None}
+    fittings = {"index": "2.02", "text": "FITTINGS", "children": None}
+    document = {"section": "23 30 00", "name": "TEST SECTION", "part1": {"partItems": []},
+                "part2": {"partItems": [ducts, fittings]}, "part3": {"partItems": []}}
+
+    def region(node, heading, anchor=None):
+        return {"part": 2, "part_title": "PART 2 - PRODUCTS", "node": node, "anchor": anchor, "heading": heading,
+                "pages": [0, 0], "content": [heading or "See drawings."], "issues": [],
+                "confidence": 1.0 if node else 0.0}
+
+    regions = [region(ducts, "2.01 DUCTS"), region(None, "", ducts), region(None, "", ducts),
+               region(fittings, "2.02 FITTINGS")]
+    assert regions[1] == regions[2]
+    monkeypatch.setattr(parsing, "parse_masterformat", lambda *args, **kwargs: (document, regions))
+    fake_llm.respond = lambda prompt: '{"partItems": []}'
+    rules_document([{"text": "", "tables": []}], max_concurrency=1)
+
+    assert "Following item: 2.02 FITTINGS" not in fake_llm.prompts[0]
+    assert "Following item: 2.02 FITTINGS" in fake_llm.prompts[1]
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from uploads import UploadReceiver
+
+BOUNDARY = "XyZ"
+
+def part(name, value, filename=None):
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + value + b"\r\n"
+
+def upload_request(blocks):
+    """A Request whose body arrives in `blocks`; `read` counts the blocks the app asked for"""
+    read = [0]
+
+    async def receive():
+        i = read[0]
+        read[0] += 1
+        if i < len(blocks):
+            return {"type": "http.request", "body": blocks[i], "more_body": i + 1 < len(blocks)}
+        return {"type": "http.disconnect"}
+
+    scope = {"type": "http", "method": "POST", "path": "/jobs", "query_string": b"",
+             "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]}
+    return Request(scope, receive), read
+
+def receive(receiver, blocks):
+    request, read = upload_request(blocks)
+    asyncio.run(receiver.receive(request))
+    return read[0]
+
+def test_file_is_written_to_disk_and_fields_kept(tmp_path):
+    pdf = b"%PDF-1.4 " + bytes(range(256)) * 300
+    body = part("priority", b"batch") + part("file", pdf, "Spec 23 30 00.pdf") + f"--{BOUNDARY}--\r\n".encode()
+    receiver = UploadReceiver(str(tmp_path / "upload.pdf"))
+    receive(receiver, [body[i:i + 1000] for i in range(0, len(body), 1000)])
+
+    assert receiver.filename == "Spec 23 30 00.pdf"
+    assert receiver.fields == {"priority": "batch"}
+    assert receiver.size == len(pdf)
+    assert (tmp_path / "upload.pdf").read_bytes() == pdf
+
+def test_oversized_upload_stops_before_the_rest_of_the_body(tmp_path):
+    head = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="big.pdf"\r\n\r\n'.encode()
+    blocks = [head] + [b"x" * 1024] * 100 + [f"\r\n--{BOUNDARY}--\r\n".encode()]
+    receiver = UploadReceiver(str(tmp_path / "upload.pdf"), max_bytes=10 * 1024)
+    request, read = upload_request(blocks)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(receiver.receive(request))
+
+    assert error.value.status_code == 413
+    assert read[0] <= 12
+    assert not os.path.exists(tmp_path / "upload.pdf")
+
+@pytest.mark.parametrize("body, detail", [
+    (part("file", b"hello", "notes.txt"), "Only PDF files are accepted."),
+    (part("priority", b"batch"), 'No PDF in the "file" form field.'),
+])
+def test_upload_without_a_pdf_is_refused(tmp_path, body, detail):
+    receiver = UploadReceiver(str(tmp_path / "upload.pdf"))
+    with pytest.raises(HTTPException) as error:
+        receive(receiver, [body + f"--{BOUNDARY}--\r\n".encode()])
+    assert (error.value.status_code, error.value.detail) == (400, detail)
+    assert not os.path.exists(tmp_path / "upload.pdf")
@@ -0,0 +1,145 @@
+import os
+import asyncio
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Largest PDF accepted
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "200"))
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+# Room for the multipart framing and form fields around the file
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"PDF is larger than {MAX_UPLOAD_MB:g} MB.")
+
+# --- Streaming multipart/form-data Reader ---
+
+class UploadReceiver:
+    """
+    Reads a multipart/form-data request body as it arrives: the "file" part
+    is written straight to `upload_path`, other parts are kept as form
+    fields. Nothing is spooled, so at most one received block is held in
+    memory, and an upload is refused with 413 as soon as the file passes
+    `max_bytes`, without reading the rest of the body.
+    """
+
+    def __init__(self, upload_path: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                 max_field_bytes: int = UPLOAD_OVERHEAD_BYTES):
+        self.upload_path = upload_path
+        self.max_bytes = max_bytes
+        self.max_field_bytes = max_field_bytes
+        self.filename: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+        self.size = 0
+        # File data received but not yet written, and the part being read
+        self._pending: List[bytes] = []
+        self._field_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._part: Optional[str] = None
+        self._value = bytearray()
+        self._in_file = False
+
+    # Parser callbacks; they run inside parser.write() and may raise to abort the upload
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._part = None
+        self._value = bytearray()
+        self._in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise HTTPException(status_code=400, detail='Form part without a "name" in its Content-Disposition.')
+        self._part = options[b"name"].decode("utf-8", "replace")
+        if self._part != "file":
+            return
+        if self.filename is not None:
+            raise HTTPException(status_code=400, detail="Upload one PDF at a time.")
+        filename = options.get(b"filename", b"").decode("utf-8", "replace")
+        if not filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
+        self.filename = filename
+        self._in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self.size += end - start
+            if self.size > self.max_bytes:
+                raise upload_too_large()
+            self._pending.append(bytes(data[start:end]))
+        else:
+            self._field_bytes += end - start
+            if self._field_bytes > self.max_field_bytes:
+                raise HTTPException(status_code=400, detail="Form fields are too large.")
+            self._value += data[start:end]
+
+    def on_part_end(self) -> None:
+        if self._part is not None and not self._in_file:
+            self.fields[self._part] = self._value.decode("utf-8", "replace")
+        self._in_file = False
+
+    async def receive(self, request: Request) -> None:
+        """
+        Read the whole body, writing the file as it comes (file I/O is kept
+        off the event loop). Raises HTTPException for a request that is not
+        a PDF upload; the partly written file is then removed.
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload.")
+        parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+        out = await asyncio.to_thread(open, self.upload_path, "wb")
+        try:
+            try:
+                async for block in request.stream():
+                    parser.write(block)
+                    if self._pending:
+                        blocks, self._pending = self._pending, []
+                        await asyncio.to_thread(out.writelines, blocks)
+                parser.finalize()
+            except ValueError as e:
+                # python-multipart's parse errors
+                raise HTTPException(status_code=400, detail=f"Malformed upload: {str(e)}")
+            finally:
+                await asyncio.to_thread(out.close)
+            if self.filename is None:
+                raise HTTPException(status_code=400, detail='No PDF in the "file" form field.')
+        except BaseException:
+            if os.path.exists(self.upload_path):
+                os.remove(self.upload_path)
+            raise
+
+async def receive_upload(request: Request, upload_path: str) -> UploadReceiver:
+    """Stream the request's PDF to `upload_path`; the receiver holds its filename and form fields"""
+    receiver = UploadReceiver(upload_path)
+    await receiver.receive(request)
+    return receiver
@@ -43,6 +43,38 @@ interface ApiResponse {
   error?: string;
 }
 
+type PartKey = 'part1' | 'part2' | 'part3';
+type PartItem = NonNullable<NonNullable<ParsedData[PartKey]>['partItems']>[number];
+
+// Events sent by the backend's /parse/stream endpoint (one JSON object per line)
+type StreamEvent =
+  | { type: 'job'; job_id: string }
+  | { type: 'chunk'; chunk: number; total: number; section?: string; name?: string; parts: Record<PartKey, PartItem[]> }
+  | ({ type: 'result' } & ApiResponse);
+
+const PART_KEYS: PartKey[] = ['part1', 'part2', 'part3'];
+
+// Fold one chunk's items into the partial document, keeping the first item seen per index
+function mergeChunk(doc: ParsedData, event: Extract<StreamEvent, { type: 'chunk' }>): ParsedData {
+  const next: ParsedData = {
+    ...doc,
+    section: doc.section || event.section,
+    name: doc.name || event.name,
+  };
+  for (const key of PART_KEYS) {
+    const items = [...(doc[key]?.partItems ?? [])];
+    const seen = new Set(items.map((item) => item.index));
+    for (const item of event.parts?.[key] ?? []) {
+      if (!seen.has(item.index)) {
+        items.push(item);
+        seen.add(item.index);
+      }
+    }
+    next[key] = { partItems: items };
+  }
+  return next;
+}
+
 export default function Home() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [isLoading, setIsLoading] = useState(false);
@@ -72,24 +104,48 @@ export default function Home() {
       const formData = new FormData();
       formData.append('file', selectedFile);
 
-      const response = await fetch('http://localhost:8000/parse', {
+      const response = await fetch('http://localhost:8000/parse/stream', {
         method: 'POST',
         body: formData,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const result: ApiResponse = await response.json();
-      
-      if (result.success && result.data) {
+      // Show each chunk's sections as soon as the backend finishes them
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let partial: ParsedData = {};
+      let result: ApiResponse | null = null;
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const event: StreamEvent = JSON.parse(line);
+          if (event.type === 'chunk') {
+            partial = mergeChunk(partial, event);
+            setJsonData(partial);
+          } else if (event.type === 'result') {
+            result = event;
+          }
+        }
+      }
+
+      if (result?.success && result.data) {
         setJsonData(result.data);
       } else {
-        throw new Error(result.error || 'Failed to parse PDF');
+        throw new Error(result?.error || 'Failed to parse PDF');
       }
     } catch (err) {
       console.error('Error parsing PDF:', err);
+      setJsonData(null);
       setError(err instanceof Error ? err.message : 'An unexpected error occurred');
     } finally {
       setIsLoading(false);
@@ -222,9 +278,9 @@ export default function Home() {
             )}
           </AnimatePresence>
 
-          {/* JSON Output */}
+          {/* JSON Output (partial while chunks are still streaming in) */}
           <AnimatePresence>
-            {jsonData && !isLoading && (
+            {jsonData && (
               <motion.div
                 initial={{ opacity: 0, y: 40, scale: 0.95 }}
                 animate={{ opacity: 1, y: 0, scale: 1 }}